@@ -0,0 +1,139 @@
+"""
+Time of the user lookups done to start a process, looking up each with pwd and
+scanning every group for the user's groups (as before) and with the
+IdentityCache. The group database is this system's, then a generated one of
+thousands of groups, such as a lab machine's LDAP directory would give, read
+in full by each grp.getgrall.
+
+    python -m benchmarks.identity_lookup
+"""
+
+import grp
+import os
+import pwd
+import tempfile
+import time
+from unittest.mock import patch
+
+from further_link.util import user_config
+from further_link.util.user_config import IdentityCache
+
+from .utils import print_table, user
+
+ROUNDS = 200
+GROUPS = (5000, 20000)
+
+# the lookups of ProcessHandler and PyProcessHandler starting a run
+START_LOOKUPS = [
+    "user_exists",
+    "user_exists",
+    "get_home_directory",
+    "get_uid",
+    "get_gid",
+    "get_home_directory",
+    "get_uid",
+    "get_shell",
+    "get_gid",
+    "get_grp_ids",
+    "get_uid",
+]
+
+
+def getpwnam_field(field):
+    def lookup(user):
+        try:
+            return getattr(pwd.getpwnam(user), field)
+        except (KeyError, TypeError):
+            return None
+
+    return lookup
+
+
+def uncached_grp_ids(user):
+    try:
+        groups = [g.gr_gid for g in grp.getgrall() if user in g.gr_mem]
+        groups.append(pwd.getpwnam(user).pw_gid)
+        return groups
+    except (KeyError, TypeError):
+        return None
+
+
+UNCACHED = {
+    "user_exists": lambda user: getpwnam_field("pw_name")(user) is not None,
+    "get_uid": getpwnam_field("pw_uid"),
+    "get_gid": getpwnam_field("pw_gid"),
+    "get_home_directory": getpwnam_field("pw_dir"),
+    "get_shell": getpwnam_field("pw_shell"),
+    "get_grp_ids": uncached_grp_ids,
+}
+
+
+def group_file(path, count):
+    # the user is a member of every 100th group
+    with open(path, "w") as file:
+        for i in range(count):
+            members = f"someone,{user}" if i % 100 == 0 else "someone,else"
+            file.write(f"group{i}:x:{100000 + i}:{members}\n")
+
+
+def read_group_file(path):
+    def getgrall():
+        with open(path) as file:
+            return [
+                grp.struct_group((name, pw, int(gid), members.split(",")))
+                for name, pw, gid, members in (
+                    line.rstrip("\n").split(":") for line in file
+                )
+            ]
+
+    return getgrall
+
+
+def per_start(functions):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for name in START_LOOKUPS:
+            functions[name](user)
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def measure():
+    uncached = per_start(UNCACHED)
+
+    user_config.identities = IdentityCache()
+    start = time.perf_counter()
+    user_config.get_grp_ids(user)
+    first = time.perf_counter() - start
+    cached = per_start({name: getattr(user_config, name) for name in START_LOOKUPS})
+    return uncached, first, cached
+
+
+def ms(seconds):
+    return f"{seconds * 1000:.3f}"
+
+
+def main():
+    rows = []
+    uncached, first, cached = measure()
+    rows.append(("this system", len(grp.getgrall()), uncached, first, cached))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in GROUPS:
+            path = os.path.join(directory, "group")
+            group_file(path, count)
+            with patch("grp.getgrall", read_group_file(path)):
+                # os.getgrouplist asks the system, so give the cache this
+                # database's groups the way the scan finds them
+                with patch("os.getgrouplist", lambda user, gid: uncached_grp_ids(user)):
+                    uncached, first, cached = measure()
+            rows.append(("generated", count, uncached, first, cached))
+
+    print(f"{len(START_LOOKUPS)} lookups per start, {ROUNDS} starts")
+    print_table(
+        ("groups", "count", "uncached ms", "cache first ms", "cached ms"),
+        [(name, count, ms(u), ms(f), ms(c)) for name, count, u, f, c in rows],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Encode and decode time of the messages sent and received most often, with the
+json module as before and with each json_codec backend.
+
+    python -m benchmarks.json_codec
+"""
+
+import json
+import os
+import timeit
+from base64 import b64encode
+from unittest.mock import patch
+
+from further_link.util import json_codec
+from further_link.util.message import create_message, parse_message
+
+from .utils import print_table
+
+CLIENT = "3f0c2d4e-8b1a-4c5d-9e6f-7a8b9c0d1e2f"
+NUMBER = 2000
+
+SENT = {
+    "keystroke echo": ("stdout", CLIENT, {"output": "a"}, "1"),
+    "output line": (
+        "stdout",
+        CLIENT,
+        {"output": "epoch 12 loss 0.0231 accuracy 0.9812\r\n"},
+        "1",
+    ),
+    "bulk output": ("stdout", CLIENT, {"output": "0123456789abcdef\n" * 240}, "1"),
+    "stopped": ("stopped", CLIENT, {"exitCode": 0}, "1"),
+    "video frame": (
+        "video",
+        CLIENT,
+        {"output": b64encode(os.urandom(20000)).decode()},
+        "1",
+    ),
+}
+
+RECEIVED = {
+    "stdin keystroke": ("stdin", CLIENT, {"input": "a"}, "1"),
+    "keyevent": ("keyevent", CLIENT, {"key": "ArrowUp", "event": "keydown"}, "1"),
+    "resize": ("resize", CLIENT, {"rows": 24, "cols": 80}, "1"),
+    "start": (
+        "start",
+        CLIENT,
+        {"runner": "python3", "code": "print('hello world')\n" * 100},
+        "1",
+    ),
+}
+
+
+def old_create_message(msg_type, msg_client, msg_data=None, msg_process=None):
+    return json.dumps(
+        {
+            "type": msg_type,
+            "data": msg_data,
+            "client": msg_client,
+            "process": msg_process,
+        }
+    )
+
+
+def us(function, *args):
+    seconds = min(timeit.repeat(lambda: function(*args), number=NUMBER, repeat=5))
+    return f"{seconds / NUMBER * 1e6:.2f}"
+
+
+def with_backend(backend, function, *args):
+    with patch.multiple(
+        json_codec,
+        encode_string=backend.encode_string,
+        dumps=backend.dumps,
+        loads=backend.loads,
+    ):
+        return us(function, *args)
+
+
+def main():
+    backends = [json_codec.StdlibJson()]
+    try:
+        import orjson
+
+        backends.append(json_codec.Orjson(orjson))
+    except ImportError:
+        pass
+    names = [backend.name for backend in backends]
+
+    rows = []
+    for name, message in SENT.items():
+        assert create_message(*message) == old_create_message(*message)
+        rows.append(
+            (
+                name,
+                len(create_message(*message)),
+                us(old_create_message, *message),
+                *(with_backend(b, create_message, *message) for b in backends),
+            )
+        )
+    print_table(("sent", "bytes", "json.dumps us", *(f"{n} us" for n in names)), rows)
+    print()
+
+    rows = []
+    for name, message in RECEIVED.items():
+        encoded = create_message(*message)
+        rows.append(
+            (
+                name,
+                len(encoded),
+                us(json.loads, encoded),
+                *(with_backend(b, parse_message, encoded) for b in backends),
+            )
+        )
+    print_table(
+        ("received", "bytes", "json.loads us", *(f"{n} us" for n in names)), rows
+    )
+
+
+if __name__ == "__main__":
+    main()
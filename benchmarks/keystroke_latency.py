@@ -0,0 +1,92 @@
+"""
+Keystroke round trip latency of a ShellProcessHandler pty run, and the rate of
+messages while the shell prints bulk output, comparing a fixed 0.1s flush
+window (as before) with the adaptive FlushPolicy.
+
+    python -m benchmarks.keystroke_latency
+"""
+
+import asyncio
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from further_link.util.async_helpers import FlushPolicy, ringbuf_read
+
+from .pty_echo import drain, keystroke, start_shell
+from .utils import print_table
+
+ROUNDS = 30
+BULK_COMMAND = "timeout 3 yes\n"  # sustained output for 3 seconds
+
+
+def with_policy(**limits):
+    async def read(*args, **kwargs):
+        await ringbuf_read(*args, flush_policy=FlushPolicy(**limits), **kwargs)
+
+    return read
+
+
+async def bulk_output(handler):
+    drain(handler)
+    await handler.send_input(BULK_COMMAND)
+    messages = 0
+    start = time.perf_counter()
+    last = start
+    # the output is done when nothing more arrives for a while
+    while True:
+        try:
+            last, _ = await asyncio.wait_for(handler.output.get(), 0.5)
+        except asyncio.TimeoutError:
+            break
+        messages += 1
+    return messages, last - start
+
+
+async def measure(work_dir):
+    handler = await start_shell(work_dir)
+    await asyncio.sleep(1)  # let the shell print its prompt
+    drain(handler)
+
+    latencies = []
+    for _ in range(ROUNDS):
+        latencies.append(await keystroke(handler))
+        await asyncio.sleep(0.2)  # typing speed
+        drain(handler)
+    await handler.send_input("\x15")  # clear the typed line
+
+    messages, duration = await bulk_output(handler)
+
+    await handler.stop()
+    await asyncio.sleep(0.5)
+    return latencies, messages, duration
+
+
+async def main():
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, limits in (
+            ("fixed 0.1s", {"min_window": 0.1, "max_window": 0.1}),
+            ("adaptive", {}),
+        ):
+            with patch(
+                "further_link.runner.process_handler.ringbuf_read",
+                with_policy(**limits),
+            ):
+                latencies, messages, duration = await measure(work_dir)
+            ms = sorted(latency * 1000 for latency in latencies)
+            rows.append(
+                (
+                    name,
+                    f"{statistics.median(ms):.1f}",
+                    f"{ms[int(len(ms) * 0.95) - 1]:.1f}",
+                    f"{messages / duration:.1f}",
+                )
+            )
+
+    print_table(("flush window", "echo p50 ms", "echo p95 ms", "bulk messages/s"), rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
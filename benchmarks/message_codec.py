@@ -0,0 +1,68 @@
+"""
+Size and encode plus decode time of typical messages, comparing JSON messages
+with the binary codec, once the session's ids have been interned.
+
+    python -m benchmarks.message_codec
+"""
+
+import os
+import time
+from base64 import b64encode
+
+from further_link.util.message import BinaryCodec, JsonCodec
+
+from .utils import print_table
+
+CLIENT = "3f0c2d4e-8b1a-4c5d-9e6f-7a8b9c0d1e2f"
+PROCESS = "a1b2c3d4"
+ROUNDS = 2000
+
+MESSAGES = {
+    "keystroke echo": ("stdout", {"output": "a"}),
+    "output line": ("stdout", {"output": "epoch 12 loss 0.0231 accuracy 0.9812\r\n"}),
+    "bulk output": ("stdout", {"output": "0123456789abcdef\n" * 240}),
+    "stopped": ("stopped", {"exitCode": 0}),
+    "video frame": ("video", {"output": b64encode(os.urandom(20000)).decode()}),
+}
+
+
+def measure(codec_class, msg_type, msg_data):
+    encoder = codec_class()
+    decoder = codec_class()
+    # intern the ids, as they would be early in a session
+    decoder.parse_message(encoder.create_message("started", CLIENT, None, PROCESS))
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        message = encoder.create_message(msg_type, CLIENT, msg_data, PROCESS)
+        decoder.parse_message(message)
+    duration = time.perf_counter() - start
+
+    size = len(message if isinstance(message, bytes) else message.encode())
+    return size, duration / ROUNDS * 1e6
+
+
+def main():
+    rows = []
+    for name, (msg_type, msg_data) in MESSAGES.items():
+        json_size, json_us = measure(JsonCodec, msg_type, msg_data)
+        binary_size, binary_us = measure(BinaryCodec, msg_type, msg_data)
+        rows.append(
+            (
+                name,
+                json_size,
+                binary_size,
+                f"{binary_size / json_size:.2f}",
+                f"{json_us:.1f}",
+                f"{binary_us:.1f}",
+            )
+        )
+
+    print_table(
+        ("message", "JSON B", "binary B", "size ratio", "JSON us", "binary us"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
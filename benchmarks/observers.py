@@ -0,0 +1,134 @@
+"""
+CPU time to send a process' output to its owner and 30 observers, encoding each
+message once for all of them and, as separate connections would, once for
+each. Then with one observer which never reads, how long the owner takes to
+receive the output and how much the stalled observer misses.
+
+    python -m benchmarks.observers
+"""
+
+import asyncio
+
+from further_link.endpoint.run import Observer, RunManager
+from further_link.util.message import create_message
+from further_link.util.send_queue import Priority
+
+from .utils import cpu_timer, print_table
+
+CLIENT = "3f0c2d4e-8b1a-4c5d-9e6f-7a8b9c0d1e2f"
+OBSERVERS = 30
+MESSAGES = 2000
+
+OUTPUTS = {
+    "output line": "epoch 12 loss 0.0231 accuracy 0.9812\r\n",
+    "bulk output": "0123456789abcdef\n" * 240,
+}
+
+
+async def null_send(message):
+    pass
+
+
+async def stalled_send(message):
+    await asyncio.Event().wait()
+
+
+async def null_close():
+    pass
+
+
+def create_run_manager(observer_send_funcs):
+    run_manager = RunManager(null_send, CLIENT)
+    run_manager.process_handlers["1"] = None  # a running process
+    observers = [Observer(send, null_close) for send in observer_send_funcs]
+    for observer in observers:
+        run_manager.add_observer("1", observer)
+    return run_manager, observers
+
+
+async def finish(run_manager, observers):
+    await run_manager.send_queue.join()
+    for observer in observers:
+        await observer.send_queue.join()
+
+
+async def close(run_manager):
+    del run_manager.process_handlers["1"]
+    await run_manager.stop()
+
+
+async def encode_once(output):
+    run_manager, observers = create_run_manager([null_send] * OBSERVERS)
+    with cpu_timer() as t:
+        for _ in range(MESSAGES):
+            await run_manager.send("stdout", {"output": output}, "1")
+        await finish(run_manager, observers)
+    await close(run_manager)
+    return t["cpu"]
+
+
+async def encode_each(output):
+    run_manager, observers = create_run_manager([])
+    observers = [Observer(null_send, null_close) for _ in range(OBSERVERS)]
+    with cpu_timer() as t:
+        for _ in range(MESSAGES):
+            await run_manager.send("stdout", {"output": output}, "1")
+            for observer in observers:
+                message = create_message("stdout", CLIENT, {"output": output}, "1")
+                await observer.send_queue.put(message, Priority.TEXT, ("1", "stdout"))
+        await finish(run_manager, observers)
+    await close(run_manager)
+    for observer in observers:
+        await observer.finish()
+    return t["cpu"]
+
+
+async def stalled(output):
+    send_funcs = [null_send] * (OBSERVERS - 1) + [stalled_send]
+    run_manager, observers = create_run_manager(send_funcs)
+    with cpu_timer() as t:
+        for _ in range(MESSAGES):
+            await run_manager.send("stdout", {"output": output}, "1")
+        await finish(run_manager, observers[:-1])
+    dropped = observers[-1].send_queue.stats()["text"]["dropped"]
+    await close(run_manager)
+    return t["wall"], dropped
+
+
+def us(seconds):
+    return f"{seconds / MESSAGES * 1e6:.1f}"
+
+
+async def main():
+    rows = []
+    for name, output in OUTPUTS.items():
+        once = await encode_once(output)
+        each = await encode_each(output)
+        wall, dropped = await stalled(output)
+        rows.append(
+            (
+                name,
+                len(output),
+                us(each),
+                us(once),
+                us(wall),
+                f"{dropped}/{MESSAGES}",
+            )
+        )
+
+    print(f"1 owner, {OBSERVERS} observers, {MESSAGES} messages")
+    print_table(
+        (
+            "output",
+            "bytes",
+            "encode each CPU us",
+            "encode once CPU us",
+            "1 stalled wall us",
+            "stalled dropped",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
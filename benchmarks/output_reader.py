@@ -0,0 +1,144 @@
+"""
+Task allocations and CPU per MB of process output through
+ProcessHandler._handle_output, comparing the previous reader, which raced a
+pair of new tasks for every chunk read, with the current RingbufReader.
+
+    python -m benchmarks.output_reader
+"""
+
+import asyncio
+from collections import deque
+from unittest.mock import patch
+
+from further_link.runner.process_handler import ProcessHandler
+from further_link.util.async_helpers import loop_forever, race, stream_read
+from further_link.util.rate_limit import BandwidthBudget
+
+from .utils import MB, TaskCounter, cpu_timer, print_table, user
+
+TOTAL_BYTES = 4 * MB
+WRITE_SIZE = 256
+
+
+async def legacy_ringbuf_read(
+    stream,
+    output_callback=None,
+    done_condition=loop_forever,
+    kBps=0,
+    **kwargs,
+):
+    # the per chunk task racing implementation, kept for comparison. It
+    # predates the limiter and the reader's other options, which are ignored,
+    # so it runs unlimited as the current reader does with BandwidthBudget(0)
+    buffer_time = 0.1
+    chunk_size = 256
+    max_chunks = None if kBps == 0 else int(kBps * buffer_time * 1000 / chunk_size)
+    ringbuf = deque(maxlen=max_chunks)
+    completed = False
+
+    async def read():
+        nonlocal completed
+        while True:
+            read_data = asyncio.create_task(stream_read(stream, chunk_size))
+            wait_done = asyncio.create_task(done_condition())
+            done = await race([read_data, wait_done])
+            if read_data not in done:
+                completed = True
+                break
+            result = read_data.result()
+            if result == b"":
+                completed = True
+                break
+            ringbuf.append(result)
+
+    async def write():
+        nonlocal completed
+        while True:
+            try:
+                await asyncio.wait_for(done_condition(), timeout=buffer_time)
+                completed = True
+            except asyncio.TimeoutError:
+                pass
+            data = b"".join(ringbuf)
+            if data:
+                ringbuf.clear()
+                if output_callback:
+                    await output_callback(data.decode(encoding="utf-8"))
+            if completed:
+                break
+
+    return await asyncio.wait(
+        [asyncio.create_task(read()), asyncio.create_task(write())]
+    )
+
+
+class FakeProcess:
+    def __init__(self):
+        self.exited = asyncio.Event()
+
+    async def wait(self):
+        await self.exited.wait()
+        return 0
+
+
+async def produce(stream):
+    chunk = b"x" * (WRITE_SIZE - 1) + b"\n"
+    for _ in range(TOTAL_BYTES // WRITE_SIZE):
+        stream.feed_data(chunk)
+        # yield so the reader wakes per write, like a chatty process would
+        await asyncio.sleep(0)
+    # the process is left running, so the reader has to reach EOF to finish
+    stream.feed_eof()
+
+
+async def measure():
+    # unlimited bandwidth, to measure the reader rather than the limiter
+    handler = ProcessHandler(user, bandwidth_budget=BandwidthBudget(0))
+    handler.process = FakeProcess()
+    received = 0
+
+    async def on_output(channel, output):
+        nonlocal received
+        received += len(output)
+
+    handler.on_output = on_output
+    stream = asyncio.StreamReader()
+
+    counter = TaskCounter()
+    with counter.counting(), cpu_timer() as timing:
+        producer = asyncio.create_task(produce(stream))
+        await handler._handle_output(stream, "stdout")
+        await producer
+
+    return counter.count, timing, received
+
+
+async def main():
+    rows = []
+    for name, implementation in (
+        ("racing (before)", legacy_ringbuf_read),
+        ("RingbufReader", None),
+    ):
+        if implementation is None:
+            tasks, timing, received = await measure()
+        else:
+            with patch(
+                "further_link.runner.process_handler.ringbuf_read", implementation
+            ):
+                tasks, timing, received = await measure()
+        mb = received / MB
+        rows.append(
+            (
+                name,
+                f"{mb:.1f}",
+                tasks,
+                f"{tasks / mb:.0f}",
+                f"{timing['cpu'] / mb * 1000:.1f}",
+            )
+        )
+
+    print_table(("reader", "MB", "tasks", "tasks/MB", "cpu ms/MB"), rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
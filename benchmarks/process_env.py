@@ -0,0 +1,112 @@
+"""
+Spawn latency of ProcessHandler, building each process's environment from
+os.environ, passwd and the displays (as before) and from the
+EnvironmentTemplates: the time to build the environment alone, and to start a
+process and have it exit.
+
+    python -m benchmarks.process_env
+"""
+
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from further_link.runner import process_handler
+from further_link.runner.process_handler import ProcessHandler
+from further_link.util.environment import EnvironmentTemplates
+from further_link.util.sdk import get_first_display
+from further_link.util.user_config import (
+    get_home_directory,
+    get_shell,
+    get_xdg_runtime_dir,
+)
+
+from .utils import print_table, user
+
+BUILD_ROUNDS = 5000
+SPAWN_ROUNDS = 50
+
+
+def uncached_environment(user, work_dir, env={}, display=None):
+    process_env = {**os.environ.copy(), **env}
+    process_env["TERM"] = "xterm-256color"
+    if user:
+        process_env["USER"] = user
+        process_env["LOGNAME"] = user
+        process_env["HOME"] = get_home_directory(user)
+        process_env["XDG_RUNTIME_DIR"] = get_xdg_runtime_dir(user)
+        process_env["SHELL"] = get_shell(user)
+        process_env["PWD"] = work_dir
+        process_env = {k: v for k, v in process_env.items() if v is not None}
+    if display is not None:
+        process_env["DISPLAY"] = display
+    else:
+        default_display = get_first_display()
+        if default_display:
+            process_env["DISPLAY"] = default_display
+    return process_env
+
+
+def build_time(build):
+    env = {"VIRTUAL_ENV": "/venv"}
+    start = time.perf_counter()
+    for _ in range(BUILD_ROUNDS):
+        build(user, "/work", env)
+    return (time.perf_counter() - start) / BUILD_ROUNDS
+
+
+async def spawn(work_dir):
+    handler = ProcessHandler(user)
+    stopped = asyncio.Event()
+
+    async def on_output(channel, message):
+        pass
+
+    async def on_stop(exit_code):
+        stopped.set()
+
+    handler.on_start = None
+    handler.on_output = on_output
+    handler.on_stop = on_stop
+
+    start = time.perf_counter()
+    await handler.start("true", work_dir)
+    elapsed = time.perf_counter() - start
+    await stopped.wait()
+    return elapsed
+
+
+async def spawn_time(work_dir):
+    return statistics.median([await spawn(work_dir) for _ in range(SPAWN_ROUNDS)])
+
+
+def us(seconds):
+    return f"{seconds * 1000000:.1f}"
+
+
+async def main():
+    templates = EnvironmentTemplates()
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, build in (
+            ("uncached", uncached_environment),
+            ("templates", templates.environment),
+        ):
+            with patch.object(
+                process_handler, "environments", SimpleNamespace(environment=build)
+            ):
+                rows.append((name, build_time(build), await spawn_time(work_dir)))
+
+    print(f"{len(os.environ)} variables, spawn is the median of {SPAWN_ROUNDS}")
+    print_table(
+        ("environment", "build us", "spawn us"),
+        [(name, us(build), us(spawn)) for name, build, spawn in rows],
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Bandwidth used by a program redrawing coloured progress bars with carriage
+returns, between lines of useful output, run by a ProcessHandler on the 8kBps
+Bluetooth budget with and without compactOutput.
+
+    python -m benchmarks.progress_output
+"""
+
+import asyncio
+import shlex
+import sys
+import tempfile
+
+from further_link.runner.process_handler import ProcessHandler
+from further_link.util.connection_types import ConnectionType
+
+from .utils import print_table, user
+
+EPOCHS = 10
+
+CODE = f"""
+import time
+for epoch in range({EPOCHS}):
+    for step in range(501):
+        done = step // 20
+        bar = "\\x1b[32m" + "━" * done + "\\x1b[0m" + " " * (25 - done)
+        print(f"\\r\\x1b[2K{{bar}} {{step / 5:5.1f}}%", end="", flush=True)
+        time.sleep(0.0005)
+    print(f"\\nepoch {{epoch}} loss {{1 / (epoch + 1):.4f}}", flush=True)
+"""
+
+
+async def measure(compact, work_dir):
+    handler = ProcessHandler(
+        user, connection_type=ConnectionType.BLUETOOTH, compact=compact
+    )
+    sent = []
+    dropped = 0
+    stopped = asyncio.Event()
+
+    async def on_output(channel, output):
+        sent.append(output)
+
+    async def on_dropped(channel, dropped_bytes, dropped_chunks):
+        nonlocal dropped
+        dropped += dropped_bytes
+
+    async def on_stop(exit_code):
+        stopped.set()
+
+    async def noop(*args):
+        pass
+
+    handler.on_start = noop
+    handler.on_stop = on_stop
+    handler.on_output = on_output
+    handler.on_dropped = on_dropped
+    await handler.start(f"{sys.executable} -c {shlex.quote(CODE)}", work_dir)
+    await stopped.wait()
+
+    output = "".join(sent)
+    epochs = sum(f"epoch {i} loss" in output for i in range(EPOCHS))
+    return len(output.encode()), dropped, epochs
+
+
+async def main():
+    rows = []
+    for compact in (False, True):
+        with tempfile.TemporaryDirectory() as work_dir:
+            sent, dropped, epochs = await measure(compact, work_dir)
+        rows.append(
+            (
+                "on" if compact else "off",
+                f"{sent / 1000:.1f}",
+                f"{dropped / 1000:.1f}",
+                f"{epochs}/{EPOCHS}",
+            )
+        )
+
+    print_table(("compactOutput", "sent kB", "dropped kB", "epoch lines"), rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
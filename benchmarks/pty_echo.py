@@ -0,0 +1,160 @@
+"""
+Keystroke echo latency of ShellProcessHandler pty runs, with a few and with
+many runs open at once, comparing pty reads and writes in the default thread
+pool (as aiofiles did) against PtyStream on the event loop.
+
+    python -m benchmarks.pty_echo
+"""
+
+import asyncio
+import os
+import select
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from further_link.runner.shell_process_handler import ShellProcessHandler
+
+from .utils import print_table, user
+
+ROUNDS = 20
+
+
+class ThreadPoolPty:
+    # each read and write hops to the default executor, like aiofiles. a read
+    # occupies its thread until data arrives, as a blocking read would, but
+    # polls so the benchmark can exit after the pty is closed
+    def __init__(self, fd):
+        self._fd = fd
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+
+    def fileno(self):
+        return self._fd
+
+    def _blocking_read(self, n):
+        while not self._closed:
+            readable, _, _ = select.select([self._fd], [], [], 0.1)
+            if readable:
+                return os.read(self._fd, n)
+        return b""
+
+    async def read(self, n):
+        try:
+            return await self._loop.run_in_executor(None, self._blocking_read, n)
+        except (OSError, ValueError):
+            return b""
+
+    async def write(self, data):
+        await self._loop.run_in_executor(None, os.write, self._fd, data)
+
+    def close(self):
+        self._closed = True
+        os.close(self._fd)
+
+
+async def start_shell(work_dir):
+    handler = ShellProcessHandler(user, pty=True)
+    handler.output = asyncio.Queue()
+
+    async def on_output(channel, output):
+        handler.output.put_nowait((time.perf_counter(), output))
+
+    async def noop(*args):
+        pass
+
+    handler.on_start = noop
+    handler.on_stop = noop
+    handler.on_output = on_output
+    await handler.start(work_dir)
+    return handler
+
+
+def drain(handler):
+    while not handler.output.empty():
+        handler.output.get_nowait()
+
+
+async def keystroke(handler):
+    async def echo():
+        await handler.send_input("a")
+        return await handler.output.get()
+
+    sent = time.perf_counter()
+    received, _ = await asyncio.wait_for(echo(), 1)
+    return received - sent
+
+
+async def measure(runs, work_dir):
+    executor_calls = 0
+    loop = asyncio.get_running_loop()
+    run_in_executor = loop.run_in_executor
+
+    def counting_run_in_executor(*args):
+        nonlocal executor_calls
+        executor_calls += 1
+        return run_in_executor(*args)
+
+    handlers = [await start_shell(work_dir) for _ in range(runs)]
+    await asyncio.sleep(1)  # let the shells print their prompts
+    for handler in handlers:
+        drain(handler)
+
+    latencies = []
+    loop.run_in_executor = counting_run_in_executor
+    try:
+        for _ in range(ROUNDS):
+            try:
+                results = await asyncio.gather(*(keystroke(h) for h in handlers))
+            except asyncio.TimeoutError:
+                # no echo within a second, the runs are starved of threads
+                latencies.append(float("inf"))
+                break
+            latencies.extend(results)
+            await asyncio.sleep(0.05)
+            for handler in handlers:
+                drain(handler)
+    finally:
+        del loop.run_in_executor
+
+    for handler in handlers:
+        await handler.stop()
+    await asyncio.sleep(0.5)
+
+    return latencies, executor_calls
+
+
+async def main():
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for runs in (1, 4, 16):
+            for name, pty_class in (
+                ("thread pool", ThreadPoolPty),
+                ("PtyStream", None),
+            ):
+                if pty_class is None:
+                    latencies, calls = await measure(runs, work_dir)
+                else:
+                    with patch(
+                        "further_link.runner.process_handler.PtyStream", pty_class
+                    ):
+                        latencies, calls = await measure(runs, work_dir)
+                ms = sorted(latency * 1000 for latency in latencies)
+                rows.append(
+                    (
+                        runs,
+                        name,
+                        f"{statistics.median(ms):.1f}",
+                        f"{ms[int(len(ms) * 0.95) - 1]:.1f}",
+                        calls,
+                    )
+                )
+
+    print_table(
+        ("open runs", "pty io", "echo p50 ms", "echo p95 ms", "executor calls"), rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Time to the first output of PyProcessHandler runs of code which imports the
+modules the zygote preloads (those of pitop, numpy and PIL which are
+installed), started with a new python3 interpreter and forked from the zygote.
+
+    python -m benchmarks.python_startup
+"""
+
+import asyncio
+import importlib.util
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from further_link.runner.py_process_handler import PyProcessHandler
+from further_link.runner.zygote import DEFAULT_PRELOAD, get_zygote, stop_zygotes
+
+from .utils import print_table, user
+
+ROUNDS = 10
+
+PRELOAD = [m for m in DEFAULT_PRELOAD if importlib.util.find_spec(m)]
+
+
+async def first_output(work_dir, code):
+    handler = PyProcessHandler(user)
+    output = asyncio.Event()
+    stopped = asyncio.Event()
+
+    async def on_output(channel, message):
+        output.set()
+
+    async def on_stop(exit_code):
+        stopped.set()
+
+    handler.on_start = None
+    handler.on_output = on_output
+    handler.on_stop = on_stop
+
+    start = time.perf_counter()
+    await handler.start(work_dir, code)
+    await output.wait()
+    elapsed = time.perf_counter() - start
+    await stopped.wait()
+    return elapsed
+
+
+async def measure(work_dir, code):
+    return [await first_output(work_dir, code) for _ in range(ROUNDS)]
+
+
+async def main():
+    code = "".join(f"import {m}\n" for m in PRELOAD) + "print('ready')\n"
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        with patch.dict(os.environ, {"FURTHER_LINK_PY_PRELOAD": ",".join(PRELOAD)}):
+            with patch.dict(os.environ, {"FURTHER_LINK_PY_ZYGOTE": "0"}):
+                rows.append(("cold python3", await measure(work_dir, code)))
+
+            with patch.dict(os.environ, {"FURTHER_LINK_PY_ZYGOTE": "1"}):
+                start = time.perf_counter()
+                await get_zygote(shutil.which("python3"))
+                preload = time.perf_counter() - start
+                rows.append(("warm zygote", await measure(work_dir, code)))
+                await stop_zygotes()
+
+    print(f"imports {', '.join(PRELOAD) or 'nothing'}, {ROUNDS} runs each")
+    print(f"zygote started and preloaded in {preload * 1000:.0f} ms")
+    print_table(
+        ("start", "median ms", "min ms", "max ms"),
+        [
+            (
+                name,
+                f"{statistics.median(times) * 1000:.1f}",
+                f"{min(times) * 1000:.1f}",
+                f"{max(times) * 1000:.1f}",
+            )
+            for name, times in rows
+        ],
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Decoding high volume non-ASCII output, emoji progress bars, read in pieces
+which split characters. Compares the previous reader, which joined and decoded
+the whole ring buffer on every flush, with the incremental decoding
+RingbufReader, unlimited and when dropping output to a rate limit.
+
+    python -m benchmarks.utf8_output
+"""
+
+import asyncio
+
+from further_link.util.async_helpers import ringbuf_read
+
+from .output_reader import legacy_ringbuf_read
+from .utils import MB, cpu_timer, print_table
+
+TOTAL_BYTES = 4 * MB
+FEED_SIZE = 1000  # not a multiple of any character's length
+
+
+def progress_bars():
+    lines = []
+    for percent in range(101):
+        done = percent // 4
+        bar = "🟩" * done + "⬜" * (25 - done)
+        lines.append(f"\r🚀 [{bar}] {percent:3d}% ⏳")
+    data = "".join(lines).encode()
+    return data * (TOTAL_BYTES // len(data) + 1)
+
+
+async def measure(read, data, kBps):
+    stream = asyncio.StreamReader()
+    received = []
+
+    async def on_output(output):
+        received.append(output)
+
+    error = ""
+    with cpu_timer() as timing:
+        reader = asyncio.ensure_future(read(stream, on_output, kBps=kBps))
+        for i in range(0, len(data), FEED_SIZE):
+            stream.feed_data(data[i : i + FEED_SIZE])
+            await asyncio.sleep(0)
+        stream.feed_eof()
+        result = await reader
+        # the previous reader returns its tasks, which may have failed
+        for task in result[0] if isinstance(result, tuple) else ():
+            if task.exception():
+                error = type(task.exception()).__name__
+
+    output = "".join(received)
+    return timing, output, error
+
+
+async def main():
+    data = progress_bars()
+    rows = []
+    for kBps in (0, 128):
+        for name, read in (
+            ("join + decode", legacy_ringbuf_read),
+            ("incremental", ringbuf_read),
+        ):
+            timing, output, error = await measure(read, data, kBps)
+            rows.append(
+                (
+                    kBps or "unlimited",
+                    name,
+                    f"{timing['cpu'] * 1000 / (len(data) / MB):.1f}",
+                    f"{len(output.encode()) / MB:.2f}",
+                    output.count("\ufffd"),
+                    error or "-",
+                )
+            )
+
+    print_table(
+        ("kBps", "decode", "CPU ms/MB", "MB out", "replaced chars", "error"), rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+import asyncio
+import getpass
+import time
+from contextlib import contextmanager
+
+user = getpass.getuser()
+
+MB = 1024 * 1024
+
+
+class TaskCounter:
+    """Counts the tasks created on the running loop while active."""
+
+    def __init__(self):
+        self.count = 0
+
+    @contextmanager
+    def counting(self):
+        loop = asyncio.get_running_loop()
+        previous = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            self.count += 1
+            if previous is not None:
+                return previous(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+
+        loop.set_task_factory(factory)
+        try:
+            yield self
+        finally:
+            loop.set_task_factory(previous)
+
+
+@contextmanager
+def cpu_timer():
+    """Measures process CPU and wall time of the block, in seconds."""
+    result = {}
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["cpu"] = time.process_time() - cpu_start
+        result["wall"] = time.perf_counter() - wall_start
+
+
+def print_table(headers, rows):
+    widths = [
+        max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)
+    ]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
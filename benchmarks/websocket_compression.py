@@ -0,0 +1,90 @@
+"""
+Compression ratio and CPU cost of permessage-deflate on a typical /run
+message stream, echoed keystrokes, lines of a training loop's output and some
+bulk output, for several compression settings.
+
+    python -m benchmarks.websocket_compression
+"""
+
+import asyncio
+import random
+
+from further_link.util.compression import CompressionSettings, DeflateSender
+from further_link.util.message import create_message
+
+from .utils import print_table
+
+CLIENT = "3f0c2d4e-8b1a-4c5d-9e6f-7a8b9c0d1e2f"
+
+
+class NullTransport:
+    def write(self, frame):
+        pass
+
+    def is_closing(self):
+        return False
+
+
+class NullSocket:
+    closed = False
+    _closing = False
+
+
+class NullWriter:
+    transport = NullTransport()
+
+    async def drain(self):
+        pass
+
+
+def message_stream():
+    rng = random.Random(0)
+    messages = []
+    for epoch in range(200):
+        for key in "print(x)\r":
+            messages.append(create_message("stdin", CLIENT, {"input": key}, "1"))
+            messages.append(create_message("stdout", CLIENT, {"output": key}, "1"))
+        line = f"epoch {epoch} loss {rng.random():.4f} accuracy {rng.random():.4f}\r\n"
+        messages.append(create_message("stdout", CLIENT, {"output": line}, "1"))
+        if epoch % 20 == 0:
+            bulk = "".join(f"{i} {rng.random()}\n" for i in range(150))
+            messages.append(create_message("stdout", CLIENT, {"output": bulk}, "1"))
+    return messages
+
+
+async def measure(messages, settings, no_context_takeover=False):
+    sender = DeflateSender(
+        NullSocket(), NullWriter(), settings, no_context_takeover=no_context_takeover
+    )
+    for message in messages:
+        await sender.send_str(message)
+    return sender.stats()
+
+
+async def main():
+    messages = message_stream()
+    rows = []
+    for name, settings, no_context_takeover in (
+        ("level 1 (aiohttp)", CompressionSettings(), False),
+        ("level 1 no takeover", CompressionSettings(), True),
+        ("level 6", CompressionSettings(level=6), False),
+        ("level 9", CompressionSettings(level=9), False),
+        ("level 1 window 10", CompressionSettings(window_bits=10), False),
+        ("level 1 threshold 128", CompressionSettings(threshold=128), False),
+    ):
+        stats = await measure(messages, settings, no_context_takeover)
+        rows.append(
+            (
+                name,
+                f"{stats['bytes_in'] / 1000:.0f}",
+                f"{stats['bytes_out'] / 1000:.1f}",
+                f"{stats['ratio']:.3f}",
+                f"{stats['cpu_us_per_kB']:.1f}",
+            )
+        )
+
+    print_table(("settings", "in kB", "out kB", "ratio", "CPU us/kB"), rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
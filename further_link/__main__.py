@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from typing import Optional
@@ -8,11 +9,16 @@ from aiohttp import web
 
 from further_link.endpoint.apt_version import apt_version
 from further_link.endpoint.run import run as run_handler
-from further_link.endpoint.status import status, version
+from further_link.endpoint.status import stats, status, version
 from further_link.endpoint.upload import upload
+from further_link.runner.display_pool import vnc_pool_size
+from further_link.runner.process_handler import display_pool
+from further_link.runner.py_process_handler import start_python_zygote
+from further_link.runner.zygote import python_zygote_enabled, stop_zygotes
 from further_link.util import vnc
 from further_link.util.bluetooth.device import BluetoothDevice
 from further_link.util.bluetooth.server import BluetoothServer
+from further_link.util.sdk import display_users
 from further_link.util.ssl_context import ssl_context
 
 logging.basicConfig()
@@ -51,6 +57,29 @@ async def create_web_app():
 
     app.on_response_prepare.append(set_extra_cors_headers)
 
+    if python_zygote_enabled():
+        # preload in the background, so as not to hold up starting
+
+        async def start_zygote(app):
+            asyncio.ensure_future(start_python_zygote())
+
+        async def stop_zygote(app):
+            await stop_zygotes()
+
+        app.on_startup.append(start_zygote)
+        app.on_cleanup.append(stop_zygote)
+
+    if vnc_pool_size() > 0:
+
+        async def start_display_pool(app):
+            display_pool.start()
+
+        async def stop_display_pool(app):
+            await display_pool.stop()
+
+        app.on_startup.append(start_display_pool)
+        app.on_cleanup.append(stop_display_pool)
+
     cors = aiohttp_cors.setup(
         app,
         defaults={
@@ -65,6 +94,9 @@ async def create_web_app():
     status_resource = cors.add(app.router.add_resource("/status"))
     cors.add(status_resource.add_route("GET", status))
 
+    status_resource = cors.add(app.router.add_resource("/stats"))
+    cors.add(status_resource.add_route("GET", stats))
+
     status_resource = cors.add(app.router.add_resource("/version/apt/{pkg}"))
     cors.add(status_resource.add_route("GET", apt_version))
 
@@ -81,6 +113,8 @@ async def create_web_app():
 
 
 async def create_app():
+    # the user of the display is kept up to date from here on
+    await display_users.refresh()
     await create_bluetooth_app()
     app = await create_web_app()
     return app
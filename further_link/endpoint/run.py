@@ -1,18 +1,41 @@
 import asyncio
 import logging
-from typing import Callable, Dict, Optional
+import os
+import secrets
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
 
 from aiohttp import web
 from pt_web_vnc.connection_details import VncConnectionDetails
 
 from ..runner.exec_process_handler import ExecProcessHandler
+from ..runner.kernel_process_handler import KernelProcessHandler
 from ..runner.process_handler import InvalidOperation
 from ..runner.py_process_handler import PyProcessHandler
 from ..runner.shell_process_handler import ShellProcessHandler
+from ..util import stats
 from ..util.bluetooth.utils import bytearray_to_dict
-from ..util.connection_types import ConnectionType
-from ..util.message import BadMessage, create_message, parse_message
+from ..util.compression import CompressionSettings, negotiated_sender
+from ..util.connection_types import (
+    ConnectionType,
+    bandwidth_limits_kBps,
+    bandwidth_ranges_kBps,
+    channel_bandwidth_weights,
+    send_queue_limits_bytes,
+)
+from ..util.message import (
+    BadMessage,
+    BinaryCodec,
+    JsonCodec,
+    create_message,
+    is_binary_message,
+    parse_message,
+)
+from ..util.rate_limit import BandwidthBudget, BandwidthEstimator
+from ..util.scrollback import Scrollback
+from ..util.send_queue import DropPolicy, Priority, SendQueue, drop_policies
 from ..util.user_config import default_user, get_temp_dir
+from ..util.watchdog import Watchdog, get_watchdog
 
 
 class Timer:
@@ -40,6 +63,92 @@ class Timer:
             self._task = None
 
 
+# output soon after input to the same process is likely to be its echo, so is
+# sent ahead of other output
+ECHO_TIME = 0.5
+ECHO_MAX_LENGTH = 256
+
+# messages which aren't kept for, or counted by, clients resuming a connection
+UNNUMBERED_TYPES = ("pong", "video", "session", "resumed")
+
+
+def resume_grace():
+    return float(os.environ.get("FURTHER_LINK_RESUME_GRACE", 60))
+
+
+def estimate_bandwidth():
+    value = os.environ.get("FURTHER_LINK_ESTIMATE_BANDWIDTH", "1")
+    return value.lower() not in ("0", "false")
+
+
+def scrollback_bytes():
+    return int(os.environ.get("FURTHER_LINK_SCROLLBACK_BYTES", 2**18))
+
+
+async def discard(message):
+    pass
+
+
+# observers mustn't hold up the process' owner, so they miss output they can't
+# keep up with, including the echo of the owner's input
+observer_drop_policies = {
+    **drop_policies,
+    Priority.ECHO: DropPolicy.DROP,
+    Priority.TEXT: DropPolicy.DROP,
+}
+
+
+class Observer:
+    """
+    A read only connection receiving the messages of another connection's
+    process, with its own queue so that a slow observer doesn't hold up the
+    owner or other observers. An observer whose queue is full even of the
+    messages which aren't dropped has stalled, and is disconnected.
+    """
+
+    def __init__(self, send_func: Callable, close_func: Callable):
+        self.id = str(id(self))
+        self.send_func = send_func
+        self.close_func = close_func
+        self.send_queue = SendQueue(
+            self._send_messages,
+            send_queue_limits_bytes[ConnectionType.WEBSOCKET],
+            policies=observer_drop_policies,
+        )
+        self._finished = False
+
+    async def _send_messages(self, messages):
+        for message in messages:
+            await self.send_func(message)
+
+    async def put(self, message, priority: Priority, stream=None):
+        if self._finished:
+            return
+        queue = self.send_queue
+        if (
+            queue.policies[priority] == DropPolicy.NEVER
+            and queue.bytes + len(message) > queue.limit_bytes
+        ):
+            logging.info(f"{self.id} Observer stalled, disconnecting")
+            self._finished = True
+            queue.clear()
+            # not waited for, as the owner's messages are sent meanwhile
+            asyncio.ensure_future(self._close())
+            return
+        await queue.put(message, priority, stream)
+
+    async def finish(self):
+        """Send what is queued and close the connection."""
+        if self._finished:
+            return
+        self._finished = True
+        await self._close()
+
+    async def _close(self):
+        await self.send_queue.close()
+        await self.close_func()
+
+
 class RunManager:
     WATCHDOG_TIMEOUT = 10
 
@@ -50,6 +159,11 @@ class RunManager:
         user=None,
         pty=False,
         connection_type: ConnectionType = ConnectionType.WEBSOCKET,
+        channel_weights: Optional[Dict] = None,
+        batch=False,
+        binary=False,
+        compression_stats: Optional[Callable[[], Dict]] = None,
+        resume_grace: float = 0,
     ):
         self.send_func = send_func
         self.client_uuid = client_uuid
@@ -57,30 +171,106 @@ class RunManager:
         self.pty = pty
         self.connection_type = connection_type
 
+        # messages are json unless the client asks for binary, by connecting
+        # with the option or by sending binary messages
+        self.codec = self._binary_codec() if binary else JsonCodec()
+        # messages are sent by the queue's writer, so producers don't wait
+        # for the client. batching sends the messages queued in one event loop
+        # tick, or while the previous frame was sent, in one frame
+        self.batch = batch
+        self.send_queue = SendQueue(
+            self._send_messages,
+            send_queue_limits_bytes[connection_type],
+            batch,
+            on_delivered=self._on_delivered,
+        )
+        self._input_times: Dict = {}
+
+        # all output of the connection's processes shares one bandwidth limit,
+        # which follows the bandwidth measured from sending messages on
+        # connection types whose sends wait for the link
+        kBps = bandwidth_limits_kBps[connection_type]
+        self.bandwidth_budget = BandwidthBudget(
+            kBps, channel_weights or channel_bandwidth_weights
+        )
+        self.bandwidth_estimator = (
+            BandwidthEstimator(
+                kBps,
+                *bandwidth_ranges_kBps[connection_type],
+                on_estimate=self.bandwidth_budget.set_rate,
+            )
+            if kBps
+            and connection_type in bandwidth_ranges_kBps
+            and estimate_bandwidth()
+            else None
+        )
+
         self.id = str(id(self))
         self.process_handlers: Dict = {}
         self.handler_classes = {
             "exec": ExecProcessHandler,
             "python3": PyProcessHandler,
+            "python3-kernel": KernelProcessHandler,
             "shell": ShellProcessHandler,
         }
-        self.message_callbacks: Dict = {}
-
-        self._watchdog_callback: Optional[Callable] = None
-        self._watchdog_timer: Optional[Timer] = None
+        # handlers of each type of message received, and validators of their
+        # data and process, which must be valid for the handler to be called
+        self.message_callbacks: Dict[str, Callable] = {
+            "ping": self._on_ping,
+            "start": self._on_start,
+            "stdin": self._on_stdin,
+            "resize": self._on_resize,
+            "stop": self._on_stop,
+            "keyevent": self._on_keyevent,
+            "execute": self._on_execute,
+            "reset": self._on_reset,
+            "interrupt": self._on_interrupt,
+        }
+        self.message_validators: Dict[str, Callable] = {
+            "start": self._valid_start,
+            "stdin": self._valid_stdin,
+            "resize": self._valid_resize,
+            "stop": lambda data, process_id: self._running(process_id),
+            "keyevent": self._valid_keyevent,
+            "execute": self._valid_execute,
+            "reset": lambda data, process_id: self._running_kernel(process_id),
+            "interrupt": lambda data, process_id: self._running_kernel(process_id),
+        }
+        self.observers: Dict[str, List[Observer]] = {}
+
+        # shared by the connections on the loop, so pings don't create tasks
+        self._watchdog: Optional[Watchdog] = None
+
+        # a resumable RunManager outlives its connection for resume_grace
+        # seconds, keeping its recent messages to send when it's resumed. they
+        # are numbered in the order they are sent, which the queue's priorities
+        # make different from the order they are queued
+        self.resume_grace = resume_grace
+        self.resume_token = secrets.token_urlsafe(16) if resume_grace else None
+        self.scrollback = Scrollback(scrollback_bytes()) if resume_grace else None
+        self.connection = None
+        self.resumes = 0
+        self._resume_timer: Optional[Timer] = None
+
+        self._connected_time = monotonic()
+        self.sent_messages = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        # reported by the transport, if it compresses messages
+        self.compression_stats = compression_stats
+        stats.add_connection(self.id, self.message_stats)
 
     def start_watchdog_timer(self, callback: Callable):
-        self._watchdog_callback = callback
-        self.restart_watchdog_timer()
+        self._watchdog = get_watchdog()
+        self._watchdog.start(self.id, self.WATCHDOG_TIMEOUT, callback)
 
     def stop_watchdog_timer(self):
-        if isinstance(self._watchdog_timer, Timer):
-            self._watchdog_timer.cancel()
+        if self._watchdog:
+            self._watchdog.stop(self.id)
 
     def restart_watchdog_timer(self):
-        self.stop_watchdog_timer()
-        self._watchdog_timer = Timer(self.WATCHDOG_TIMEOUT, self._watchdog_callback)
-        self._watchdog_timer.start()
+        if self._watchdog:
+            self._watchdog.restart(self.id)
 
     async def stop(self):
         # the dictionary will be mutated so use list to make a copy
@@ -90,77 +280,212 @@ class RunManager:
             except InvalidOperation:
                 pass
 
+        await self.send_queue.close()
+        await asyncio.gather(
+            *(o.finish() for observers in self.observers.values() for o in observers)
+        )
+        self.observers.clear()
         self.stop_watchdog_timer()
+        # last, as stop may be called by the resume timer
+        if self._resume_timer:
+            self._resume_timer.cancel()
+        logging.debug(f"{self.id} Bandwidth usage {self.bandwidth_usage()}")
+        logging.debug(f"{self.id} Message stats {self.message_stats()}")
+        stats.remove_connection(self.id)
+
+    def bandwidth_usage(self):
+        return self.bandwidth_budget.usage()
+
+    def message_stats(self):
+        duration = monotonic() - self._connected_time
+        message_stats = {
+            "connection_type": self.connection_type.name.lower(),
+            "batch": self.batch,
+            "resumable": self.scrollback is not None,
+            "resumes": self.resumes,
+            "observers": [
+                o.send_queue.stats()
+                for observers in self.observers.values()
+                for o in observers
+            ],
+            "messages": self.sent_messages,
+            "frames": self.sent_frames,
+            "bytes": self.sent_bytes,
+            "frame_rate": self.sent_frames / duration if duration else 0,
+            "bytes_per_message": (
+                self.sent_bytes / self.sent_messages if self.sent_messages else 0
+            ),
+        }
+        message_stats["queue"] = self.send_queue.stats()
+        message_stats["bandwidth"] = (
+            self.bandwidth_estimator.stats()
+            if self.bandwidth_estimator
+            else {"kBps": self.bandwidth_budget.rate / 1000, "estimates": 0}
+        )
+        if self.compression_stats:
+            message_stats["compression"] = self.compression_stats()
+        return message_stats
+
+    def _binary_codec(self):
+        # every bluetooth client receives every message, so can only learn the
+        # ids interned for its own messages, which doesn't include the client
+        return BinaryCodec(
+            intern_client=self.connection_type != ConnectionType.BLUETOOTH
+        )
+
+    def _create_batch_message(self, messages):
+        return self.codec.create_batch_message(messages, self.client_uuid)
 
     async def send(self, type, data=None, process_id=None):
         client_uuid = self.client_uuid
-        await self.send_func(create_message(type, client_uuid, data, process_id))
-
-    def set_message_callback(self, message_type, callback):
+        message = self.codec.create_message(type, client_uuid, data, process_id)
+        priority, stream = self._message_priority(type, data, process_id)
+        record = None
+        if self.scrollback is not None and type not in UNNUMBERED_TYPES:
+            record = (type, data, process_id)
+        await self.send_queue.put(message, priority, stream, record)
+
+        observers = self.observers.get(process_id) if process_id is not None else None
+        if observers:
+            # encoded once for all observers, which always receive json
+            if self.codec.binary:
+                message = create_message(type, client_uuid, data, process_id)
+            for observer in observers:
+                await observer.put(message, priority, stream)
+
+    def add_observer(self, process_id: str, observer: Observer) -> bool:
+        """Send observer the messages of a running process, if there is one."""
+        if process_id not in self.process_handlers:
+            return False
+        self.observers.setdefault(process_id, []).append(observer)
+        return True
+
+    def remove_observer(self, process_id: str, observer: Observer):
+        observers = self.observers.get(process_id, [])
+        if observer in observers:
+            observers.remove(observer)
+        if not observers:
+            self.observers.pop(process_id, None)
+
+    def detach(self, on_expired: Callable):
+        """
+        Carry on without a connection, discarding messages, until resumed or
+        resume_grace has passed, when on_expired is called.
+        """
+        self.connection = None
+        self.send_func = discard
+        self._resume_timer = Timer(self.resume_grace, on_expired)
+        self._resume_timer.start()
+
+    async def resume(
+        self,
+        send_func: Callable,
+        seq: int,
+        binary=False,
+        batch=False,
+        compression_stats: Optional[Callable[[], Dict]] = None,
+    ):
+        """Send on a new connection, starting with the messages after seq."""
+        if self.scrollback is None:
+            raise InvalidOperation("Connection is not resumable")
+        if self._resume_timer:
+            self._resume_timer.cancel()
+            self._resume_timer = None
+        self.resumes += 1
+
+        # messages still queued weren't sent on the old connection, so follow
+        # those which were in the scrollback
+        for record, size in self.send_queue.clear():
+            self.scrollback.append(record, size)
+        self.send_func = send_func
+        self.codec = self._binary_codec() if binary else JsonCodec()
+        self.batch = self.send_queue.batch = batch
+        self.compression_stats = compression_stats
+
+        first_seq, items = self.scrollback.since(seq)
+        await self.send("resumed", {"seq": first_seq})
+        for type, data, process_id in items:
+            message = self.codec.create_message(
+                type, self.client_uuid, data, process_id
+            )
+            # ahead of new output, which mustn't overtake its process' old output
+            stream = None if process_id is None else (process_id, None)
+            await self.send_queue.put(message, Priority.CONTROL, stream)
+
+    def _message_priority(self, type, data, process_id):
+        # output is kept in order within its stream, and the dropped and
+        # stopped messages of a process follow the output before them
+        if type in ("stdout", "stderr"):
+            input_time = self._input_times.get(process_id)
+            if (
+                input_time is not None
+                and monotonic() - input_time < ECHO_TIME
+                and len(data["output"]) <= ECHO_MAX_LENGTH
+            ):
+                return Priority.ECHO, (process_id, type)
+            return Priority.TEXT, (process_id, type)
+        if type == "keylisten":
+            return Priority.ECHO, (process_id, type)
+        if type == "video":
+            return Priority.VIDEO, (process_id, type)
+        if type == "dropped":
+            return Priority.CONTROL, (process_id, data["channel"])
+        if type in ("stopped", "executed", "reset"):
+            return Priority.CONTROL, (process_id, None)
+        return Priority.CONTROL, None
+
+    def _on_delivered(self, record, size):
+        if self.scrollback is not None:
+            self.scrollback.append(record, size)
+
+    async def _send_messages(self, messages):
+        self.sent_messages += len(messages)
+        if len(messages) > 1:
+            await self._send_frame(self._create_batch_message(messages))
+        else:
+            await self._send_frame(messages[0])
+
+    async def _send_frame(self, frame):
+        self.sent_frames += 1
+        self.sent_bytes += len(frame)  # json is ascii, binary is bytes
+        start_time = perf_counter()
+        await self.send_func(frame)
+        if self.bandwidth_estimator:
+            self.bandwidth_estimator.sent(len(frame), perf_counter() - start_time)
+
+    def set_message_callback(
+        self,
+        message_type: str,
+        callback: Callable,
+        validator: Optional[Callable] = None,
+    ):
+        """
+        Handle messages of a type with the async callback(data, process_id),
+        if validator(data, process_id) returns True or there is no validator.
+        Other messages of the type are bad messages.
+        """
         self.message_callbacks[message_type] = callback
+        if validator is None:
+            self.message_validators.pop(message_type, None)
+        else:
+            self.message_validators[message_type] = validator
 
     async def handle_message(self, message):
+        m_type = None
+        start_time = perf_counter()
         try:
-            m_type, m_data, m_process, _ = parse_message(message)
-
-            process_handler = self.process_handlers.get(m_process)
-
-            if m_type == "ping":
-                if self._watchdog_timer:
-                    self.restart_watchdog_timer()
-                await self.send("pong")
-
-            elif (
-                m_type == "start"
-                and not process_handler
-                and m_process
-                and isinstance(m_data.get("runner"), str)
-            ):
-                code = m_data.get("code")
-                code = code if isinstance(code, str) else None
-                path = m_data.get("path")
-                path = path if isinstance(path, str) and len(path) else get_temp_dir()
-                novncOptions = m_data.get("novncOptions")
-                novncOptions = (
-                    novncOptions
-                    if (
-                        isinstance(novncOptions, dict)
-                        and isinstance(novncOptions.get("enabled"), bool)
-                    )
-                    else {"enabled": False}
-                )
-                await self.add_handler(
-                    m_process, m_data["runner"], path, code, novncOptions
-                )
-
-            elif (
-                m_type == "stdin"
-                and process_handler
-                and isinstance(m_data.get("input"), str)
-            ):
-                await process_handler.send_input(m_data["input"])
-
-            elif (
-                m_type == "resize"
-                and process_handler
-                and isinstance(m_data.get("rows"), int)
-                and isinstance(m_data.get("cols"), int)
-            ):
-                await process_handler.resize_pty(m_data["rows"], m_data["cols"])
-
-            elif m_type == "stop" and process_handler:
-                await process_handler.stop()
-
-            elif (
-                m_type == "keyevent"
-                and process_handler
-                and isinstance(m_data.get("key"), str)
-                and isinstance(m_data.get("event"), str)
-            ):
-                await process_handler.send_key_event(m_data["key"], m_data["event"])
-
+            if is_binary_message(message):
+                if not self.codec.binary:
+                    self.codec = self._binary_codec()
+                m_type, m_data, m_process, _ = self.codec.parse_message(message)
             else:
+                m_type, m_data, m_process, _ = parse_message(message)
+
+            callback = self.message_callbacks.get(m_type)
+            validator = self.message_validators.get(m_type)
+            if callback is None or (validator and not validator(m_data, m_process)):
                 raise BadMessage()
+            await callback(m_data, m_process)
 
         except (BadMessage, InvalidOperation):
             logging.exception(f"{self.id} Bad Message")
@@ -170,7 +495,111 @@ class RunManager:
             logging.exception(f"{self.id} Message Exception: {e}")
             await self.send("error", {"message": "Message Exception"})
 
-    async def add_handler(self, process_id, runner, path, code, novncOptions):
+        finally:
+            # types are chosen by clients, so only registered ones are recorded
+            key = m_type if m_type in self.message_callbacks else "unknown"
+            connection_type = self.connection_type.name.lower()
+            stats.record_time(
+                f"message.{connection_type}.{key}", perf_counter() - start_time
+            )
+
+    def _running(self, process_id) -> bool:
+        return bool(self.process_handlers.get(process_id))
+
+    def _valid_start(self, data, process_id) -> bool:
+        return (
+            bool(process_id)
+            and not self._running(process_id)
+            and isinstance(data.get("runner"), str)
+        )
+
+    def _valid_stdin(self, data, process_id) -> bool:
+        return self._running(process_id) and isinstance(data.get("input"), str)
+
+    def _valid_resize(self, data, process_id) -> bool:
+        return (
+            self._running(process_id)
+            and isinstance(data.get("rows"), int)
+            and isinstance(data.get("cols"), int)
+        )
+
+    def _valid_keyevent(self, data, process_id) -> bool:
+        return (
+            self._running(process_id)
+            and isinstance(data.get("key"), str)
+            and isinstance(data.get("event"), str)
+        )
+
+    def _running_kernel(self, process_id) -> bool:
+        return isinstance(self.process_handlers.get(process_id), KernelProcessHandler)
+
+    def _valid_execute(self, data, process_id) -> bool:
+        return self._running_kernel(process_id) and isinstance(data.get("code"), str)
+
+    async def _on_ping(self, data, process_id):
+        self.restart_watchdog_timer()
+        await self.send("pong")
+
+    async def _on_start(self, data, process_id):
+        code = data.get("code")
+        code = code if isinstance(code, str) else None
+        path = data.get("path")
+        path = path if isinstance(path, str) and len(path) else get_temp_dir()
+        novncOptions = data.get("novncOptions")
+        novncOptions = (
+            novncOptions
+            if (
+                isinstance(novncOptions, dict)
+                and isinstance(novncOptions.get("enabled"), bool)
+            )
+            else {"enabled": False}
+        )
+        lossless = data.get("outputMode") == "lossless"
+        compact = data.get("compactOutput") is True
+        await self.add_handler(
+            process_id,
+            data["runner"],
+            path,
+            code,
+            novncOptions,
+            lossless,
+            compact,
+        )
+
+    async def _on_stdin(self, data, process_id):
+        self._input_times[process_id] = monotonic()
+        await self.process_handlers[process_id].send_input(data["input"])
+
+    async def _on_resize(self, data, process_id):
+        await self.process_handlers[process_id].resize_pty(data["rows"], data["cols"])
+
+    async def _on_stop(self, data, process_id):
+        await self.process_handlers[process_id].stop()
+
+    async def _on_keyevent(self, data, process_id):
+        await self.process_handlers[process_id].send_key_event(
+            data["key"], data["event"]
+        )
+
+    async def _on_execute(self, data, process_id):
+        await self.process_handlers[process_id].execute(data["code"])
+
+    async def _on_reset(self, data, process_id):
+        await self.process_handlers[process_id].reset()
+
+    async def _on_interrupt(self, data, process_id):
+        await self.process_handlers[process_id].interrupt()
+
+    async def add_handler(
+        self,
+        process_id,
+        runner,
+        path,
+        code,
+        novncOptions,
+        lossless=False,
+        compact=False,
+    ):
         try:
             handler_class = self.handler_classes[runner]
         except KeyError:
@@ -183,13 +612,29 @@ class RunManager:
         async def on_stop(exit_code):
             # process_id may be reused with other runners so clean up handler
             self.process_handlers.pop(process_id, None)
+            self._input_times.pop(process_id, None)
             await self.send("stopped", {"exitCode": exit_code}, process_id)
+            for observer in self.observers.pop(process_id, []):
+                asyncio.ensure_future(observer.finish())
             logging.info(f"{self.id} Stopped {process_id}")
 
         async def on_output(channel, output):
             await self.send(channel, {"output": output}, process_id)
             logging.debug(f"{self.id} Sending Output {process_id} {channel} {output}")
 
+        async def on_dropped(channel, dropped_bytes, dropped_chunks):
+            await self.send(
+                "dropped",
+                {"channel": channel, "bytes": dropped_bytes, "chunks": dropped_chunks},
+                process_id,
+            )
+            logging.debug(
+                f"{self.id} Dropped output {process_id} {channel} {dropped_bytes}"
+            )
+
+        async def on_kernel_message(type, data):
+            await self.send(type, data, process_id)
+
         async def on_display_activity(connection_details: VncConnectionDetails):
             logging.debug(f"{self.id} Sending display activity")
             await self.send(
@@ -201,16 +646,31 @@ class RunManager:
                 process_id,
             )
 
-        handler = handler_class(self.user, self.pty, self.connection_type)
+        handler = handler_class(
+            self.user,
+            self.pty,
+            self.connection_type,
+            self.bandwidth_budget,
+            lossless=lossless,
+            compact=compact,
+        )
         handler.on_start = on_start
         handler.on_stop = on_stop
         handler.on_display_activity = on_display_activity
         handler.on_output = on_output
+        handler.on_dropped = on_dropped
+        handler.on_kernel_message = on_kernel_message
         await handler.start(path, code, novncOptions=novncOptions)
 
         self.process_handlers[process_id] = handler
 
 
+# resumable websocket connections' RunManagers, by client uuid and resume token
+resumable_run_managers: Dict[Tuple[str, str], RunManager] = {}
+# websocket connections' RunManagers by client uuid, for observers to find
+run_managers: Dict[str, RunManager] = {}
+
+
 async def bluetooth_run_handler(
     device,
     message,
@@ -218,13 +678,15 @@ async def bluetooth_run_handler(
     bt_run_managers,
 ):
     try:
-        message_dict = bytearray_to_dict(message)
+        if is_binary_message(message):
+            client_uuid = BinaryCodec.parse_client(message)
+        else:
+            client_uuid = bytearray_to_dict(message).pop("client", None)
     except Exception:
         msg = "Error: invalid format"
         logging.error(msg)
         return
 
-    client_uuid = message_dict.pop("client", None)
     if client_uuid is None:
         msg = "Error: client_uuid not provided in message"
         logging.error(msg)
@@ -261,7 +723,7 @@ async def bluetooth_run_handler(
         bt_run_managers[client_uuid] = run_manager
 
     run_manager = bt_run_managers.get(client_uuid)
-    logging.debug(f"{run_manager.id} Received Message {message_dict}")
+    logging.debug(f"{run_manager.id} Received Message {message!r}")
 
     try:
         await run_manager.handle_message(message)
@@ -278,24 +740,73 @@ async def run(request):
     client_uuid = query_params.get("client", "")
     user = query_params.get("user", None)
     pty = query_params.get("pty", "").lower() in ["1", "true"]
+    batch = query_params.get("batch", "").lower() in ["1", "true"]
+    binary = query_params.get("format", "") == "binary"
+    compression = CompressionSettings.from_env().with_query(query_params)
+    resume_token = query_params.get("resume", "")
+    resumable = resume_token != "" or query_params.get("resumable", "").lower() in [
+        "1",
+        "true",
+    ]
+    try:
+        seq = int(query_params.get("seq", 0))
+    except ValueError:
+        seq = 0
 
-    socket = web.WebSocketResponse()
-    await socket.prepare(request)
+    socket = web.WebSocketResponse(compress=compression.enabled)
+    writer = await socket.prepare(request)
+
+    # messages are compressed by deflate if the client accepted compression
+    deflate = negotiated_sender(socket, writer, compression)
+    sender = deflate or socket
 
     async def send_func(message):
         try:
-            await socket.send_str(message)
+            if isinstance(message, bytes):
+                await sender.send_bytes(message)
+            else:
+                await sender.send_str(message)
         except ConnectionResetError:
             pass  # already disconnected
 
-    run_manager = RunManager(
-        send_func,
-        client_uuid=client_uuid,
-        user=user,
-        pty=pty,
-        connection_type=ConnectionType.WEBSOCKET,
-    )
-    logging.info(f"{run_manager.id} New connection")
+    observed_client = query_params.get("observe")
+    if observed_client is not None:
+        process_id = query_params.get("process", "")
+        await observe(socket, send_func, client_uuid, observed_client, process_id)
+        return socket
+
+    compression_stats = deflate.stats if deflate else lambda: {"enabled": False}
+
+    run_manager = resumable_run_managers.get((client_uuid, resume_token))
+    if run_manager:
+        previous = run_manager.connection
+        run_manager.connection = socket
+        if previous is not None:
+            await previous.close()  # the client reconnected before it closed
+        await run_manager.resume(send_func, seq, binary, batch, compression_stats)
+        logging.info(f"{run_manager.id} Resumed connection")
+    else:
+        run_manager = RunManager(
+            send_func,
+            client_uuid=client_uuid,
+            user=user,
+            pty=pty,
+            connection_type=ConnectionType.WEBSOCKET,
+            batch=batch,
+            binary=binary,
+            compression_stats=compression_stats,
+            resume_grace=resume_grace() if resumable else 0,
+        )
+        run_manager.connection = socket
+        logging.info(f"{run_manager.id} New connection")
+        if run_manager.resume_token:
+            key = (client_uuid, run_manager.resume_token)
+            resumable_run_managers[key] = run_manager
+            await run_manager.send(
+                "session",
+                {"token": run_manager.resume_token, "grace": run_manager.resume_grace},
+            )
+    run_managers[client_uuid] = run_manager
 
     try:
         async for message in socket:
@@ -306,8 +817,59 @@ async def run(request):
         pass
 
     finally:
+        # the run manager's queued messages are sent, or given up on, before the
+        # close frame
+        if run_manager.connection is not socket:
+            pass  # resumed on another connection
+        elif run_manager.resume_token:
+            key = (client_uuid, run_manager.resume_token)
+
+            async def on_expired():
+                resumable_run_managers.pop(key, None)
+                forget_run_manager(client_uuid, run_manager)
+                logging.info(f"{run_manager.id} Resume grace period expired")
+                await run_manager.stop()
+
+            run_manager.detach(on_expired)
+        else:
+            forget_run_manager(client_uuid, run_manager)
+            await run_manager.stop()
         await socket.close()
         logging.info(f"{run_manager.id} Closed connection")
-        await run_manager.stop()
 
     return socket
+
+
+def forget_run_manager(client_uuid, run_manager):
+    if run_managers.get(client_uuid) is run_manager:
+        del run_managers[client_uuid]
+
+
+async def observe(socket, send_func, client_uuid, observed_client, process_id):
+    observer = Observer(send_func, socket.close)
+    run_manager = run_managers.get(observed_client)
+    if run_manager is None or not run_manager.add_observer(process_id, observer):
+        message = {"message": "Process not found"}
+        await send_func(create_message("error", client_uuid, message))
+        await socket.close()
+        return
+    logging.info(f"{observer.id} Observing {run_manager.id} process {process_id}")
+
+    try:
+        async for message in socket:
+            # observers can only keep the connection alive
+            try:
+                m_type = parse_message(message.data)[0]
+            except Exception:
+                continue
+            if m_type == "ping":
+                pong = create_message("pong", client_uuid)
+                await observer.put(pong, Priority.CONTROL)
+
+    except asyncio.CancelledError:
+        pass
+
+    finally:
+        run_manager.remove_observer(process_id, observer)
+        await observer.finish()
+        logging.info(f"{observer.id} Closed observer connection")
@@ -2,6 +2,7 @@ from json import dumps
 
 from aiohttp import web
 
+from further_link.util.stats import get_stats
 from further_link.version import __version__
 
 
@@ -19,3 +20,7 @@ async def status(_):
 
 async def version(_):
     return web.Response(text=raw_version())
+
+
+async def stats(_):
+    return web.json_response(get_stats())
@@ -0,0 +1,270 @@
+# noVNC runs can lease a virtual display from a pool of displays which have
+# already been started, rather than each waiting for pt-web-vnc to start an X
+# server, window manager and vnc server for it. Displays are kept ready in the
+# sizes runs usually ask for. A display a run has finished with is put back in
+# the pool if the run left nothing on it and no one is still viewing it, and is
+# stopped otherwise.
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from pt_web_vnc.display_activity_monitor import (
+    start_activity_monitor,
+    stop_activity_monitor,
+)
+from pt_web_vnc.screenshot_monitor import (
+    start_screenshot_monitor,
+    stop_screenshot_monitor,
+)
+from pt_web_vnc.vnc import (
+    async_clients,
+    async_connection_details,
+    async_start,
+    async_stop,
+)
+
+from ..util import stats
+from ..util.id_generator import IdGenerator
+from ..util.sdk import X11_DIR
+from ..util.vnc import VNC_CERTIFICATE_PATH
+
+# width and height, None for pt-web-vnc's default
+Size = Tuple[Optional[int], Optional[int]]
+
+# how long a display started for the pool is left for its window manager to
+# start before its windows are counted, to later tell whether a run left any
+SETTLE_TIME = 1
+# how long to wait before starting displays again after one failed to start
+RETRY_DELAY = 30
+
+
+def vnc_pool_size() -> int:
+    """How many displays of each size to keep ready, 0 disables the pool."""
+    return int(os.environ.get("FURTHER_LINK_VNC_POOL", "0"))
+
+
+def vnc_pool_sizes() -> List[Size]:
+    value = os.environ.get("FURTHER_LINK_VNC_POOL_SIZES", "")
+    sizes: List[Size] = []
+    for size in value.split(","):
+        if size.strip():
+            width, height = size.lower().split("x")
+            sizes.append((int(width), int(height)))
+    return sizes or [(None, None)]
+
+
+def vnc_pool_wait() -> float:
+    """How long a lease waits for a display of its size which is starting."""
+    return float(os.environ.get("FURTHER_LINK_VNC_POOL_WAIT", "10"))
+
+
+async def _window_count(display_id) -> Optional[int]:
+    # the top level windows, or None if the display isn't running
+    proc = await asyncio.create_subprocess_exec(
+        "xwininfo",
+        "-d",
+        f":{display_id}",
+        "-root",
+        "-children",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return None
+    match = re.search(rb"(\d+) child", stdout)
+    return int(match.group(1)) if match else 0
+
+
+class PooledDisplay:
+    def __init__(self, id: int, size: Size):
+        self.id = id
+        self.size = size
+        self.connection_details = None
+        # top level windows when ready for a run
+        self.windows: Optional[int] = None
+
+    def is_alive(self) -> bool:
+        return os.path.exists(f"{X11_DIR}/X{self.id}")
+
+    def monitor(self, on_display_activity, screenshot_timeout):
+        """Start the monitors which async_start would for a run."""
+        start_activity_monitor(self.id, on_display_activity, self.connection_details)
+        return start_screenshot_monitor(self.id, screenshot_timeout)
+
+
+class DisplayPool:
+    """
+    Virtual displays for noVNC runs, vnc_pool_size() of each of
+    vnc_pool_sizes() kept ready while running. Display ids are taken from the
+    ids of ProcessHandlers, so that they don't clash with those of runs.
+    Leases of sizes which aren't kept ready, or when none are, start their own
+    display, which is returned to the pool after the run if it is of a size
+    the pool is short of.
+    """
+
+    def __init__(self, ids: IdGenerator):
+        self.ids = ids
+        self.running = False
+        self.hits = 0
+        self.misses = 0
+        self._ready: Dict[Size, List[PooledDisplay]] = {}
+        self._starting: Dict[Size, Set[asyncio.Future]] = {}
+        self._retry_at = float("-inf")
+
+    def ready(self) -> int:
+        return sum(len(displays) for displays in self._ready.values())
+
+    def hit_rate(self) -> int:
+        """The percentage of leases which didn't start their own display."""
+        leases = self.hits + self.misses
+        return round(self.hits * 100 / leases) if leases else 0
+
+    def start(self):
+        self.running = True
+        stats.add_gauge("vnc_pool.ready", self.ready)
+        stats.add_gauge("vnc_pool.hit_rate", self.hit_rate)
+        self.fill()
+
+    async def stop(self):
+        self.running = False
+        starting = [f for futures in self._starting.values() for f in futures]
+        for future in starting:
+            future.cancel()
+        await asyncio.gather(*starting, return_exceptions=True)
+
+        displays = [d for displays in self._ready.values() for d in displays]
+        self._ready.clear()
+        await asyncio.gather(*(self._destroy(d) for d in displays))
+
+    def fill(self):
+        """Start displays of each size until enough are ready or starting."""
+        if not self.running or time.monotonic() < self._retry_at:
+            return
+        for size in vnc_pool_sizes():
+            starting = self._starting.setdefault(size, set())
+            ready = self._ready.get(size, [])
+            for _ in range(vnc_pool_size() - len(ready) - len(starting)):
+                future = asyncio.ensure_future(self._warm(size))
+                starting.add(future)
+                future.add_done_callback(starting.discard)
+
+    async def lease(self, width=None, height=None) -> PooledDisplay:
+        start = time.perf_counter()
+        size = (width, height)
+
+        display = self._take(size)
+        if display is None and self._starting.get(size):
+            # one of the displays starting is ready sooner than a new one
+            await asyncio.wait(
+                set(self._starting[size]),
+                timeout=vnc_pool_wait(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            display = self._take(size)
+
+        if display is not None:
+            self.hits += 1
+            stats.count("vnc_pool.hit")
+        else:
+            self.misses += 1
+            stats.count("vnc_pool.miss")
+            display = await self._start_display(size)
+
+        stats.record_time("vnc_pool.lease", time.perf_counter() - start)
+        self.fill()
+        return display
+
+    async def release(self, display: PooledDisplay):
+        await stop_activity_monitor(display.id)
+        await stop_screenshot_monitor(display.id)
+        if await self._reusable(display):
+            self._ready.setdefault(display.size, []).append(display)
+            self._trim(display.size)
+        else:
+            await self._destroy(display)
+        self.fill()
+
+    def _take(self, size) -> Optional[PooledDisplay]:
+        ready = self._ready.get(size)
+        while ready:
+            display = ready.pop(0)
+            if display.is_alive():
+                return display
+            logging.warning(f"Pooled display :{display.id} stopped")
+            asyncio.ensure_future(self._destroy(display))
+        return None
+
+    async def _reusable(self, display) -> bool:
+        size = display.size
+        if (
+            not self.running
+            or size not in vnc_pool_sizes()
+            or len(self._ready.get(size, [])) >= vnc_pool_size()
+        ):
+            return False
+        try:
+            # the next run mustn't be seen by this run's viewers, or see
+            # windows this run left open
+            return (
+                await async_clients(display.id) == 0
+                and await _window_count(display.id) == display.windows
+            )
+        except Exception as e:
+            logging.exception(f"Pooled display :{display.id} check error: {e}")
+            return False
+
+    def _trim(self, size):
+        # a display returned is ready before those started when it was leased
+        starting = self._starting.get(size, set())
+        excess = len(self._ready[size]) + len(starting) - vnc_pool_size()
+        for future in list(starting)[: max(excess, 0)]:
+            future.cancel()
+
+    async def _warm(self, size):
+        try:
+            display = await self._start_display(size, SETTLE_TIME)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(f"Display pool start error: {e}")
+            self._retry_at = time.monotonic() + RETRY_DELAY
+            asyncio.get_running_loop().call_later(RETRY_DELAY, self.fill)
+            return
+
+        if self.running:
+            self._ready.setdefault(size, []).append(display)
+        else:
+            await self._destroy(display)
+
+    async def _start_display(self, size, settle_time=0) -> PooledDisplay:
+        width, height = size
+        display = PooledDisplay(self.ids.create(), size)
+        try:
+            await async_start(
+                display_id=display.id,
+                ssl_certificate=VNC_CERTIFICATE_PATH,
+                with_window_manager=True,
+                height=height,
+                width=width,
+            )
+            await asyncio.sleep(settle_time)
+            display.windows = await _window_count(display.id)
+            if display.windows is None or not display.is_alive():
+                raise RuntimeError(f"Display :{display.id} didn't start")
+            display.connection_details = await async_connection_details(display.id)
+        except BaseException:
+            await self._destroy(display)
+            raise
+        return display
+
+    async def _destroy(self, display):
+        try:
+            await async_stop(display.id)
+        except Exception as e:
+            logging.exception(f"Pooled display :{display.id} stop error: {e}")
+        finally:
+            self.ids.free(display.id)
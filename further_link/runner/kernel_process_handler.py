@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import shlex
+import signal
+from functools import partial
+
+from ..util.async_helpers import ringbuf_read
+from ..util.ipc import _get_temp_dir
+from ..util.upload import create_directory
+from ..util.user_config import get_absolute_path, get_working_directory
+from .process_handler import InvalidOperation, ProcessHandler
+from .py_process_handler import PyProcessHandler, venv_env
+
+KERNEL_SCRIPT = str(pathlib.Path(__file__).parent.absolute() / "python_kernel.py")
+
+# how long the kernel may take to start listening for cells
+CONNECT_TIMEOUT = 10
+# how often to check whether output written by a cell has been sent yet
+OUTPUT_POLL_TIME = 0.005
+
+
+class _CountedStream:
+    """Counts the reads of a stream which returned data, and those sent on."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.reads = 0
+        self.sent_reads = 0
+
+    async def read(self, n):
+        data = await self.stream.read(n)
+        if data:
+            self.reads += 1
+        return data
+
+    def pending(self):
+        return self.reads > self.sent_reads
+
+
+class KernelProcessHandler(PyProcessHandler):
+    """
+    A python3 process which keeps running between code cells, executing each
+    cell in the namespace left by the cells before it. Cells are sent to the
+    kernel by execute, and the kernel's replies, once the output of the cell
+    has been sent, are passed to on_kernel_message(type, data).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_kernel_message = None
+
+    async def _start(self, path, code=None, novncOptions={}):
+        work_dir = get_absolute_path(path, get_working_directory(self.user))
+
+        # create work dir if it doesn't already exist
+        create_directory(work_dir, self.user)
+
+        self.entrypoint = KERNEL_SCRIPT
+        self._outputs = []
+        self._connection = asyncio.get_running_loop().create_future()
+
+        # given to the kernel rather than both sides deriving it from the
+        # kernel's process group, which isn't known until it has started
+        self.socket_path = os.path.join(_get_temp_dir(), f"{self.id}.kernel.sock")
+        try:
+            os.remove(self.socket_path)  # left by a kernel which didn't start
+        except FileNotFoundError:
+            pass
+
+        command = (
+            f"python3 -u {shlex.quote(KERNEL_SCRIPT)} {shlex.quote(self.socket_path)}"
+        )
+        await ProcessHandler._start(
+            self, command, work_dir, env=venv_env(), novncOptions=novncOptions
+        )
+
+        kernel_com = asyncio.create_task(self._kernel_communicate())
+        self.background_tasks.add(kernel_com)
+
+        # code given to start is the first cell
+        if code:
+            await self.execute(code)
+
+    async def execute(self, code):
+        await self._send_request({"type": "execute", "code": code})
+
+    async def reset(self):
+        await self._send_request({"type": "reset"})
+
+    async def interrupt(self):
+        if not self.is_running():
+            raise InvalidOperation()
+        try:
+            os.kill(self.process.pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+
+    async def _send_request(self, request):
+        if not self.is_running():
+            raise InvalidOperation()
+        _, writer = await asyncio.shield(self._connection)
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+
+    async def _connect(self):
+        path = self.socket_path
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONNECT_TIMEOUT
+        while True:
+            try:
+                return await asyncio.open_unix_connection(path=path)
+            except OSError:
+                if not self.is_running() or loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.01)  # wait for the kernel to listen
+
+    async def _kernel_communicate(self):
+        try:
+            connection = await self._connect()
+        except Exception as e:
+            logging.exception(f"{self.id} Kernel connection error: {e}")
+            self._connection.set_exception(InvalidOperation())
+            self._connection.exception()  # retrieved, may never be awaited
+            return
+        self._connection.set_result(connection)
+
+        reader, writer = connection
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                await self._output_sent()
+                if self.on_kernel_message:
+                    await self.on_kernel_message(reply.pop("type"), reply)
+        finally:
+            writer.close()
+
+    async def _output_sent(self):
+        # output written by the cell is read while its reply is, but is only
+        # sent after the reader's flush window, so wait for it before replying
+        await asyncio.sleep(OUTPUT_POLL_TIME)
+        while self.is_running() and any(o.pending() for o in self._outputs):
+            await asyncio.sleep(OUTPUT_POLL_TIME)
+
+    async def _handle_output(self, stream, channel):
+        stream = _CountedStream(stream)
+        self._outputs.append(stream)
+
+        async def on_output(text):
+            # what has been read is flushed together
+            stream.sent_reads = stream.reads
+            await self.on_output(channel, text)
+
+        await ringbuf_read(
+            stream,
+            output_callback=on_output,
+            on_dropped=partial(self._handle_dropped, channel),
+            done_condition=self.process.wait,
+            limiter=self._budget_stream(channel),
+            lossless=self.lossless,
+            transform=self._compact_output if self.compact else None,
+        )
@@ -6,28 +6,31 @@ from functools import partial
 from pty import openpty
 from shlex import split
 
-import aiofiles
 from pt_web_vnc.vnc import async_start, async_stop
 
+from ..util import stats
 from ..util.async_helpers import ringbuf_read, timeout
-from ..util.connection_types import ConnectionType, bandwidth_limits_kBps
+from ..util.connection_types import (
+    ConnectionType,
+    bandwidth_limits_kBps,
+    channel_bandwidth_weights,
+)
+from ..util.environment import environments
 from ..util.id_generator import IdGenerator
 from ..util.images import base64_encode
 from ..util.ipc import async_ipc_send, async_start_ipc_server, ipc_cleanup
-from ..util.sdk import get_first_display
-from ..util.terminal import set_winsize
+from ..util.rate_limit import BandwidthBudget
+from ..util.terminal import DEFAULT_COLUMNS, PtyStream, compact_output, set_winsize
 from ..util.user_config import (
     get_current_user,
     get_gid,
     get_grp_ids,
-    get_home_directory,
-    get_shell,
     get_uid,
     get_working_directory,
-    get_xdg_runtime_dir,
     user_exists,
 )
 from ..util.vnc import VNC_CERTIFICATE_PATH
+from .display_pool import DisplayPool, vnc_pool_size
 
 SERVER_IPC_CHANNELS = [
     "video",
@@ -44,10 +47,33 @@ class InvalidOperation(Exception):
 # so we must use +ve int < 1000, with 0-99 reserved for other uses
 id_generator = IdGenerator(min_value=100, max_value=999)
 
+# virtual displays for novnc runs, when FURTHER_LINK_VNC_POOL is set
+display_pool = DisplayPool(id_generator)
+
+# most seconds lossless output is sent for after the process exits, as output
+# doesn't end while a background child of the process keeps writing to it
+LOSSLESS_DRAIN_TIMEOUT = 30
+
 
 class ProcessHandler:
-    def __init__(self, user, pty=False, connection_type=ConnectionType.WEBSOCKET):
+    def __init__(
+        self,
+        user,
+        pty=False,
+        connection_type=ConnectionType.WEBSOCKET,
+        bandwidth_budget=None,
+        lossless=False,
+        compact=False,
+    ):
         self.pty = pty
+        # lossless output blocks the process while the client catches up,
+        # rather than dropping the oldest output
+        self.lossless = lossless
+        # compact output drops terminal redraws that would be overwritten
+        # before the client could see them, such as progress bar updates
+        self.compact = compact
+        # width of the client's terminal, known for a pty once resized
+        self.columns = DEFAULT_COLUMNS
 
         assert user_exists(user)
         self.user = user
@@ -55,11 +81,17 @@ class ProcessHandler:
         assert connection_type in ConnectionType
         self.connection_type = connection_type
         assert connection_type in bandwidth_limits_kBps
-        self.bandwidth_limit_kBps = bandwidth_limits_kBps[connection_type]
+        # output streams share a budget, with those of other processes on the
+        # same connection if one is given
+        self.bandwidth_budget = bandwidth_budget or BandwidthBudget(
+            bandwidth_limits_kBps[connection_type], channel_bandwidth_weights
+        )
+        self.budget_streams = []
 
         self.id = id_generator.create()
         self.had_display_activity = False
         self.on_display_activity = None
+        self.on_dropped = None
         self.background_tasks = set()
 
     async def start(self, *args, **kwargs):
@@ -83,31 +115,36 @@ class ProcessHandler:
             # cannot set terminal process group (-1): Inappropriate ioctl for device
             os.chown(slave, get_uid(self.user), get_gid(self.user))
 
-            self.pty_master = await aiofiles.open(master, "w+b", 0)
-            self.pty_slave = await aiofiles.open(slave, "r+b", 0)
+            # the master is read and written on the event loop, the slave is
+            # only handed to the process and kept open for resizing
+            self.pty_master = PtyStream(master)
+            self.pty_slave = slave
 
             # set terminal size to a minimum that we display in Further
             set_winsize(slave, 4, 60)
+            self.columns = 60
 
             stdio = self.pty_slave
 
-        process_env = {**os.environ.copy(), **env}
-        process_env["TERM"] = "xterm-256color"  # perhaps should be param
-
-        if self.user:
-            process_env["USER"] = self.user
-            process_env["LOGNAME"] = self.user
-            process_env["HOME"] = get_home_directory(self.user)
-            process_env["XDG_RUNTIME_DIR"] = get_xdg_runtime_dir(self.user)
-            process_env["SHELL"] = get_shell(self.user)
-            process_env["PWD"] = self.work_dir
-            # remove None values
-            process_env = {k: v for k, v in process_env.items() if v is not None}
-
         # set $DISPLAY so that user can open GUI windows
         self.screenshot_manager = None
-        if self.novnc:
-            process_env["DISPLAY"] = ":{}".format(self.id)
+        self.display_lease = None
+        display = None
+        if self.novnc and vnc_pool_size() > 0:
+            self.display_lease = await display_pool.lease(
+                width=novncOptions.get("width"), height=novncOptions.get("height")
+            )
+            display = ":{}".format(self.display_lease.id)
+        elif self.novnc:
+            display = ":{}".format(self.id)
+        process_env = environments.environment(self.user, self.work_dir, env, display)
+
+        if self.display_lease:
+            self.screenshot_manager = self.display_lease.monitor(
+                on_display_activity=self.handle_display_activity,
+                screenshot_timeout=1,
+            )
+        elif self.novnc:
             self.screenshot_manager = await async_start(
                 display_id=self.id,
                 on_display_activity=self.handle_display_activity,
@@ -118,11 +155,6 @@ class ProcessHandler:
                 screenshot_timeout=1,
             )
 
-        else:
-            default_display = get_first_display()
-            if default_display:
-                process_env["DISPLAY"] = default_display
-
         def preexec():
             if self.user != get_current_user():
                 # set the process group id for user
@@ -140,15 +172,7 @@ class ProcessHandler:
             # as allowing a shell process to be a 'controlling terminal'
             os.setsid()
 
-        self.process = await asyncio.create_subprocess_exec(
-            *split(command),
-            stdin=stdio,
-            stdout=stdio,
-            stderr=stdio,
-            env=process_env,
-            cwd=self.work_dir,
-            preexec_fn=preexec,
-        )
+        self.process = await self._create_process(command, stdio, process_env, preexec)
 
         if self.on_start:
             await self.on_start()
@@ -163,6 +187,17 @@ class ProcessHandler:
             # the process is done faster than we can look up gpid!
             self.pgid = None
 
+    async def _create_process(self, command, stdio, env, preexec):
+        return await asyncio.create_subprocess_exec(
+            *split(command),
+            stdin=stdio,
+            stdout=stdio,
+            stderr=stdio,
+            env=env,
+            cwd=self.work_dir,
+            preexec_fn=preexec,
+        )
+
     async def handle_display_activity(self, connection_details):
         self.had_display_activity = True
         if self.on_display_activity:
@@ -202,7 +237,8 @@ class ProcessHandler:
         if not self.is_running() or not self.pty:
             raise InvalidOperation()
 
-        set_winsize(self.pty_slave.fileno(), rows, cols)
+        set_winsize(self.pty_slave, rows, cols)
+        self.columns = cols
 
     async def send_key_event(self, key, event):
         if (
@@ -215,6 +251,11 @@ class ProcessHandler:
         content_bytes = f"{key} {event}".encode("utf-8")
         await async_ipc_send("keyevent", content_bytes, pgid=self.pgid)
 
+    def _budget_stream(self, channel):
+        stream = self.bandwidth_budget.stream(f"{self.id}.{channel}", channel)
+        self.budget_streams.append(stream)
+        return stream
+
     async def _ipc_communicate(self):
         self.ipc_tasks = []
         for channel in SERVER_IPC_CHANNELS:
@@ -224,7 +265,7 @@ class ProcessHandler:
                         channel,
                         partial(self.on_output, channel),
                         pgid=self.pgid,
-                        kBps=self.bandwidth_limit_kBps,
+                        limiter=self._budget_stream(channel),
                     )
                 )
             )
@@ -246,10 +287,21 @@ class ProcessHandler:
         # wait for process to exit
         await self.process.wait()
 
-        # wait a little for the io tasks to complete to let them send
-        # output produced right before the process stopped
-        # but cancel them after a timeout if they don't stop themselves
-        await timeout(output_tasks, 1)
+        if self.lossless:
+            # the io tasks stop once output left by the process has been sent
+            _, pending = await asyncio.wait(
+                output_tasks, timeout=LOSSLESS_DRAIN_TIMEOUT
+            )
+            if pending:
+                logging.warning(f"{self.id} Output still open after process exit")
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+        else:
+            # wait a little for the io tasks to complete to let them send
+            # output produced right before the process stopped
+            # but cancel them after a timeout if they don't stop themselves
+            await timeout(output_tasks, 1)
         if hasattr(self, "ipc_tasks"):
             await timeout(self.ipc_tasks, 0.1)
 
@@ -275,14 +327,30 @@ class ProcessHandler:
         if self.on_stop:
             await self.on_stop(exit_code)
 
+    def _stats_key(self, channel):
+        return f"output.{self.connection_type.name.lower()}.{channel}"
+
+    async def _handle_dropped(self, channel, dropped_bytes, dropped_chunks):
+        stats_key = self._stats_key(channel)
+        stats.count(f"{stats_key}.dropped_bytes", dropped_bytes)
+        stats.count(f"{stats_key}.dropped_chunks", dropped_chunks)
+        if self.on_dropped:
+            await self.on_dropped(channel, dropped_bytes, dropped_chunks)
+
     async def _handle_output(self, stream, channel):
         await ringbuf_read(
             stream,
             output_callback=partial(self.on_output, channel),
+            on_dropped=partial(self._handle_dropped, channel),
             done_condition=self.process.wait,
-            kBps=self.bandwidth_limit_kBps,
+            limiter=self._budget_stream(channel),
+            lossless=self.lossless,
+            transform=self._compact_output if self.compact else None,
         )
 
+    def _compact_output(self, output):
+        return compact_output(output, self.columns)
+
     async def _clean_up(self):
         try:
             self.background_tasks.clear()
@@ -291,13 +359,20 @@ class ProcessHandler:
         if getattr(self, "pty", None):
             try:
                 if getattr(self, "pty_master", None):
-                    await self.pty_master.close()
-                if getattr(self, "pty_slave", None):
-                    await self.pty_slave.close()
+                    self.pty_master.close()
+                if getattr(self, "pty_slave", None) is not None:
+                    os.close(self.pty_slave)
+                    self.pty_slave = None
             except Exception as e:
                 logging.exception(f"{self.id} PTY Cleanup error: {e}")
 
-        if getattr(self, "novnc", None):
+        if getattr(self, "display_lease", None):
+            try:
+                await display_pool.release(self.display_lease)
+                self.display_lease = None
+            except Exception as e:
+                logging.exception(f"{self.id} NOVNC Cleanup error: {e}")
+        elif getattr(self, "novnc", None):
             try:
                 await async_stop(self.id)
             except Exception as e:
@@ -313,5 +388,11 @@ class ProcessHandler:
             except Exception as e:
                 logging.exception(f"{self.id} IPC Cleanup error: {e}")
 
+        logging.debug(f"{self.id} Bandwidth usage {self.bandwidth_budget.usage()}")
+        for stream in self.budget_streams:
+            stats.count(f"{self._stats_key(stream.channel)}.sent_bytes", stream.bytes)
+            stream.close()
+        self.budget_streams.clear()
+
         id_generator.free(self.id)
         logging.debug(f"{self.id} Cleanup complete")
@@ -2,6 +2,7 @@ import logging
 import os
 import pathlib
 import shlex
+import shutil
 
 import aiofiles
 
@@ -13,10 +14,36 @@ from ..util.user_config import (
     get_working_directory,
 )
 from .process_handler import ProcessHandler
+from .zygote import get_zygote, python_zygote_enabled
 
 dirname = pathlib.Path(__file__).parent.absolute()
 
 
+def venv_env():
+    # Check for venv in environment
+    venv = os.environ.get("FURTHER_VENV")
+    env = {}
+
+    if venv and os.path.isfile(os.path.join(venv, "bin", "python3")):
+        env = {
+            "VIRTUAL_ENV": venv,
+            "PATH": f"{venv}/bin:{os.environ.get('PATH', '')}",
+        }
+    return env
+
+
+async def start_python_zygote():
+    """Start the zygote of the python3 that runs use, to preload its modules."""
+    path = venv_env().get("PATH", os.environ.get("PATH"))
+    python = shutil.which("python3", path=path)
+    if not python:
+        return
+    try:
+        await get_zygote(python)
+    except Exception as e:
+        logging.exception(f"Zygote error: {e}")
+
+
 class PyProcessHandler(ProcessHandler):
     async def _start(self, path, code=None, novncOptions={}):
         path = get_absolute_path(path, get_working_directory(self.user))
@@ -32,24 +59,28 @@ class PyProcessHandler(ProcessHandler):
                 await file.write(code)
             self._remove_entrypoint = entrypoint
 
-        # Check for venv in environment
-        venv = os.environ.get("FURTHER_VENV")
-        env = {}
-
-        if venv and os.path.isfile(os.path.join(venv, "bin", "python3")):
-            env = {
-                "VIRTUAL_ENV": venv,
-                "PATH": f"{venv}/bin:{os.environ.get('PATH', '')}",
-            }
-
+        env = venv_env()
         command = f"python3 -u {shlex.quote(entrypoint)}"
 
         os.chown(entrypoint, uid=get_uid(self.user), gid=get_gid(self.user))
 
         work_dir = os.path.dirname(entrypoint)
+        self.entrypoint = entrypoint
 
         await super()._start(command, work_dir, env=env, novncOptions=novncOptions)
 
+    async def _create_process(self, command, stdio, env, preexec):
+        python = shutil.which("python3", path=env.get("PATH"))
+        if python_zygote_enabled() and python:
+            try:
+                zygote = await get_zygote(python)
+                # the script and its arguments, after python3 -u
+                argv = shlex.split(command)[2:]
+                return await zygote.spawn(argv, self.work_dir, env, self.user, stdio)
+            except Exception as e:
+                logging.exception(f"{self.id} Zygote error, starting python3: {e}")
+        return await super()._create_process(command, stdio, env, preexec)
+
     async def _clean_up(self):
         try:
             if getattr(self, "_remove_entrypoint", None):
@@ -0,0 +1,118 @@
+# A python3 interpreter which runs code cells sent by further-link one after
+# another in the same namespace, so that what a cell imports and creates is
+# there for the next. It is started by kernel_process_handler.py with the same
+# python3 as runs, and must only import from the standard library.
+#
+# The kernel listens on the unix socket at the path further-link gives as its
+# argument, for one connection from further-link. Requests and replies are
+# lines of json:
+#
+#     {"type": "execute", "code": ...} -> {"type": "executed", "ok": ..., "error": ...}
+#     {"type": "reset"} -> {"type": "reset"}
+#
+# A running cell is interrupted by SIGINT, which raises KeyboardInterrupt in
+# it. The kernel exits when the connection closes or a cell exits.
+import ast
+import builtins
+import json
+import linecache
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+import types
+
+
+class Kernel:
+    def __init__(self):
+        self.cells = 0
+        self.reset()
+
+    def reset(self):
+        """Start again with an empty namespace, keeping imported modules."""
+        module = types.ModuleType("__main__")
+        module.__builtins__ = builtins
+        sys.modules["__main__"] = module
+        self.namespace = module.__dict__
+
+    def execute(self, code):
+        self.cells += 1
+        filename = f"<cell {self.cells}>"
+        # for tracebacks to show the cell's lines
+        linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+        # only interrupt cells, not the kernel between them
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            tree = ast.parse(code, filename)
+            # the value of a final expression is printed, as in the
+            # interactive interpreter
+            last = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last = ast.Interactive([tree.body.pop()])
+            exec(compile(tree, filename, "exec"), self.namespace)
+            if last is not None:
+                exec(compile(last, filename, "single"), self.namespace)
+            error = None
+        except SystemExit:
+            raise
+        except BaseException as e:
+            # leave out this frame, which a python3 run wouldn't have, and
+            # the parser's for syntax errors
+            tb = None if isinstance(e, SyntaxError) else e.__traceback__.tb_next
+            traceback.print_exception(type(e), e, tb)
+            error = type(e).__name__
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            sys.stdout.flush()
+            sys.stderr.flush()
+        return {"type": "executed", "ok": error is None, "error": error}
+
+
+def accept(listener):
+    # only further-link, running as root or the user, may send cells
+    while True:
+        conn, _ = listener.accept()
+        creds = conn.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", creds)
+        if uid in (0, os.getuid()):
+            return conn
+        conn.close()
+
+
+def main():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # modules are imported from the working directory, as for python3 runs
+    sys.path[0] = os.getcwd()
+    kernel = Kernel()
+
+    path = sys.argv.pop(1)  # cells see the arguments of a script run without any
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    try:
+        conn = accept(listener)
+    finally:
+        listener.close()
+        os.unlink(path)
+
+    with conn, conn.makefile("rwb") as channel:
+        for line in channel:
+            request = json.loads(line)
+            if request["type"] == "execute":
+                reply = kernel.execute(request["code"])
+            elif request["type"] == "reset":
+                kernel.reset()
+                reply = {"type": "reset"}
+            else:
+                continue
+            channel.write(json.dumps(reply).encode() + b"\n")
+            channel.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# python3 runs can be started by forking a zygote, an interpreter which has
+# already imported the modules that runs usually do, such as pitop and numpy,
+# rather than each starting a new interpreter which imports them itself. On a
+# Pi this takes the first output of a run from seconds to milliseconds. The
+# zygote runs zygote_server.py, there is one for each python3 interpreter used.
+import array
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import tempfile
+from typing import Dict, List, Optional
+
+from ..util import stats
+from ..util.user_config import get_current_user, get_gid, get_grp_ids, get_uid
+from .zygote_server import HEADER
+
+SERVER_SCRIPT = str(pathlib.Path(__file__).parent.absolute() / "zygote_server.py")
+
+DEFAULT_PRELOAD = ["pitop", "numpy", "PIL"]
+
+# preloading may take a while on a Pi
+READY_TIMEOUT = 60
+
+
+def python_zygote_enabled():
+    value = os.environ.get("FURTHER_LINK_PY_ZYGOTE", "0")
+    return value.lower() not in ("0", "false")
+
+
+def preload_modules() -> List[str]:
+    value = os.environ.get("FURTHER_LINK_PY_PRELOAD")
+    if value is None:
+        return DEFAULT_PRELOAD
+    return [module.strip() for module in value.split(",") if module.strip()]
+
+
+def _exit_code(status):
+    # as asyncio.subprocess.Process.returncode
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ZygoteProcess:
+    """
+    A run forked by a zygote, with the parts of asyncio.subprocess.Process
+    that ProcessHandler uses. Its exit is reported by the zygote.
+    """
+
+    def __init__(self, pid, connection, stdin=None, stdout=None, stderr=None):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self._exited = asyncio.ensure_future(self._wait_exit(*connection))
+
+    async def _wait_exit(self, reader, writer):
+        line = await reader.readline()
+        writer.close()
+        if line.startswith(b"exit "):
+            self.returncode = _exit_code(int(line.split()[1]))
+        else:
+            # the zygote stopped first, so the exit status is unknown
+            logging.warning(f"Zygote stopped before run {self.pid} exited")
+            self.returncode = -signal.SIGKILL
+        if self.stdin is not None:
+            self.stdin.close()
+        return self.returncode
+
+    async def wait(self):
+        return await asyncio.shield(self._exited)
+
+
+async def _pipe_reader(fd):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0)
+    )
+    return reader
+
+
+async def _pipe_writer(fd):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(fd, "wb", 0)
+    )
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+def _send_request(path, request, fds):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        body = json.dumps(request).encode()
+        data = HEADER.pack(len(body)) + body
+        ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+        sent = sock.sendmsg([data], ancdata)
+        sock.sendall(data[sent:])
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+class Zygote:
+    def __init__(self, python: str, preload: List[str]):
+        self.python = python
+        self.preload = preload
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._dir: Optional[str] = None
+        self.spawned = 0
+
+    @property
+    def path(self):
+        return os.path.join(self._dir, "zygote.sock") if self._dir else None
+
+    def is_running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        # only the further-link user may use the socket
+        self._dir = tempfile.mkdtemp(prefix="further-link-zygote-")
+        self.process = await asyncio.create_subprocess_exec(
+            self.python,
+            "-u",
+            SERVER_SCRIPT,
+            self.path,
+            *self.preload,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(), READY_TIMEOUT)
+            if line != b"ready\n":
+                raise RuntimeError(f"Zygote for {self.python} failed to start")
+        except BaseException:
+            await self.stop()
+            raise
+        logging.info(f"Zygote for {self.python} preloaded {', '.join(self.preload)}")
+
+    async def stop(self):
+        if self.process is not None:
+            if self.process.returncode is None:
+                self.process.stdin.close()  # the zygote exits
+                try:
+                    await asyncio.wait_for(self.process.wait(), 1)
+                except asyncio.TimeoutError:
+                    self.process.kill()
+                    await self.process.wait()
+            self.process = None
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    async def spawn(self, argv, cwd, env, user, stdio) -> ZygoteProcess:
+        """
+        Start a run of the python script argv[0] as user, with stdio either
+        the fd of a pty slave or asyncio.subprocess.PIPE.
+        """
+        request: Dict = {"argv": argv, "cwd": cwd, "env": env, "user": None}
+        if user != get_current_user():
+            request["user"] = {
+                "uid": get_uid(user),
+                "gid": get_gid(user),
+                "groups": get_grp_ids(user),
+            }
+
+        if stdio == asyncio.subprocess.PIPE:
+            pipes = [os.pipe() for _ in range(3)]
+            fds = [pipes[0][0], pipes[1][1], pipes[2][1]]
+            ends = [pipes[0][1], pipes[1][0], pipes[2][0]]
+        else:
+            fds = [stdio] * 3
+            ends = []
+
+        try:
+            sock = _send_request(self.path, request, fds)
+        except Exception:
+            for fd in ends:
+                os.close(fd)
+            raise
+        finally:
+            # the run has its own copies
+            if ends:
+                for fd in fds:
+                    os.close(fd)
+
+        sock.setblocking(False)
+        reader, writer = await asyncio.open_unix_connection(sock=sock)
+        line = await reader.readline()
+        if not line:
+            writer.close()
+            for fd in ends:
+                os.close(fd)
+            raise RuntimeError(f"Zygote for {self.python} failed to start run")
+
+        streams = {}
+        if ends:
+            streams = {
+                "stdin": await _pipe_writer(ends[0]),
+                "stdout": await _pipe_reader(ends[1]),
+                "stderr": await _pipe_reader(ends[2]),
+            }
+        self.spawned += 1
+        stats.count("zygote.spawned")
+        return ZygoteProcess(int(line), (reader, writer), **streams)
+
+
+_zygotes: Dict[str, Zygote] = {}
+_starting: Dict[str, asyncio.Future] = {}
+
+
+async def get_zygote(python: str) -> Zygote:
+    """The running zygote of the python3 interpreter, started if it isn't."""
+    zygote = _zygotes.get(python)
+    if zygote is not None and zygote.is_running():
+        return zygote
+    # runs started together wait for the same zygote
+    if python not in _starting:
+        _starting[python] = asyncio.ensure_future(_start_zygote(python))
+    return await asyncio.shield(_starting[python])
+
+
+async def _start_zygote(python: str) -> Zygote:
+    try:
+        previous = _zygotes.pop(python, None)
+        if previous is not None:
+            await previous.stop()
+        zygote = Zygote(python, preload_modules())
+        await zygote.start()
+        _zygotes[python] = zygote
+        return zygote
+    finally:
+        del _starting[python]
+
+
+async def stop_zygotes():
+    for zygote in list(_zygotes.values()):
+        await zygote.stop()
+    _zygotes.clear()
@@ -0,0 +1,279 @@
+# A python3 interpreter which imports the preload modules once, then forks a
+# child for each run so that runs start with them already imported. It is
+# started by zygote.py with the same interpreter that runs would use, and must
+# only import from the standard library:
+#
+#     python3 zygote_server.py <socket path> [<preload module>...]
+#
+# A run is requested on a connection to the unix socket, by sending the length
+# of a json request then the request, with the run's stdin, stdout and stderr
+# file descriptors attached. The zygote replies with a line with the pid of the
+# run, once it's the leader of its own session and process group, and once the
+# run has exited, a line with "exit" and its wait status.
+#
+# The zygote prints "ready" when it's listening and exits when its stdin is
+# closed, which happens when further-link stops.
+import array
+import atexit
+import gc
+import importlib
+import io
+import json
+import os
+import pkgutil  # noqa: F401 imported by runpy.run_path, preloaded for runs
+import runpy
+import selectors
+import signal
+import site
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+HEADER = struct.Struct("!I")
+STDIO_FDS = 3
+
+
+def receive_request(conn):
+    """The request and file descriptors sent on the connection."""
+    fds = array.array("i")
+    data = b""
+    while len(data) < HEADER.size:
+        chunk, ancdata, _, _ = conn.recvmsg(
+            HEADER.size - len(data), socket.CMSG_SPACE(STDIO_FDS * fds.itemsize)
+        )
+        if not chunk:
+            raise ConnectionError("Connection closed before request")
+        data += chunk
+        for level, kind, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(
+                    cmsg_data[: len(cmsg_data) - len(cmsg_data) % fds.itemsize]
+                )
+    (length,) = HEADER.unpack(data)
+    body = b""
+    while len(body) < length:
+        chunk = conn.recv(length - len(body))
+        if not chunk:
+            raise ConnectionError("Connection closed during request")
+        body += chunk
+    return json.loads(body), list(fds)
+
+
+def exit_code(code):
+    # as the interpreter handles SystemExit
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def print_exception(path):
+    # leave out the frames of this script and runpy, which a run started with
+    # python3 wouldn't have
+    exc_type, exc, tb = sys.exc_info()
+    while tb is not None and tb.tb_frame.f_code.co_filename != path:
+        tb = tb.tb_next
+    if tb is not None:
+        exc.__traceback__ = tb
+    sys.excepthook(exc_type, exc, exc.__traceback__)
+
+
+def set_stdio():
+    # as python3 -u creates them: unbuffered stdout and stderr
+    encoding = sys.stdout.encoding
+    streams = {
+        "stdin": io.TextIOWrapper(io.open(0, "rb", closefd=False), encoding=encoding),
+        "stdout": io.TextIOWrapper(
+            io.open(1, "wb", buffering=0, closefd=False),
+            encoding=encoding,
+            write_through=True,
+        ),
+        "stderr": io.TextIOWrapper(
+            io.open(2, "wb", buffering=0, closefd=False),
+            encoding=encoding,
+            errors="backslashreplace",
+            write_through=True,
+        ),
+    }
+    for name, stream in streams.items():
+        setattr(sys, name, stream)
+        setattr(sys, f"__{name}__", stream)
+
+
+def run(request, fds, ready):
+    """
+    In the forked child, become the run and never return. ready is closed once
+    the run is in its own session, before it's given to the requester.
+    """
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    # a new session and process group, as for runs started with python3. the
+    # requester uses the process group to stop the run, so it mustn't see the
+    # pid while the run is still in the zygote's
+    os.setsid()
+    os.close(ready)
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+    # the listening socket, connections and descriptors of other runs
+    os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+
+    user = request.get("user")
+    if user:
+        os.setgid(user["gid"])
+        os.setgroups(user["groups"])
+        # must do this after setting groups as it reduces privilege
+        os.setuid(user["uid"])
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+
+    path = request["argv"][0]
+    sys.argv = list(request["argv"])
+    sys.path[0] = os.path.dirname(path)
+    # the user site packages are those of the run's user, not the zygote's
+    if site.ENABLE_USER_SITE:
+        if site.USER_SITE in sys.path:
+            sys.path.remove(site.USER_SITE)
+        site.USER_BASE = site.USER_SITE = None
+        user_site = site.getusersitepackages()
+        if os.path.isdir(user_site):
+            site.addsitedir(user_site)
+
+    set_stdio()
+
+    code = 0
+    interrupted = False
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        code = exit_code(e.code)
+    except KeyboardInterrupt:
+        print_exception(path)
+        interrupted = True
+    except BaseException:
+        print_exception(path)
+        code = 1
+
+    # as the interpreter does on exit
+    try:
+        threading._shutdown()
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException:
+        code = code or 1
+    if interrupted:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGINT)
+    os._exit(code)
+
+
+def serve(path):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    # exited children are noticed in the select loop
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, "accept")
+    selector.register(wakeup_r, selectors.EVENT_READ, "wakeup")
+    selector.register(0, selectors.EVENT_READ, "stdin")
+
+    # objects made so far will live as long as the zygote, keeping them out of
+    # collections avoids copying their pages in each child
+    gc.freeze()
+
+    print("ready", flush=True)
+
+    connections = {}  # by pid
+    while True:
+        for key, _ in selector.select():
+            if key.data == "stdin":
+                if not os.read(0, 1024):
+                    return
+            elif key.data == "wakeup":
+                os.read(wakeup_r, 1024)
+                while connections:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        break
+                    if pid == 0:
+                        break
+                    conn = connections.pop(pid, None)
+                    if conn is not None:
+                        try:
+                            conn.sendall(f"exit {status}\n".encode())
+                        except OSError:
+                            pass
+                        conn.close()
+            elif key.data == "accept":
+                conn, _ = listener.accept()
+                fds = []
+                try:
+                    creds = conn.getsockopt(
+                        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+                    )
+                    _, uid, _ = struct.unpack("3i", creds)
+                    if uid != os.getuid():
+                        raise PermissionError(f"Request from uid {uid}")
+                    conn.settimeout(5)
+                    request, fds = receive_request(conn)
+                    if len(fds) != STDIO_FDS:
+                        raise ValueError(f"Request with {len(fds)} fds")
+                    ready_r, ready_w = os.pipe()
+                    pid = os.fork()
+                    if pid == 0:
+                        try:
+                            os.close(ready_r)
+                            run(request, fds, ready_w)
+                        except BaseException:
+                            traceback.print_exc()
+                        finally:
+                            os._exit(1)
+                    os.close(ready_w)
+                    connections[pid] = conn
+                    # wait for the run's setsid, so its pgid is its pid
+                    try:
+                        os.read(ready_r, 1)
+                    finally:
+                        os.close(ready_r)
+                    conn.sendall(f"{pid}\n".encode())
+                except Exception as e:
+                    print(f"zygote: {e}", file=sys.stderr)
+                    conn.close()
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+
+
+def main():
+    path = sys.argv[1]
+    for module in sys.argv[2:]:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"zygote: not preloading {module}: {e}", file=sys.stderr)
+    try:
+        serve(path)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
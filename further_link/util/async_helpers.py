@@ -1,6 +1,8 @@
 import asyncio
+import codecs
 from collections import deque
-from concurrent.futures import TimeoutError
+
+from .rate_limit import TokenBucket
 
 
 async def loop_forever(*args, **kwargs):
@@ -32,65 +34,385 @@ async def stream_read(stream, chunk_size):
         pass  # probably stream was closed by end of process
 
 
+def utf8_boundary(data, n):
+    """Largest length <= n which doesn't split a utf-8 character in data."""
+    if n >= len(data):
+        return len(data)
+    # step back over continuation bytes to the start of the split character
+    boundary = n
+    while boundary > 0 and (data[boundary] & 0xC0) == 0x80:
+        boundary -= 1
+    return boundary
+
+
+def _split_text(text, nbytes, n, round_up=False):
+    """
+    Split text, which is nbytes long in utf-8, after its first n bytes without
+    splitting a character. Only text with multibyte characters is encoded.
+    Returns the head, the tail and the tail's length in bytes.
+    """
+    if nbytes == len(text):
+        # one byte per character, bytes and characters line up
+        return text[:n], text[n:], nbytes - n
+    data = text.encode()
+    boundary = utf8_boundary(data, n)
+    if round_up and boundary < n:
+        # step forward to the end of the split character instead
+        boundary = n
+        while boundary < len(data) and (data[boundary] & 0xC0) == 0x80:
+            boundary += 1
+    tail = data[boundary:]
+    return data[:boundary].decode(), tail.decode(), len(tail)
+
+
+class RingBuffer:
+    """
+    Text buffer, sized in utf-8 bytes, which drops the oldest text beyond
+    max_bytes, counting the bytes and the appended chunks that were dropped.
+    Text is only ever split between characters.
+
+    If given, transform is applied to the buffered text before dropping any
+    of it, in case that makes it fit. To bound the cost it is only applied
+    once half the buffer has been appended since it was last applied.
+    """
+
+    def __init__(self, max_bytes=None, transform=None):
+        self.max_bytes = max_bytes
+        self.transform = transform
+        self._untransformed = 0  # bytes appended since transform was applied
+        self.size = 0
+        self.dropped_bytes = 0
+        self.dropped_chunks = 0
+        self._chunks = deque()  # (text, length in bytes)
+        self._front_trimmed = False  # front chunk already counted as dropped
+
+    def __bool__(self):
+        return self.size > 0
+
+    def append(self, text, nbytes=None):
+        if nbytes is None:
+            nbytes = len(text.encode())
+        if not nbytes:
+            return
+        self._chunks.append((text, nbytes))
+        self.size += nbytes
+        self._untransformed += nbytes
+
+        if self.max_bytes is None:
+            return
+        excess = self.size - self.max_bytes
+        if excess > 0 and self.transform and self._untransformed * 2 >= self.max_bytes:
+            self.apply(self.transform)
+            excess = self.size - self.max_bytes
+        while excess > 0:
+            oldest, oldest_bytes = self._chunks[0]
+            if not self._front_trimmed:
+                self.dropped_chunks += 1
+            if oldest_bytes <= excess:
+                self._chunks.popleft()
+                self._front_trimmed = False
+                dropped = oldest_bytes
+            else:
+                # drop the whole of any character the excess ends inside
+                _, tail, tail_bytes = _split_text(
+                    oldest, oldest_bytes, excess, round_up=True
+                )
+                self._chunks[0] = (tail, tail_bytes)
+                self._front_trimmed = True
+                dropped = oldest_bytes - tail_bytes
+            self.size -= dropped
+            self.dropped_bytes += dropped
+            excess -= dropped
+
+    def peek(self):
+        return "".join(text for text, _ in self._chunks)
+
+    def apply(self, function):
+        """Replace the buffered text with function applied to it."""
+        if not self._chunks:
+            return
+        text = function(self.peek())
+        nbytes = len(text.encode())
+        self._chunks.clear()
+        self._chunks.append((text, nbytes))
+        self._front_trimmed = False
+        self.size = nbytes
+        self._untransformed = 0
+
+    def take(self, n):
+        """
+        Remove and return the text in up to n bytes from the front of the
+        buffer. Less is returned if n ends inside a character.
+        """
+        taken = []
+        while self._chunks and n > 0:
+            text, nbytes = self._chunks[0]
+            if nbytes <= n:
+                self._chunks.popleft()
+                self._front_trimmed = False
+                taken.append(text)
+                self.size -= nbytes
+                n -= nbytes
+                continue
+            head, tail, tail_bytes = _split_text(text, nbytes, n)
+            if head:
+                self._chunks[0] = (tail, tail_bytes)
+                taken.append(head)
+                self.size -= nbytes - tail_bytes
+            break
+        return "".join(taken)
+
+
+def _set_done(future):
+    if future is not None and not future.done():
+        future.set_result(None)
+
+
+class FlushPolicy:
+    """
+    Decides how long to let output build up before flushing it.
+
+    Output arriving after the stream has been idle for idle_time, such as a
+    keystroke echo, is flushed after min_window, which only needs to be long
+    enough to gather the separate writes of one print. While output keeps
+    arriving the window doubles with each flush, up to max_window, so bulk
+    output is batched into fewer, larger messages.
+    """
+
+    def __init__(self, min_window=0.005, max_window=0.1, idle_time=0.05):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.idle_time = idle_time
+        self._window = min_window
+        self._last_flush = float("-inf")
+
+    def window(self, now):
+        """Seconds to wait, from now, before flushing output which has arrived."""
+        if now - self._last_flush > self.idle_time:
+            self._window = self.min_window
+        else:
+            self._window = min(self.max_window, max(self._window * 2, 0.001))
+        return self._window
+
+    def flushed(self, now):
+        self._last_flush = now
+
+
+class RingbufReader:
+    """
+    Reads a stream into a ring buffer and flushes it to a callback, after a
+    window chosen by a FlushPolicy so that interactive output is sent at once
+    while bulk output is batched.
+
+    The stream is decoded as utf-8 as it is read, by an incremental decoder
+    which carries characters split between reads over to the next read. The
+    ring buffer holds the decoded text, so flushes only join what they send
+    and characters are never split by a flush or by dropping data.
+
+    A single reader task lives for the whole read and is only woken by the
+    stream becoming readable or reaching EOF. The done condition is awaited
+    once, rather than raced against every chunk, and the flush loop sleeps
+    until there is data to send.
+
+    Output is rate limited by a byte counting token bucket, either created
+    from kBps or passed in as limiter. The ring buffer holds as many bytes as
+    the limit allows per buffer_time, which is also the default longest flush
+    window, so if the stream produces faster than the limit the oldest data is
+    dropped.
+
+    A transform, such as compacting terminal output, can be applied to the
+    buffered text before each flush and before dropping any of it, so the
+    rate limit only counts the text that will be sent.
+
+    Dropped data is reported to on_dropped with the number of bytes and
+    chunks lost since the previous report, before the output that follows it.
+
+    In lossless mode nothing is dropped, instead reading stops while the
+    buffer is full. The stream's own buffers then fill and the writing
+    process blocks. Once the done condition is met reading continues until
+    the stream is idle, so output left behind by the process is still sent.
+    """
+
+    buffer_time = 0.1
+    chunk_size = 256
+    # buffer size in lossless mode when there's no rate limit to size it by
+    lossless_buffer = 2**16
+    # how long the stream must be idle after the done condition to stop reading
+    drain_time = 0.1
+
+    def __init__(
+        self,
+        stream,
+        output_callback=None,
+        done_condition=loop_forever,
+        kBps=0,
+        limiter=None,
+        lossless=False,
+        on_dropped=None,
+        transform=None,
+        flush_policy=None,
+    ):
+        self.stream = stream
+        self.output_callback = output_callback
+        self.done_condition = done_condition
+        self.lossless = lossless
+        self.on_dropped = on_dropped
+        self.transform = transform
+        self.flush_policy = flush_policy or FlushPolicy(max_window=self.buffer_time)
+
+        # the bucket can burst two flushes worth so that late flushes don't
+        # waste tokens
+        self.limiter = (
+            limiter
+            if limiter is not None
+            else TokenBucket(kBps, burst=int(kBps * self.buffer_time * 2000))
+        )
+        # example limit 128kBps = 12800 bytes buffered per 0.1s
+        self.capacity = (
+            self.lossless_buffer
+            if self.limiter.unlimited
+            else max(int(self.limiter.rate * self.buffer_time), 1)
+        )
+        self.ringbuf = RingBuffer(
+            None if lossless or self.limiter.unlimited else self.capacity,
+            transform,
+        )
+        # invalid utf-8 is replaced rather than ending the stream
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._data_waiter = None
+        self._space_waiter = None
+        self._last_read = 0
+        self._reported_bytes = 0
+        self._reported_chunks = 0
+
+    async def _read(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if self.lossless and self.ringbuf.size >= self.capacity:
+                    # stop reading until the buffer has been flushed
+                    self._space_waiter = loop.create_future()
+                    try:
+                        await self._space_waiter
+                    finally:
+                        self._space_waiter = None
+
+                result = await stream_read(self.stream, self.chunk_size)
+                if not result:
+                    break  # EOF or stream closed
+
+                self._last_read = loop.time()
+                self._append(result)
+                _set_done(self._data_waiter)
+        finally:
+            # anything left of an incomplete character is replaced
+            self._append(b"", final=True)
+
+    def _append(self, data, final=False):
+        # the decoder holds on to a character split between reads until the
+        # rest of it arrives, so the bytes it used may differ from len(data)
+        carried = len(self._decoder.getstate()[0])
+        text = self._decoder.decode(data, final)
+        nbytes = carried + len(data) - len(self._decoder.getstate()[0])
+        self.ringbuf.append(text, nbytes)
+
+    async def _report_dropped(self):
+        dropped_bytes = self.ringbuf.dropped_bytes - self._reported_bytes
+        if not dropped_bytes:
+            return
+        dropped_chunks = self.ringbuf.dropped_chunks - self._reported_chunks
+        self._reported_bytes = self.ringbuf.dropped_bytes
+        self._reported_chunks = self.ringbuf.dropped_chunks
+        if self.on_dropped:
+            await self.on_dropped(dropped_bytes, dropped_chunks)
+
+    async def _flush(self):
+        await self._report_dropped()
+        if not self.ringbuf:
+            return
+        if self.transform:
+            self.ringbuf.apply(self.transform)
+        size = self.ringbuf.size
+        output = self.ringbuf.take(int(min(size, self.limiter.available())))
+        # tokens for the bytes taken, fewer if the limit ends inside a character
+        self.limiter.consume(size - self.ringbuf.size)
+        if self.ringbuf.size < self.capacity:
+            _set_done(self._space_waiter)
+        if output and self.output_callback:
+            await self.output_callback(output)
+
+    def _stop_reading(self, reader):
+        if not self.lossless:
+            reader.cancel()
+            return
+
+        # keep reading what was left behind until the stream goes idle
+        loop = asyncio.get_running_loop()
+
+        def stop_when_idle():
+            if reader.done():
+                return
+            busy = loop.time() - self._last_read < self.drain_time
+            if busy or self._space_waiter is not None:
+                loop.call_later(self.drain_time, stop_when_idle)
+            else:
+                reader.cancel()
+
+        loop.call_later(self.drain_time, stop_when_idle)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        reader = loop.create_task(self._read())
+        done = asyncio.ensure_future(self.done_condition())
+        # when the done condition is met stop reading, the final flush below
+        # still handles anything left in the ring buffer
+        done.add_done_callback(lambda _: self._stop_reading(reader))
+
+        try:
+            while not reader.done():
+                if not self.ringbuf:
+                    # sleep until the reader has data or finishes
+                    self._data_waiter = loop.create_future()
+                    await asyncio.wait(
+                        [self._data_waiter, reader],
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    self._data_waiter = None
+
+                # let data buffer in ringbuf for the window or until reader ends
+                window = self.flush_policy.window(loop.time())
+                if window > 0:
+                    await asyncio.wait([reader], timeout=window)
+                await self._flush()
+                self.flush_policy.flushed(loop.time())
+
+            while self.ringbuf:
+                await asyncio.sleep(self.limiter.delay(self.ringbuf.size))
+                await self._flush()
+        finally:
+            done.cancel()
+            reader.cancel()
+
+
 async def ringbuf_read(
     stream,
     output_callback=None,
     done_condition=loop_forever,
     kBps=0,
+    limiter=None,
+    lossless=False,
+    on_dropped=None,
+    transform=None,
+    flush_policy=None,
 ):
-    buffer_time = 0.1
-    chunk_size = 256  # this is too large to support kBps < 3, that's ok
-    max_chunks = None if kBps == 0 else int(kBps * buffer_time * 1000 / chunk_size)
-
-    # stream is read into a ring buffer so that if produces faster desired
-    # limit the oldest data is dumped
-    # example limit 128kBps = 50 max_chunks * 256 byte chunk_size / 0.1s
-
-    ringbuf = deque(maxlen=max_chunks)
-    completed = False
-
-    async def read():
-        nonlocal completed
-        while True:
-            read_data = asyncio.create_task(stream_read(stream, chunk_size))
-            wait_done = asyncio.create_task(done_condition())
-
-            done = await race([read_data, wait_done])
-
-            if read_data not in done:
-                completed = True
-                break
-
-            result = read_data.result()
-
-            if result == b"":
-                completed = True
-                break
-
-            ringbuf.append(read_data.result())
-
-    async def write():
-        nonlocal completed
-        while True:
-            # let data buffer in ringbuf for buffer_time or until process ends
-            # if process ends ringbuf still needs to be handled
-            try:
-                await asyncio.wait_for(done_condition(), timeout=buffer_time)
-                completed = True
-            except (TimeoutError, asyncio.TimeoutError):
-                pass
-
-            data = b"".join(ringbuf)
-            if data:
-                ringbuf.clear()
-                output = data.decode(encoding="utf-8")
-                if output_callback:
-                    await output_callback(output)
-            if completed:
-                break
-
-    # when read is completed it will set a flag causing write to complete after
-    # flushing a final time
-    return await asyncio.wait(
-        [asyncio.create_task(read()), asyncio.create_task(write())]
-    )
+    await RingbufReader(
+        stream,
+        output_callback=output_callback,
+        done_condition=done_condition,
+        kBps=kBps,
+        limiter=limiter,
+        lossless=lossless,
+        on_dropped=on_dropped,
+        transform=transform,
+        flush_policy=flush_policy,
+    ).run()
@@ -67,6 +67,8 @@ def FurtherGattService():
             logging.debug(f"Writing value '{value}' to {char.uuid}")
             if isinstance(value, str):
                 value = bytearray(value, "utf-8")
+            elif isinstance(value, bytes):
+                value = bytearray(value)  # binary messages
 
             # Generate a random id
             id = randint(0, pow(2, 8 * PtMessageFormat.CHUNK_MESSAGE_ID_SIZE) - 1)
@@ -9,15 +9,21 @@ from bluez_peripheral.gatt.characteristic import characteristic
 from bluez_peripheral.gatt.service import Service
 from bluez_peripheral.uuid16 import UUID16
 
+from further_link.util import json_codec
+
 
 def bytearray_to_dict(message: bytearray) -> Dict:
-    message_str = message.decode()
+    try:
+        return json_codec.loads(message)
+    except json.decoder.JSONDecodeError:
+        pass
 
     # remove trailing commas
+    message_str = message.decode()
     message_str = re.sub(",[ \t\r\n]+}", "}", message_str)
     message_str = re.sub(",[ \t\r\n]+]", "]", message_str)
 
-    return json.loads(message_str)
+    return json_codec.loads(message_str)
 
 
 def get_raspberry_pi_serial() -> str:
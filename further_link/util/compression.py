@@ -0,0 +1,233 @@
+# permessage-deflate (RFC 7692) compression of /run websocket messages.
+# aiohttp negotiates the extension with the client, but always compresses at
+# its fastest level and compresses every frame, so data frames are compressed
+# and written here, where the level, window size and the size below which
+# frames are sent uncompressed can be chosen and the cost measured. Control
+# frames, such as close and pong, are still sent by aiohttp.
+#
+# aiohttp's writer has no way to send a frame that is already compressed, so
+# frames are written to the transport of the stream writer aiohttp's prepare
+# returns, which is how aiohttp's own writer sends them too. test_compression
+# checks this against the installed aiohttp.
+import os
+import struct
+import time
+import zlib
+from typing import Dict
+
+FURTHER_LINK_WS_COMPRESS = "FURTHER_LINK_WS_COMPRESS"
+FURTHER_LINK_WS_COMPRESS_LEVEL = "FURTHER_LINK_WS_COMPRESS_LEVEL"
+FURTHER_LINK_WS_WINDOW_BITS = "FURTHER_LINK_WS_WINDOW_BITS"
+FURTHER_LINK_WS_COMPRESS_THRESHOLD = "FURTHER_LINK_WS_COMPRESS_THRESHOLD"
+
+DEFAULT_LEVEL = 1  # zlib's fastest, as aiohttp uses
+DEFAULT_WINDOW_BITS = 15
+DEFAULT_THRESHOLD = 0  # bytes, smaller messages are sent uncompressed
+MIN_WINDOW_BITS = 9  # zlib doesn't support raw deflate with 8
+MAX_WINDOW_BITS = 15
+
+TEXT = 0x1
+BINARY = 0x2
+COMPRESSED = 0x40  # RSV1, set on compressed frames
+DEFLATE_TRAILER = b"\x00\x00\xff\xff"
+
+
+def _parse_int(value, default, low, high):
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return default
+    return n if low <= n <= high else default
+
+
+def _parse_bool(value, default):
+    if value is None:
+        return default
+    return value.lower() in ("1", "true")
+
+
+class CompressionSettings:
+    def __init__(
+        self,
+        enabled=True,
+        level=DEFAULT_LEVEL,
+        window_bits=DEFAULT_WINDOW_BITS,
+        threshold=DEFAULT_THRESHOLD,
+    ):
+        self.enabled = enabled
+        self.level = level
+        self.window_bits = window_bits
+        self.threshold = threshold
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=_parse_bool(os.environ.get(FURTHER_LINK_WS_COMPRESS), True),
+            level=_parse_int(
+                os.environ.get(FURTHER_LINK_WS_COMPRESS_LEVEL), DEFAULT_LEVEL, 0, 9
+            ),
+            window_bits=_parse_int(
+                os.environ.get(FURTHER_LINK_WS_WINDOW_BITS),
+                DEFAULT_WINDOW_BITS,
+                MIN_WINDOW_BITS,
+                MAX_WINDOW_BITS,
+            ),
+            threshold=_parse_int(
+                os.environ.get(FURTHER_LINK_WS_COMPRESS_THRESHOLD),
+                DEFAULT_THRESHOLD,
+                0,
+                2**32,
+            ),
+        )
+
+    def with_query(self, query):
+        """These settings overridden by a connection's query parameters."""
+        return CompressionSettings(
+            enabled=_parse_bool(query.get("compress"), self.enabled),
+            level=_parse_int(query.get("compressLevel"), self.level, 0, 9),
+            window_bits=_parse_int(
+                query.get("windowBits"),
+                self.window_bits,
+                MIN_WINDOW_BITS,
+                MAX_WINDOW_BITS,
+            ),
+            threshold=_parse_int(
+                query.get("compressThreshold"), self.threshold, 0, 2**32
+            ),
+        )
+
+
+def create_frame(payload: bytes, opcode: int, rsv: int = 0) -> bytes:
+    # frames sent by a server aren't masked
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | rsv | opcode, length)
+    elif length < 2**16:
+        header = struct.pack("!BBH", 0x80 | rsv | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | rsv | opcode, 127, length)
+    return header + payload
+
+
+class DeflateSender:
+    """
+    Sends the data frames of a websocket which negotiated permessage-deflate,
+    on the transport of the stream writer returned by preparing the socket.
+    Like aiohttp's own sends, nothing is sent once the socket is closing, so
+    that no data frame follows its close frame, and sends wait while the
+    transport's buffer is full.
+
+    window_bits is the window the client agreed to, the smaller of it and the
+    settings' window is used. With no_context_takeover each message is
+    compressed on its own, otherwise messages refer back to earlier ones,
+    which is what makes small similar messages compress well.
+
+    Counts the bytes before and after compression and the CPU time spent
+    compressing, for the connection's stats.
+    """
+
+    def __init__(
+        self,
+        socket,
+        writer,
+        settings,
+        window_bits=MAX_WINDOW_BITS,
+        no_context_takeover=False,
+    ):
+        self.socket = socket
+        self.writer = writer
+        self.settings = settings
+        self.window_bits = max(min(settings.window_bits, window_bits), MIN_WINDOW_BITS)
+        self._flush_mode = (
+            zlib.Z_FULL_FLUSH if no_context_takeover else zlib.Z_SYNC_FLUSH
+        )
+        self._compressor = zlib.compressobj(
+            settings.level, zlib.DEFLATED, -self.window_bits
+        )
+
+        self.frames = 0
+        self.compressed_frames = 0
+        self.bytes_in = 0  # of the messages
+        self.bytes_out = 0  # of the frames' payloads
+        self.cpu_time = 0.0
+
+    def compress(self, data: bytes) -> bytes:
+        start = time.thread_time()
+        compressed = self._compressor.compress(data) + self._compressor.flush(
+            self._flush_mode
+        )
+        self.cpu_time += time.thread_time() - start
+        # the trailer which every flush ends with is left for the client to add
+        return compressed[: -len(DEFLATE_TRAILER)]
+
+    def is_closing(self):
+        transport = self.writer.transport
+        return (
+            self.socket.closed
+            # private to aiohttp, set once a close has started rather than
+            # when it has finished, as closed is
+            or getattr(self.socket, "_closing", False)
+            or transport is None
+            or transport.is_closing()
+        )
+
+    async def send(self, data: bytes, opcode=TEXT):
+        if self.is_closing():
+            raise ConnectionResetError("Cannot write to closing websocket")
+
+        # compressed and written without yielding, so frames can't interleave
+        # and the compressor's state always matches what the client has seen
+        if len(data) < self.settings.threshold:
+            payload = data
+            self.writer.transport.write(create_frame(payload, opcode))
+        else:
+            payload = self.compress(data)
+            self.writer.transport.write(create_frame(payload, opcode, COMPRESSED))
+            self.compressed_frames += 1
+
+        self.frames += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(payload)
+
+        await self.writer.drain()
+
+    async def send_str(self, data: str):
+        await self.send(data.encode(), TEXT)
+
+    async def send_bytes(self, data: bytes):
+        await self.send(data, BINARY)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": True,
+            "level": self.settings.level,
+            "window_bits": self.window_bits,
+            "threshold": self.settings.threshold,
+            "frames": self.frames,
+            "compressed_frames": self.compressed_frames,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1,
+            "cpu_seconds": self.cpu_time,
+            "cpu_us_per_kB": (
+                self.cpu_time * 1e6 / (self.bytes_in / 1000) if self.bytes_in else 0
+            ),
+        }
+
+
+def negotiated_sender(socket, writer, settings):
+    """
+    A DeflateSender for a websocket and the writer returned by preparing it, or
+    None if the client didn't accept permessage-deflate.
+    """
+    window_bits = socket.compress
+    if not settings.enabled or not window_bits:
+        return None
+    extensions = socket.headers.get("Sec-WebSocket-Extensions", "")
+    return DeflateSender(
+        socket,
+        writer,
+        settings,
+        window_bits=MAX_WINDOW_BITS if window_bits is True else window_bits,
+        no_context_takeover="server_no_context_takeover" in extensions,
+    )
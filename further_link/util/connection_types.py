@@ -6,7 +6,31 @@ class ConnectionType(Enum):
     WEBSOCKET = 2
 
 
+# initial guesses, which are adjusted to each connection's measured bandwidth
+# within bandwidth_ranges_kBps
 bandwidth_limits_kBps = {
     ConnectionType.BLUETOOTH: 8,
     ConnectionType.WEBSOCKET: 128,
 }
+
+# bluetooth notifications are sent without waiting for the link, so there is
+# nothing to measure and its guess is kept
+bandwidth_ranges_kBps = {
+    ConnectionType.WEBSOCKET: (16, 8192),
+}
+
+# relative share of a connection's bandwidth given to each output channel when
+# several are busy at once, so that interactive text isn't starved by video
+channel_bandwidth_weights = {
+    "stdout": 4,
+    "stderr": 4,
+    "keylisten": 4,
+    "video": 1,
+}
+
+# most bytes of messages waiting to be sent on a connection, beyond which text
+# output waits and video frames are dropped
+send_queue_limits_bytes = {
+    ConnectionType.BLUETOOTH: 2**15,
+    ConnectionType.WEBSOCKET: 2**20,
+}
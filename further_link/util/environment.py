@@ -0,0 +1,113 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from .sdk import X11_DIR, get_first_display
+from .user_config import get_home_directory, get_shell, get_xdg_runtime_dir, identities
+
+# the parent of users' XDG_RUNTIME_DIRs, created and removed at log in and out
+XDG_RUNTIME_PARENT = "/run/user"
+
+
+def _environ_data():
+    # os.environ decodes every variable when copied or compared, which takes
+    # longer than using a template saves. The encoded variables it keeps in
+    # _data are much cheaper to compare with those a template was built from,
+    # but _data is a CPython internal, so os.environ itself is compared where
+    # it's missing
+    return getattr(os.environ, "_data", os.environ)
+
+
+def _dir_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class _Template:
+    def __init__(self, env, environ, passwd, stamp):
+        self.env = env
+        self.environ = environ
+        self.passwd = passwd
+        self.stamp = stamp
+
+
+class EnvironmentTemplates:
+    """
+    The environments of processes started for each user, runner environment
+    and display setting, built once rather than for every process, so that
+    starting one only has to copy the template and set PWD and DISPLAY.
+
+    A template is built again once what it was built from has changed: this
+    process's environment, the user's passwd entry, the users logged in (for
+    XDG_RUNTIME_DIR) or the displays (for DISPLAY).
+    """
+
+    def __init__(self):
+        self._templates: Dict[Tuple, _Template] = {}
+
+    def clear(self):
+        self._templates.clear()
+
+    def environment(self, user, work_dir, env={}, display=None) -> Dict[str, str]:
+        """
+        The environment of a process of user run in work_dir, with the
+        runner's env. DISPLAY is display, or the first display if None.
+        """
+        template = self._template(user, env, display is None)
+        process_env = dict(template.env)
+        if user:
+            process_env["PWD"] = work_dir
+        if display is not None:
+            process_env["DISPLAY"] = display
+        return process_env
+
+    def _template(self, user, env, default_display) -> _Template:
+        key = (user, tuple(sorted(env.items())), default_display)
+        environ = _environ_data()
+        passwd = identities.passwd(user)
+        stamp = self._stamp(default_display)
+
+        template = self._templates.get(key)
+        if (
+            template is None
+            or template.passwd is not passwd
+            or template.stamp != stamp
+            or template.environ != environ
+        ):
+            template = _Template(
+                self._build(user, env, default_display), dict(environ), passwd, stamp
+            )
+            self._templates[key] = template
+        return template
+
+    @staticmethod
+    def _stamp(default_display) -> Tuple:
+        x11 = _dir_stamp(X11_DIR) if default_display else None
+        return _dir_stamp(XDG_RUNTIME_PARENT), x11
+
+    @staticmethod
+    def _build(user, env, default_display) -> Dict[str, str]:
+        process_env = {**os.environ.copy(), **env}
+        process_env["TERM"] = "xterm-256color"  # perhaps should be param
+
+        if user:
+            process_env["USER"] = user
+            process_env["LOGNAME"] = user
+            process_env["HOME"] = get_home_directory(user)
+            process_env["XDG_RUNTIME_DIR"] = get_xdg_runtime_dir(user)
+            process_env["SHELL"] = get_shell(user)
+            # remove None values
+            process_env = {k: v for k, v in process_env.items() if v is not None}
+
+        # set $DISPLAY so that user can open GUI windows
+        if default_display:
+            first_display: Optional[str] = get_first_display()
+            if first_display:
+                process_env["DISPLAY"] = first_display
+
+        return process_env
+
+
+environments = EnvironmentTemplates()
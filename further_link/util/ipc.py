@@ -3,6 +3,7 @@ import os
 import socket
 from time import sleep
 
+from .rate_limit import TokenBucket
 from .sdk import Singleton
 
 # buffer limit for our socket read streams. this is the limit for the size on an
@@ -94,10 +95,15 @@ def start_ipc_server(channel, handle_message=None, pgid=None, kBps=128):
             sleep(buffer_time)
 
 
-async def async_start_ipc_server(channel, handle_message=None, pgid=None, kBps=128):
-    buffer_time = 0 if kBps == 0 else MAX_BUFFER / kBps / 1000
-
+async def async_start_ipc_server(
+    channel, handle_message=None, pgid=None, kBps=128, limiter=None
+):
     async def handle_connection(reader, _):
+        # messages are read at the rate the limiter allows, backing up the
+        # sender when it produces faster
+        connection_limiter = (
+            limiter if limiter is not None else TokenBucket(kBps, burst=MAX_BUFFER)
+        )
         incomplete_message = ""
 
         while True:
@@ -117,7 +123,7 @@ async def async_start_ipc_server(channel, handle_message=None, pgid=None, kBps=1
                 for c in complete_messages:
                     await handle_message(c)
 
-            await asyncio.sleep(buffer_time)
+            await connection_limiter.acquire(len(data))
 
     ipc_filepath = _get_ipc_filepath(channel, pgid=pgid)
     # set the read buffer size when creating the server
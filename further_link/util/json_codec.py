@@ -0,0 +1,99 @@
+# JSON encoding of messages, which happens for every chunk of output and every
+# message received. orjson is used when it's installed, as it's several times
+# faster than the json module, which is used otherwise. The backend is chosen
+# once, when this is imported, and can be forced with FURTHER_LINK_JSON=json.
+#
+# JSON messages are sent exactly as json.dumps formats them, ascii only with
+# spaces after separators, which orjson can't produce. So orjson parses
+# messages, but only encodes the long strings, such as output, that it
+# escapes the same way as json.dumps.
+import json
+import logging
+import os
+
+# the C escaping, which is missing from the type stubs
+from json.encoder import encode_basestring_ascii  # type: ignore[attr-defined]
+
+FURTHER_LINK_JSON = "FURTHER_LINK_JSON"
+
+# below this length the json module's escaping is faster than calling orjson
+ORJSON_MIN_STRING = 128
+
+
+class StdlibJson:
+    name = "json"
+
+    @staticmethod
+    def encode_string(string: str) -> str:
+        return encode_basestring_ascii(string)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
+    @staticmethod
+    def dumps_bytes(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class Orjson:
+    """
+    orjson, falling back to the json module for what orjson rejects but json
+    accepts, such as integers over 64 bits or lone surrogates. orjson's
+    decoding errors are JSONDecodeErrors too.
+    """
+
+    name = "orjson"
+
+    def __init__(self, orjson):
+        self._orjson = orjson
+
+    def encode_string(self, string: str) -> str:
+        # orjson leaves non-ascii characters and DEL unescaped
+        if (
+            len(string) >= ORJSON_MIN_STRING
+            and string.isascii()
+            and "\x7f" not in string
+        ):
+            return self._orjson.dumps(string).decode()
+        return encode_basestring_ascii(string)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
+    def dumps_bytes(self, obj) -> bytes:
+        # compact utf-8, for encodings which aren't tied to json.dumps' format
+        try:
+            return self._orjson.dumps(obj)
+        except TypeError:
+            return json.dumps(obj).encode()
+
+    def loads(self, data):
+        try:
+            return self._orjson.loads(data)
+        except ValueError:
+            return json.loads(data)
+
+
+def _select_backend():
+    if os.environ.get(FURTHER_LINK_JSON, "") == StdlibJson.name:
+        return StdlibJson()
+    try:
+        import orjson
+    except ImportError:
+        return StdlibJson()
+    return Orjson(orjson)
+
+
+backend = _select_backend()
+logging.debug(f"Using {backend.name} for JSON messages")
+
+encode_string = backend.encode_string
+dumps = backend.dumps
+dumps_bytes = backend.dumps_bytes
+loads = backend.loads
@@ -1,31 +1,78 @@
+import binascii
 import json
-from typing import Dict
+from base64 import b64decode, b64encode
+from typing import Dict, List
+
+from . import json_codec
 
 
 class BadMessage(Exception):
     pass
 
 
+def _to_json(value) -> str:
+    if type(value) is str:
+        return json_codec.encode_string(value)
+    if value is None:
+        return "null"
+    return json_codec.dumps(value)
+
+
+def _data_to_json(data) -> str:
+    # most messages carry a single string, such as output
+    if type(data) is dict and len(data) == 1:
+        for key, value in data.items():
+            if type(key) is str and type(value) is str:
+                return (
+                    "{"
+                    + json_codec.encode_string(key)
+                    + ": "
+                    + json_codec.encode_string(value)
+                    + "}"
+                )
+    return _to_json(data)
+
+
 def create_message(msg_type, msg_client, msg_data=None, msg_process=None):
-    return json.dumps(
-        {
-            "type": msg_type,
-            "data": msg_data,
-            "client": msg_client,
-            "process": msg_process,
-        }
+    # formatted the same as json.dumps of the message dict, which is slower
+    return (
+        '{"type": '
+        + _to_json(msg_type)
+        + ', "data": '
+        + _data_to_json(msg_data)
+        + ', "client": '
+        + _to_json(msg_client)
+        + ', "process": '
+        + _to_json(msg_process)
+        + "}"
+    )
+
+
+def create_batch_message(messages: List[str], msg_client) -> str:
+    # the messages are already json so are joined rather than parsed again
+    return (
+        '{"type": "batch", "data": {"messages": ['
+        + ", ".join(messages)
+        + ']}, "client": '
+        + _to_json(msg_client)
+        + ', "process": null}'
     )
 
 
 def append_to_message(message_str: str, dict_to_append: Dict) -> str:
-    message_dict = json.loads(message_str)
+    try:
+        message_dict = json_codec.loads(message_str)
+    except json.decoder.JSONDecodeError:
+        raise BadMessage("Invalid JSON") from None
+    if not isinstance(message_dict, dict):
+        raise BadMessage("Invalid JSON")
     message_dict.update(dict_to_append)
-    return json.dumps(message_dict)
+    return json_codec.dumps(message_dict)
 
 
 def parse_message(message):
     try:
-        msg = json.loads(message)
+        msg = json_codec.loads(message)
     except json.decoder.JSONDecodeError:
         raise BadMessage("Invalid JSON") from None
 
@@ -40,3 +87,279 @@ def parse_message(message):
     msg_client = msg_client if isinstance(msg_client, str) else ""
 
     return msg_type, msg_data, msg_process, msg_client
+
+
+class JsonCodec:
+    """The default message encoding, JSON text."""
+
+    binary = False
+
+    def create_message(self, msg_type, msg_client, msg_data=None, msg_process=None):
+        return create_message(msg_type, msg_client, msg_data, msg_process)
+
+    def create_batch_message(self, messages, msg_client):
+        return create_batch_message(messages, msg_client)
+
+    def parse_message(self, message):
+        return parse_message(message)
+
+
+# first byte of binary messages, which can't start a JSON message
+BINARY_FORMAT = 1
+
+# numeric codes of message types in binary messages, 0 means the type follows
+# as a string
+MESSAGE_TYPE_CODES = {
+    msg_type: code
+    for code, msg_type in enumerate(
+        [
+            "ping",
+            "pong",
+            "error",
+            "start",
+            "started",
+            "stop",
+            "stopped",
+            "stdin",
+            "stdout",
+            "stderr",
+            "dropped",
+            "resize",
+            "keyevent",
+            "keylisten",
+            "video",
+            "novnc",
+            "batch",
+        ],
+        start=1,
+    )
+}
+MESSAGE_TYPES = {code: msg_type for msg_type, code in MESSAGE_TYPE_CODES.items()}
+
+# message types whose data is a single string, sent as raw bytes
+RAW_DATA_KEYS = {
+    "stdin": "input",
+    "stdout": "output",
+    "stderr": "output",
+    "keylisten": "output",
+    "video": "output",
+}
+
+# how the data of a binary message is encoded
+NO_DATA = 0
+JSON_DATA = 1
+TEXT_DATA = 2  # the string of RAW_DATA_KEYS as utf-8
+BASE64_DATA = 3  # the base64 string of RAW_DATA_KEYS, decoded
+BATCH_DATA = 4  # length prefixed binary messages
+
+
+def is_binary_message(message) -> bool:
+    return isinstance(message, (bytes, bytearray)) and message[:1] == bytes(
+        [BINARY_FORMAT]
+    )
+
+
+def _write_varint(out: bytearray, n: int):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(message, position):
+    n = 0
+    shift = 0
+    while True:
+        byte = message[position]
+        position += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, position
+        shift += 7
+
+
+def _write_string(out: bytearray, string: str):
+    encoded = string.encode()
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_string(message, position):
+    length, position = _read_varint(message, position)
+    end = position + length
+    if end > len(message):
+        raise IndexError()
+    return bytes(message[position:end]).decode(), end
+
+
+class BinaryCodec:
+    """
+    Compact binary message encoding, negotiated by a client. Messages are a
+    BINARY_FORMAT byte, then a type code, the client id, the process id, and
+    the data, whose first byte says how it is encoded.
+
+    Ids are interned per session, so a codec must be used for one connection
+    only, with the messages decoded in the order they were encoded. An id is
+    sent as a varint reference, with its string following the first time it
+    is used. Ids which aren't interned, like clients on the shared Bluetooth
+    characteristic, are sent as a string every time. Data which is a single
+    string, such as output, is sent as raw bytes.
+    """
+
+    binary = True
+
+    def __init__(self, intern_client=True):
+        self.intern_client = intern_client
+        self._sent_ids: Dict[str, int] = {}
+        self._received_ids: Dict[int, str] = {}
+
+    def _write_id(self, out: bytearray, id, intern=True):
+        # 0 is no id, odd is a reference with its string following, even is a
+        # reference to a string sent before. reference 0 is never interned
+        if not id:
+            out.append(0)
+            return
+        if not intern:
+            _write_varint(out, 1)
+            _write_string(out, id)
+            return
+        ref = self._sent_ids.get(id)
+        if ref is not None:
+            _write_varint(out, ref << 1)
+            return
+        ref = self._sent_ids[id] = len(self._sent_ids) + 1
+        _write_varint(out, ref << 1 | 1)
+        _write_string(out, id)
+
+    def _read_id(self, message, position):
+        header, position = _read_varint(message, position)
+        if header == 0:
+            return "", position
+        ref = header >> 1
+        if header & 1:
+            id, position = _read_string(message, position)
+            if ref:
+                self._received_ids[ref] = id
+            return id, position
+        return self._received_ids[ref], position
+
+    def _write_header(
+        self, out: bytearray, msg_type, msg_client, msg_process, intern=True
+    ):
+        out.append(BINARY_FORMAT)
+        code = MESSAGE_TYPE_CODES.get(msg_type, 0)
+        out.append(code)
+        if code == 0:
+            _write_string(out, msg_type)
+        self._write_id(out, msg_client, intern and self.intern_client)
+        self._write_id(out, msg_process, intern)
+
+    def create_message(self, msg_type, msg_client, msg_data=None, msg_process=None):
+        out = bytearray()
+        self._write_header(out, msg_type, msg_client, msg_process)
+
+        raw_key = RAW_DATA_KEYS.get(msg_type)
+        raw = (
+            msg_data.get(raw_key)
+            if isinstance(msg_data, dict) and list(msg_data) == [raw_key]
+            else None
+        )
+        if msg_data is None:
+            out.append(NO_DATA)
+        elif isinstance(raw, str):
+            decoded = _base64_decode(raw) if msg_type == "video" else None
+            if decoded is not None:
+                out.append(BASE64_DATA)
+                out += decoded
+            else:
+                out.append(TEXT_DATA)
+                out += raw.encode()
+        else:
+            out.append(JSON_DATA)
+            out += json_codec.dumps_bytes(msg_data)
+        return bytes(out)
+
+    def create_batch_message(self, messages, msg_client):
+        out = bytearray()
+        # the batch is read before the messages in it, which may intern ids
+        self._write_header(out, "batch", msg_client, None, intern=False)
+        out.append(BATCH_DATA)
+        for message in messages:
+            _write_varint(out, len(message))
+            out += message
+        return bytes(out)
+
+    @staticmethod
+    def parse_client(message) -> str:
+        """The client of a message whose client id isn't interned."""
+        try:
+            position = 2
+            if message[1] == 0:
+                _, position = _read_string(message, position)
+            header, position = _read_varint(message, position)
+            if header != 1:
+                raise ValueError()
+            return _read_string(message, position)[0]
+        except (IndexError, ValueError):
+            raise BadMessage("Invalid binary message") from None
+
+    def parse_message(self, message):
+        try:
+            return self._parse_message(message)
+        except (IndexError, KeyError, ValueError):
+            raise BadMessage("Invalid binary message") from None
+
+    def _parse_message(self, message):
+        if not is_binary_message(message):
+            raise ValueError()
+        code = message[1]
+        position = 2
+        if code == 0:
+            msg_type, position = _read_string(message, position)
+        else:
+            msg_type = MESSAGE_TYPES.get(code, "")
+        msg_client, position = self._read_id(message, position)
+        msg_process, position = self._read_id(message, position)
+
+        data_format = message[position]
+        data = bytes(message[position + 1 :])
+        if data_format == NO_DATA:
+            msg_data = {}
+        elif data_format == JSON_DATA:
+            msg_data = json_codec.loads(data)
+        elif data_format == TEXT_DATA:
+            msg_data = {RAW_DATA_KEYS[msg_type]: data.decode()}
+        elif data_format == BASE64_DATA:
+            msg_data = {RAW_DATA_KEYS[msg_type]: b64encode(data).decode()}
+        elif data_format == BATCH_DATA:
+            msg_data = {"messages": list(self._parse_batch(data))}
+        else:
+            raise ValueError()
+
+        msg_data = msg_data if isinstance(msg_data, dict) else {}
+        return msg_type, msg_data, msg_process, msg_client
+
+    def _parse_batch(self, data):
+        position = 0
+        while position < len(data):
+            length, position = _read_varint(data, position)
+            end = position + length
+            msg_type, msg_data, msg_process, msg_client = self._parse_message(
+                data[position:end]
+            )
+            position = end
+            yield {
+                "type": msg_type,
+                "data": msg_data,
+                "client": msg_client,
+                "process": msg_process,
+            }
+
+
+def _base64_decode(string):
+    # only if encoding the bytes again gives back the same string
+    try:
+        decoded = b64decode(string, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return decoded if b64encode(decoded).decode() == string else None
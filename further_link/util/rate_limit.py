@@ -0,0 +1,308 @@
+import asyncio
+from time import monotonic
+from typing import Callable, Optional
+
+# by default a bucket can burst the number of bytes it gains in this time
+DEFAULT_BURST_TIME = 0.1
+
+
+class TokenBucket:
+    """
+    Byte counting token bucket rate limiter.
+
+    Tokens, each worth one byte, are added at `kBps` and can accumulate up to
+    `burst` bytes. A kBps of 0 means unlimited, matching the convention of
+    `bandwidth_limits_kBps`.
+
+    Other than __init__ and set_rate, the methods only use `tokens`, `rate`,
+    `burst`, `unlimited` and `_refill`, which adds the tokens gained since it
+    was last called. A subclass may provide those differently, as
+    BudgetStream does.
+    """
+
+    def __init__(self, kBps, burst=None, clock=monotonic):
+        self._clock = clock
+        self.set_rate(kBps, burst)
+        self.tokens = self.burst
+        self._last = clock()
+
+    @property
+    def unlimited(self):
+        return self.rate == 0
+
+    def set_rate(self, kBps, burst=None):
+        self.rate = kBps * 1000  # bytes per second
+        self.burst = (
+            max(1, int(self.rate * DEFAULT_BURST_TIME)) if burst is None else burst
+        )
+        if hasattr(self, "tokens"):
+            self._refill()
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def available(self):
+        if self.unlimited:
+            return float("inf")
+        self._refill()
+        return self.tokens
+
+    def consume(self, n):
+        """Take up to n tokens without waiting, returning how many were taken."""
+        if self.unlimited:
+            return n
+        self._refill()
+        taken = min(n, max(0, int(self.tokens)))
+        self.tokens -= taken
+        return taken
+
+    def delay(self, n):
+        """Seconds until n tokens, or a full bucket if n is larger, are available."""
+        if self.unlimited:
+            return 0
+        self._refill()
+        missing = min(n, self.burst) - self.tokens
+        return max(0, missing / self.rate)
+
+    async def acquire(self, n):
+        """
+        Wait until n tokens are available and take them. Requests larger than
+        the burst size wait for a full bucket and leave it in debt, so the
+        long term rate is still respected.
+        """
+        if self.unlimited:
+            return
+        delay = self.delay(n)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay(n)
+        self.tokens -= n
+
+    def close(self):
+        pass
+
+
+# a stream which hasn't asked for tokens in this time gets no share of the rate
+ACTIVE_TIME = 0.5
+# weight of channels not given one in a budget's weights
+DEFAULT_WEIGHT = 1
+
+
+class BandwidthBudget:
+    """
+    One rate limit shared fairly between several weighted streams.
+
+    Tokens gained at `kBps` are divided between the streams that have recently
+    asked for them, in proportion to their weights. A stream which can't hold
+    its share passes the excess on to the others. Each stream is used as a
+    TokenBucket, and counts the bytes it has been given.
+    """
+
+    def __init__(self, kBps, weights=None, burst=None, clock=monotonic):
+        self._fixed_burst = burst
+        self.set_rate(kBps)
+        self.weights = weights or {}
+        self._clock = clock
+        self._last = clock()
+        self._streams = {}
+        self.channel_bytes = {}
+
+    @property
+    def unlimited(self):
+        return self.rate == 0
+
+    def set_rate(self, kBps):
+        self.rate = kBps * 1000  # bytes per second
+        self.burst = (
+            max(1, int(self.rate * DEFAULT_BURST_TIME * 2))
+            if self._fixed_burst is None
+            else self._fixed_burst
+        )
+
+    def stream(self, name, channel=None):
+        weight = self.weights.get(channel, DEFAULT_WEIGHT)
+        stream = BudgetStream(self, name, channel, weight)
+        self._streams[name] = stream
+        return stream
+
+    def remove(self, stream):
+        if self._streams.get(stream.name) is stream:
+            del self._streams[stream.name]
+
+    def usage(self):
+        return {
+            "streams": {
+                name: {
+                    "channel": stream.channel,
+                    "weight": stream.weight,
+                    "bytes": stream.bytes,
+                }
+                for name, stream in self._streams.items()
+            },
+            "channels": dict(self.channel_bytes),
+        }
+
+    def _count(self, stream, n):
+        stream.bytes += n
+        self.channel_bytes[stream.channel] = (
+            self.channel_bytes.get(stream.channel, 0) + n
+        )
+
+    def _is_active(self, stream, now):
+        return now - stream.last_demand <= ACTIVE_TIME
+
+    def share(self, stream):
+        now = self._clock()
+        total = stream.weight + sum(
+            s.weight
+            for s in self._streams.values()
+            if s is not stream and self._is_active(s, now)
+        )
+        return stream.weight / total
+
+    def refill(self, requester):
+        now = self._clock()
+        requester.last_demand = now
+
+        gained = (now - self._last) * self.rate
+        self._last = now
+
+        active = [s for s in self._streams.values() if self._is_active(s, now)]
+        caps = {s: s.burst for s in active}
+        # fill each stream by weight, passing on what doesn't fit
+        while gained > 0 and active:
+            total = sum(s.weight for s in active)
+            overflow = 0
+            unfilled = []
+            for s in active:
+                s.tokens += gained * s.weight / total
+                if s.tokens >= caps[s]:
+                    overflow += s.tokens - caps[s]
+                    s.tokens = caps[s]
+                else:
+                    unfilled.append(s)
+            gained = overflow
+            active = unfilled
+
+
+class BudgetStream(TokenBucket):
+    """
+    A stream's fair share of a BandwidthBudget, used like a TokenBucket.
+
+    TokenBucket.__init__ isn't called and set_rate isn't used, as the rate and
+    burst are the stream's share of the budget's, and its tokens are added by
+    the budget's refill. The budget's rate is set instead.
+    """
+
+    def __init__(self, budget, name, channel, weight):
+        self.budget = budget
+        self.name = name
+        self.channel = channel
+        self.weight = weight
+        self.tokens = 0.0
+        self.bytes = 0
+        self.last_demand = float("-inf")
+
+    @property
+    def rate(self):
+        return self.budget.rate * self.budget.share(self)
+
+    @property
+    def burst(self):
+        return max(1, int(self.budget.burst * self.budget.share(self)))
+
+    @property
+    def unlimited(self):
+        return self.budget.unlimited
+
+    def _refill(self):
+        self.budget.refill(self)
+
+    def consume(self, n):
+        taken = super().consume(n)
+        self.budget._count(self, taken)
+        return taken
+
+    async def acquire(self, n):
+        await super().acquire(n)
+        self.budget._count(self, n)
+
+    def close(self):
+        self.budget.remove(self)
+
+
+# the estimate is updated after sending for this long
+ESTIMATE_WINDOW = 0.5
+# fraction of a window spent waiting for sends when the link is full
+SATURATED = 0.5
+# fraction of the rate sent in a window when the rate is what limits sending
+RATE_LIMITED = 0.8
+# rate kept below a full link's throughput, so that its buffers can drain
+HEADROOM = 0.9
+# rate increase of a window in which the link wasn't full
+INCREASE = 1.25
+# weight of a full window's throughput in the estimate
+SMOOTHING = 0.5
+
+
+class BandwidthEstimator:
+    """
+    Estimates the bandwidth of a connection from how long its sends take to
+    complete, starting from a guess, to set the rate of its BandwidthBudget.
+
+    Sends wait when the link's buffers are full. In a window where they wait
+    for much of the time the link is full, and its throughput is the
+    estimate. Otherwise, if as much was sent as the rate allowed, the rate is
+    what limited sending, so it's increased. A window where less was sent
+    says nothing about the link.
+    """
+
+    def __init__(
+        self,
+        kBps,
+        min_kBps,
+        max_kBps,
+        on_estimate: Optional[Callable[[float], None]] = None,
+        clock=monotonic,
+    ):
+        self.kBps = kBps
+        self.min_kBps = min_kBps
+        self.max_kBps = max_kBps
+        self.on_estimate = on_estimate
+        self._clock = clock
+        self._window_start = clock()
+        self._bytes = 0
+        self._waiting = 0.0
+        self.estimates = 0
+
+    def sent(self, n, seconds):
+        """Record that a send of n bytes took seconds to complete."""
+        self._bytes += n
+        self._waiting += seconds
+        now = self._clock()
+        elapsed = now - self._window_start
+        if elapsed < ESTIMATE_WINDOW:
+            return
+
+        kBps = self.kBps
+        if self._waiting >= SATURATED * elapsed:
+            throughput = self._bytes / elapsed / 1000
+            kBps += SMOOTHING * (throughput * HEADROOM - kBps)
+        elif self._bytes >= RATE_LIMITED * self.kBps * 1000 * elapsed:
+            kBps *= INCREASE
+        kBps = min(self.max_kBps, max(self.min_kBps, kBps))
+
+        self._window_start = now
+        self._bytes = 0
+        self._waiting = 0.0
+        if kBps != self.kBps:
+            self.kBps = kBps
+            self.estimates += 1
+            if self.on_estimate:
+                self.on_estimate(kBps)
+
+    def stats(self):
+        return {"kBps": self.kBps, "estimates": self.estimates}
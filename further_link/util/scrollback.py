@@ -0,0 +1,31 @@
+# The most recent messages of a resumable connection, kept so that a client
+# which reconnects can be sent what it missed. Messages are numbered from 1 and
+# the oldest are forgotten once they take up more than limit_bytes.
+from collections import deque
+from typing import Any, Deque, List, Tuple
+
+
+class Scrollback:
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.bytes = 0
+        self.last_seq = 0
+        self._items: Deque[Tuple[int, Any, int]] = deque()
+
+    def append(self, item, size: int) -> int:
+        self.last_seq += 1
+        self._items.append((self.last_seq, item, size))
+        self.bytes += size
+        # always keep the latest, even if it's larger than the limit
+        while self.bytes > self.limit_bytes and len(self._items) > 1:
+            _, _, removed = self._items.popleft()
+            self.bytes -= removed
+        return self.last_seq
+
+    def since(self, seq: int) -> Tuple[int, List]:
+        """
+        The number of the first message after seq which is still kept, and the
+        kept messages from it on.
+        """
+        items = [item for s, item, _ in self._items if s > seq]
+        return self.last_seq - len(items) + 1, items
@@ -5,11 +5,15 @@
 # from pitop.common.current_session_info import get_first_display
 # from pitop.common.singleton import Singleton
 
+import asyncio
+import logging
+import os
+from asyncio.subprocess import PIPE
 from glob import glob
 from os import environ
 from shlex import split
 from subprocess import run
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 
 def get_current_user():
@@ -25,8 +29,11 @@ def get_current_user():
         return get_user_using_first_display()
 
 
+X11_DIR = "/tmp/.X11-unix"
+
+
 def get_list_of_displays() -> List[str]:
-    display_file_prefix = "/tmp/.X11-unix/X"
+    display_file_prefix = f"{X11_DIR}/X"
     return [
         f.replace(display_file_prefix, ":")
         for f in glob(display_file_prefix + "[0-9]*")
@@ -39,17 +46,9 @@ def get_first_display() -> Optional[str]:
     return first_display
 
 
-def get_user_using_display(display_no):
-    """Returns the name of the user that is currently using the defined
-    display.
-    Returns:
-            user (str): String representing the user
-    """
-
+def _user_in_who(stdout, display_no):
     user = None
-    proc = run("who", timeout=5, capture_output=True)
-    stdout = proc.stdout.decode("utf-8").strip()
-    lines = stdout.split("\n")
+    lines = stdout.decode("utf-8").strip().split("\n")
     for line in lines:
         if "(%s)" % display_no in line:
             fields = line.split(" ")
@@ -59,6 +58,119 @@ def get_user_using_display(display_no):
     return user
 
 
+def get_user_using_display(display_no):
+    """Returns the name of the user that is currently using the defined
+    display.
+    Returns:
+            user (str): String representing the user
+    """
+    proc = run("who", timeout=5, capture_output=True)
+    return _user_in_who(proc.stdout, display_no)
+
+
+async def async_get_user_using_display(display_no):
+    """As get_user_using_display, without blocking the event loop."""
+    try:
+        proc = await asyncio.create_subprocess_exec("who", stdout=PIPE)
+    except OSError:
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), 5)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    return _user_in_who(stdout, display_no)
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class DisplayUserTracker:
+    """
+    Keeps the user of the first display, resolved again only once the
+    displays or the login sessions have changed, rather than running who each
+    time it's needed.
+
+    user() doesn't wait for who when called on the event loop, instead it
+    starts resolving the user again in the background and returns the user
+    last resolved.
+    """
+
+    # the display sockets and the login records read by who
+    paths = (X11_DIR, "/var/run/utmp")
+
+    def __init__(self):
+        self._user: Optional[str] = None
+        self._stamp: Optional[Tuple] = None
+        self._refreshing: Optional[asyncio.Future] = None
+
+    def user(self) -> Optional[str]:
+        stamp = self._current_stamp()
+        if stamp == self._stamp:
+            return self._user
+        if self._stamp is not None and _on_event_loop():
+            self._start_refresh()
+            return self._user
+        # off the event loop, or never resolved, which refresh() at start up
+        # avoids, so wait for who
+        self._user = get_user_using_display(get_first_display())
+        self._stamp = stamp
+        return self._user
+
+    async def get_user(self) -> Optional[str]:
+        """The user of the first display, waiting for it if it has changed."""
+        if self._current_stamp() != self._stamp:
+            await self.refresh()
+        return self._user
+
+    async def refresh(self):
+        await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self._refreshing is None or self._refreshing.get_loop() is not loop:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(self._refreshed)
+        return self._refreshing
+
+    async def _refresh(self) -> None:
+        # changes while who runs are noticed the next time
+        stamp = self._current_stamp()
+        self._user = await async_get_user_using_display(get_first_display())
+        self._stamp = stamp
+
+    def _refreshed(self, refreshing: asyncio.Future) -> None:
+        # nothing may await a refresh started by user(), so its error is
+        # reported here. The user last resolved is kept, and resolved again
+        # the next time it's needed
+        if self._refreshing is refreshing:
+            self._refreshing = None
+        if not refreshing.cancelled() and refreshing.exception() is not None:
+            logging.error(
+                "Error resolving the user of the display",
+                exc_info=refreshing.exception(),
+            )
+
+    def _current_stamp(self) -> Tuple:
+        stamp: List[Optional[Tuple[int, int, int]]] = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+
+display_users = DisplayUserTracker()
+
+
 def get_user_using_first_display():
     """Returns the name of the user that is currently using the first available
     display.
@@ -69,7 +181,7 @@ def get_user_using_first_display():
             Returns:
                     user (str): String representing the user
     """
-    return get_user_using_display(get_first_display())
+    return display_users.user()
 
 
 class Singleton(type):
@@ -0,0 +1,263 @@
+# Outbound messages of a connection are queued and sent by a single writer task,
+# so producers such as process output callbacks don't wait for a slow client.
+# Messages are sent in order of priority class, with a bounded amount of memory
+# shared between the classes and a policy for each class once it's used up.
+import asyncio
+import logging
+from collections import deque
+from enum import Enum, IntEnum
+from time import monotonic
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+
+class Priority(IntEnum):
+    CONTROL = 0  # pong, started, stopped, error...
+    ECHO = 1  # output answering input, such as echoed keystrokes
+    TEXT = 2  # other stdout and stderr
+    VIDEO = 3
+
+
+class DropPolicy(Enum):
+    NEVER = 1  # always queued, even over the limit
+    WAIT = 2  # the producer waits until there is room
+    LATEST = 3  # replaces the stream's queued message, dropped if still no room
+    DROP = 4  # dropped if there is no room
+
+
+drop_policies = {
+    Priority.CONTROL: DropPolicy.NEVER,
+    Priority.ECHO: DropPolicy.NEVER,
+    Priority.TEXT: DropPolicy.WAIT,
+    Priority.VIDEO: DropPolicy.LATEST,
+}
+
+# the most bytes of messages taken together, when they are sent as a batch
+DEFAULT_BATCH_BYTES = 2**16
+
+
+class _Entry:
+    __slots__ = ("message", "size", "stream", "time", "replaceable", "record")
+
+    def __init__(self, message, stream, replaceable, record=None):
+        self.message = message
+        self.size = len(message)  # json is ascii, binary is bytes
+        self.stream = stream
+        self.time = monotonic()
+        self.replaceable = replaceable
+        self.record = record
+
+
+class _ClassStats:
+    def __init__(self):
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class SendQueue:
+    """
+    Per connection queue of outbound messages, sent by calling
+    deliver(messages) from one writer task. Only one message is delivered at a
+    time unless batch is set, then all the messages ready are delivered
+    together, up to batch_bytes.
+
+    Messages may be given a stream, a (process, channel) tuple, and are never
+    sent before the queued messages of the same stream, whatever their
+    priority. A stream with channel None follows all of the process' streams.
+
+    Messages may also be given a record, which is passed with the message's
+    size to on_delivered(record, size) once the message has been delivered,
+    in the order messages are delivered.
+    """
+
+    def __init__(
+        self,
+        deliver: Callable,
+        limit_bytes: int,
+        batch=False,
+        batch_bytes=DEFAULT_BATCH_BYTES,
+        policies: Optional[Dict[Priority, DropPolicy]] = None,
+        on_delivered: Optional[Callable] = None,
+    ):
+        self._deliver = deliver
+        self._on_delivered = on_delivered
+        self.limit_bytes = limit_bytes
+        self.policies = drop_policies if policies is None else policies
+        self.batch = batch
+        self.batch_bytes = batch_bytes
+
+        self._queues: Dict[Priority, Deque[_Entry]] = {p: deque() for p in Priority}
+        self._stats = {p: _ClassStats() for p in Priority}
+        # priority class and count of each stream's queued messages
+        self._streams: Dict[Tuple, List] = {}
+        self.bytes = 0
+
+        self._ready = asyncio.Event()  # messages are queued
+        self._space = asyncio.Event()  # bytes have been freed
+        self._idle = asyncio.Event()  # nothing queued or being delivered
+        self._idle.set()
+        self._writer: Optional[asyncio.Future] = None
+        self._closed = False
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    async def put(
+        self,
+        message,
+        priority: Priority,
+        stream: Optional[Tuple] = None,
+        record=None,
+    ):
+        policy = self.policies[priority]
+        if policy == DropPolicy.WAIT:
+            while self.bytes and self.bytes + len(message) > self.limit_bytes:
+                if self._closed:
+                    return
+                self._space.clear()
+                await self._space.wait()
+        if self._closed:
+            return
+
+        entry = _Entry(message, stream, policy == DropPolicy.LATEST, record)
+        if policy == DropPolicy.LATEST:
+            self._remove_replaceable(priority, stream)
+        if policy in (DropPolicy.LATEST, DropPolicy.DROP):
+            if self.bytes and self.bytes + entry.size > self.limit_bytes:
+                self._stats[priority].dropped += 1
+                return
+
+        if stream is not None:
+            priority = max(priority, self._stream_priority(stream))
+            pending = self._streams.setdefault(stream, [priority, 0])
+            pending[0] = priority
+            pending[1] += 1
+
+        queue = self._queues[priority]
+        queue.append(entry)
+        self.bytes += entry.size
+        stats = self._stats[priority]
+        stats.max_depth = max(stats.max_depth, len(queue))
+
+        self._idle.clear()
+        self._ready.set()
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def join(self):
+        """Wait until every queued message has been delivered."""
+        await self._idle.wait()
+
+    def clear(self) -> List[Tuple]:
+        """
+        Forget the queued messages, without counting them as dropped. Returns
+        the records and sizes of those with a record, in the order they would
+        have been delivered.
+        """
+        records: List[Tuple] = []
+        for queue in self._queues.values():
+            while queue:
+                entry = queue.popleft()
+                if entry.record is not None:
+                    records.append((entry.record, entry.size))
+                self._release(entry)
+        return records
+
+    async def close(self, timeout=1):
+        """Deliver what is queued, waiting at most timeout, then stop."""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.debug(f"Send queue closed with {len(self)} messages unsent")
+        self._closed = True
+        self._space.set()  # release waiting producers
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    def stats(self):
+        classes = {}
+        for priority, queue in self._queues.items():
+            stats = self._stats[priority]
+            classes[priority.name.lower()] = {
+                "policy": self.policies[priority].name.lower(),
+                "depth": len(queue),
+                "max_depth": stats.max_depth,
+                "bytes": sum(e.size for e in queue),
+                "sent": stats.sent,
+                "dropped": stats.dropped,
+                "wait_avg_ms": (
+                    stats.wait_total / stats.sent * 1000 if stats.sent else 0
+                ),
+                "wait_max_ms": stats.wait_max * 1000,
+            }
+        return {"bytes": self.bytes, "limit_bytes": self.limit_bytes, **classes}
+
+    def _stream_priority(self, stream: Tuple) -> Priority:
+        process, channel = stream
+        if channel is not None:
+            keys: tuple = (stream, (process, None))
+        else:
+            keys = tuple(s for s in self._streams if s[0] == process)
+        return max(
+            (self._streams[k][0] for k in keys if k in self._streams),
+            default=Priority.CONTROL,
+        )
+
+    def _remove_replaceable(self, priority: Priority, stream: Hashable):
+        queue = self._queues[priority]
+        for entry in [e for e in queue if e.replaceable and e.stream == stream]:
+            queue.remove(entry)
+            self._stats[priority].dropped += 1
+            self._release(entry)
+
+    def _release(self, entry: _Entry):
+        self.bytes -= entry.size
+        self._space.set()
+        if entry.stream is not None:
+            pending = self._streams[entry.stream]
+            pending[1] -= 1
+            if pending[1] == 0:
+                del self._streams[entry.stream]
+
+    def _pop(self) -> List[_Entry]:
+        entries: List[_Entry] = []
+        size = 0
+        now = monotonic()
+        for priority, queue in self._queues.items():
+            stats = self._stats[priority]
+            while queue:
+                if entries and (
+                    not self.batch or size + queue[0].size > self.batch_bytes
+                ):
+                    return entries
+                entry = queue.popleft()
+                entries.append(entry)
+                size += entry.size
+                wait = now - entry.time
+                stats.sent += 1
+                stats.wait_total += wait
+                stats.wait_max = max(stats.wait_max, wait)
+        return entries
+
+    async def _write(self):
+        while True:
+            await self._ready.wait()
+            if self.batch:
+                await asyncio.sleep(0)  # let the rest of this tick's messages join
+            entries = self._pop()
+            if not entries:
+                self._ready.clear()
+                self._idle.set()
+                continue
+            try:
+                await self._deliver([e.message for e in entries])
+            except Exception as e:
+                logging.exception(f"Error sending messages: {e}")
+            finally:
+                for entry in entries:
+                    if entry.record is not None and self._on_delivered:
+                        self._on_delivered(entry.record, entry.size)
+                    self._release(entry)
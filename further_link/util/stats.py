@@ -0,0 +1,81 @@
+# Server wide counters, reported by the /stats endpoint. These are used to tune
+# settings such as bandwidth_limits_kBps from real usage, so keys are dotted
+# names which include the connection type and channel where relevant
+# e.g. "output.websocket.stdout.dropped_bytes"
+# Gauges, such as how many connections are live, are read when reported, and
+# open connections can also register a function reporting their own stats.
+# Durations, such as how long each type of message takes to handle, are
+# recorded in histograms e.g. "message.websocket.start".
+from bisect import bisect_left
+from typing import Callable, Dict, List
+
+# upper bounds of histogram buckets, in milliseconds
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # the last bucket is for durations over every bound
+        self.buckets: List[int] = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, ms: float) -> None:
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+
+    def to_dict(self) -> Dict:
+        bounds = [str(b) for b in HISTOGRAM_BOUNDS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0,
+            "max_ms": self.max_ms,
+            # counts of durations up to each bound, and over the previous one
+            "buckets_ms": dict(zip(bounds, self.buckets)),
+        }
+
+
+_counters: Dict[str, int] = {}
+_histograms: Dict[str, Histogram] = {}
+_gauges: Dict[str, Callable[[], int]] = {}
+_connections: Dict[str, Callable[[], Dict]] = {}
+
+
+def count(key: str, n: int = 1) -> None:
+    _counters[key] = _counters.get(key, 0) + n
+
+
+def record_time(key: str, seconds: float) -> None:
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+    histogram.add(seconds * 1000)
+
+
+def add_gauge(key: str, get_value: Callable[[], int]) -> None:
+    _gauges[key] = get_value
+
+
+def add_connection(id: str, get_connection_stats: Callable[[], Dict]) -> None:
+    _connections[id] = get_connection_stats
+
+
+def remove_connection(id: str) -> None:
+    _connections.pop(id, None)
+
+
+def get_stats() -> Dict:
+    return {
+        "counters": dict(sorted(_counters.items())),
+        "gauges": {key: get() for key, get in sorted(_gauges.items())},
+        "histograms": {key: h.to_dict() for key, h in sorted(_histograms.items())},
+        "connections": {id: get() for id, get in _connections.items()},
+    }
+
+
+def reset_stats() -> None:
+    _counters.clear()
+    _histograms.clear()
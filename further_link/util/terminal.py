@@ -1,6 +1,10 @@
+import asyncio
 import fcntl
+import os
+import re
 import struct
 import termios
+import unicodedata
 
 
 # set terminal winsize ioctl on file descriptor, used for our stdout/stderr
@@ -10,3 +14,253 @@ import termios
 def set_winsize(fd, row, col, xpix=0, ypix=0):
     winsize = struct.pack("HHHH", row, col, xpix, ypix)
     fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PtyStream:
+    """
+    Non-blocking reader and writer for a pty master file descriptor.
+
+    The fd is registered with the event loop directly so reads and writes never
+    leave the loop thread. Read data is buffered up to `limit` bytes, beyond
+    which the fd is unregistered until the buffer is drained, leaving further
+    output in the kernel pty buffer.
+    """
+
+    read_size = 4096
+
+    def __init__(self, fd, limit=2**16):
+        self._fd = fd
+        self._limit = limit
+        self._loop = asyncio.get_running_loop()
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+        self._reading = False
+        self._read_waiter = None
+
+        os.set_blocking(fd, False)
+        self._resume_reading()
+
+    def fileno(self):
+        return self._fd
+
+    def at_eof(self):
+        return self._eof and not self._buffer
+
+    def _resume_reading(self):
+        if not self._reading and not self._eof:
+            self._loop.add_reader(self._fd, self._on_readable)
+            self._reading = True
+
+    def _pause_reading(self):
+        if self._reading:
+            self._loop.remove_reader(self._fd)
+            self._reading = False
+
+    def _wake_reader(self):
+        if self._read_waiter is not None:
+            _set_done(self._read_waiter)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, self.read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # linux gives EIO once every slave fd has been closed
+            data = b""
+
+        if data:
+            self._buffer.extend(data)
+            if len(self._buffer) >= self._limit:
+                self._pause_reading()
+        else:
+            self._eof = True
+            self._pause_reading()
+
+        self._wake_reader()
+
+    async def read(self, n=-1):
+        while not self._buffer and not self._eof:
+            self._read_waiter = self._loop.create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+
+        if n < 0:
+            n = len(self._buffer)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+
+        if len(self._buffer) < self._limit:
+            self._resume_reading()
+
+        return data
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self._closed:
+                raise OSError("pty is closed")
+            try:
+                written = os.write(self._fd, view)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+
+            view = view[written:]
+            if view:
+                # wait for space in the pty input buffer
+                writable = self._loop.create_future()
+                self._loop.add_writer(self._fd, _set_done, writable)
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pause_reading()
+        self._eof = True
+        self._wake_reader()
+        os.close(self._fd)
+
+
+# terminal width assumed when compacting output which isn't from a pty
+DEFAULT_COLUMNS = 80
+
+_ESCAPE = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]"  # CSI e.g. colours, cursor movement
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"  # OSC e.g. window title
+    r"|\x1b[@-Z\\-_]"
+)
+_SGR = re.compile(r"\x1b\[[0-9;]*m")
+_SGR_RESET = re.compile(r"\x1b\[0*(?:;|m)")
+_CURSOR_VISIBILITY = re.compile(r"\x1b\[\?25[hl]")
+# erasing the line, possibly after sequences carried from dropped segments
+_ERASE_LINE = re.compile(
+    rf"(?:{_SGR.pattern}|{_CURSOR_VISIBILITY.pattern})*(\x1b\[[02]?K)"
+)
+
+
+def _is_state(sequence):
+    # sequences which only change how later text is drawn, so may be moved
+    # from a dropped segment to the one after it
+    return bool(_SGR.fullmatch(sequence) or _CURSOR_VISIBILITY.fullmatch(sequence))
+
+
+def _char_width(char):
+    if unicodedata.combining(char) or unicodedata.category(char) in ("Me", "Cf"):
+        return 0
+    if unicodedata.east_asian_width(char) in ("W", "F"):
+        return 2
+    return 1
+
+
+def _segment_width(segment):
+    """
+    Display width of text written after a carriage return, and the state
+    sequences in it, or None if it does anything but draw text on the line.
+    """
+    width = 0
+    states = []
+    position = 0
+    for match in _ESCAPE.finditer(segment):
+        text = segment[position : match.start()]
+        position = match.end()
+        if text and not text.isprintable():
+            return None, None
+        width += sum(_char_width(c) for c in text)
+        if not _is_state(match.group()):
+            return None, None
+        states.append(match.group())
+    text = segment[position:]
+    if text and not text.isprintable():
+        return None, None
+    width += sum(_char_width(c) for c in text)
+    return width, states
+
+
+def _drop_redundant_states(text):
+    # in each run of sequences with no text between them, drop colours which
+    # are reset before anything is drawn and cursor visibility changes which
+    # are changed again
+    def compact_run(match):
+        sequences = _ESCAPE.findall(match.group())
+        kept = []
+        for i, sequence in enumerate(sequences):
+            later = sequences[i + 1 :]
+            if _SGR.fullmatch(sequence) and any(map(_SGR_RESET.match, later)):
+                continue
+            if _CURSOR_VISIBILITY.fullmatch(sequence) and any(
+                map(_CURSOR_VISIBILITY.fullmatch, later)
+            ):
+                continue
+            if kept and kept[-1] == sequence and _is_state(sequence):
+                continue
+            kept.append(sequence)
+        return "".join(kept)
+
+    return re.sub(f"(?:{_ESCAPE.pattern}){{2,}}", compact_run, text)
+
+
+def _compact_line(line, columns):
+    segments = line.split("\r")
+    # the first segment starts wherever the cursor was, so is always kept
+    kept = [segments[0]]
+    # segments which may still be overwritten, as [text, width, states], with
+    # widths decreasing as any narrower segment before one is overwritten by it
+    pending = []
+
+    def keep_pending():
+        kept.extend(text for text, _, _ in pending)
+        pending.clear()
+
+    for segment in segments[1:]:
+        erase = _ERASE_LINE.match(segment)
+        width, states = _segment_width(
+            segment[: erase.start(1)] + segment[erase.end(1) :] if erase else segment
+        )
+        if width is None or width > columns:
+            # this moves the cursor or may wrap, so earlier segments can't be
+            # known to be overwritten by later ones
+            keep_pending()
+            kept.append(segment)
+            continue
+
+        # colours set by overwritten segments still apply to this one
+        carried = []
+        while pending and (erase or pending[-1][1] <= width):
+            carried = pending.pop()[2] + carried
+        # erasing clears the whole line, so only another erase overwrites it
+        covers = float("inf") if erase else width
+        pending.append(["".join(carried) + segment, covers, carried + states])
+
+    keep_pending()
+    return "\r".join(kept)
+
+
+def compact_output(text, columns=DEFAULT_COLUMNS):
+    """
+    Remove output which a terminal would overwrite before it could be seen,
+    without changing what the terminal shows.
+
+    Segments of a line written after a carriage return are dropped when a
+    later segment of the same line is at least as wide or starts by erasing
+    the line. Only segments which draw text within the terminal's columns
+    are dropped, and the colours they set are kept. Runs of colour and cursor
+    visibility sequences which are undone before anything is drawn are also
+    removed.
+    """
+    if "\r" not in text and "\x1b" not in text:
+        return text
+    if "\r" in text:
+        text = "\n".join(_compact_line(line, columns) for line in text.split("\n"))
+    return _drop_redundant_states(text)
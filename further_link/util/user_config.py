@@ -1,7 +1,8 @@
 import getpass
-import grp
 import os
 import pwd
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
 
 from .sdk import get_user_using_first_display
 
@@ -19,49 +20,111 @@ def get_current_user():
     return getpass.getuser()
 
 
+# the passwd and group databases, a change to either invalidates IdentityCache
+IDENTITY_FILES = ("/etc/passwd", "/etc/group")
+# seconds between checking the files for changes
+IDENTITY_CHECK_INTERVAL = 1
+# entries which may come from elsewhere, such as LDAP, are looked up again
+# after this many seconds even if the files haven't changed
+IDENTITY_MAX_AGE = 300
+
+
+class IdentityCache:
+    """
+    Users' passwd entries and group ids, each looked up once rather than on
+    every call, as they are needed many times for each process started and
+    each directory and file uploaded. Group ids are looked up with
+    os.getgrouplist, which asks the group database about one user rather than
+    reading every group.
+    """
+
+    def __init__(self, files=IDENTITY_FILES, clock=monotonic):
+        self.files = files
+        self._clock = clock
+        self._passwd: Dict[str, Optional[pwd.struct_passwd]] = {}
+        self._groups: Dict[str, List[int]] = {}
+        self._stamp: Optional[Tuple] = None
+        self._checked = float("-inf")
+        self._created = float("-inf")
+
+    def clear(self):
+        self._passwd.clear()
+        self._groups.clear()
+
+    def passwd(self, user) -> Optional[pwd.struct_passwd]:
+        if not isinstance(user, str):
+            return None
+        self._validate()
+        try:
+            return self._passwd[user]
+        except KeyError:
+            pass
+        try:
+            entry: Optional[pwd.struct_passwd] = pwd.getpwnam(user)
+        except KeyError:
+            entry = None  # users which don't exist are remembered too
+        self._passwd[user] = entry
+        return entry
+
+    def groups(self, user) -> Optional[List[int]]:
+        """The user's group id and supplementary group ids."""
+        entry = self.passwd(user)
+        if entry is None:
+            return None
+        groups = self._groups.get(user)
+        if groups is None:
+            groups = self._groups[user] = os.getgrouplist(user, entry.pw_gid)
+        return list(groups)
+
+    def _validate(self):
+        now = self._clock()
+        if now - self._checked < IDENTITY_CHECK_INTERVAL:
+            return
+        self._checked = now
+        stamp = tuple(self._file_stamp(path) for path in self.files)
+        if stamp != self._stamp or now - self._created > IDENTITY_MAX_AGE:
+            self.clear()
+            self._stamp = stamp
+            self._created = now
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+identities = IdentityCache()
+
+
 def user_exists(user):
-    try:
-        return pwd.getpwnam(user) is not None
-    except (KeyError, TypeError):
-        return False
+    return identities.passwd(user) is not None
 
 
 def get_uid(user):
-    try:
-        return pwd.getpwnam(user).pw_uid
-    except (KeyError, TypeError):
-        return None
+    entry = identities.passwd(user)
+    return entry.pw_uid if entry else None
 
 
 def get_gid(user):
-    try:
-        return pwd.getpwnam(user).pw_gid
-    except (KeyError, TypeError):
-        return None
+    entry = identities.passwd(user)
+    return entry.pw_gid if entry else None
 
 
 def get_home_directory(user):
-    try:
-        return pwd.getpwnam(user).pw_dir
-    except (KeyError, TypeError):
-        return None
+    entry = identities.passwd(user)
+    return entry.pw_dir if entry else None
 
 
 def get_shell(user):
-    try:
-        return pwd.getpwnam(user).pw_shell
-    except (KeyError, TypeError):
-        return None
+    entry = identities.passwd(user)
+    return entry.pw_shell if entry else None
 
 
 def get_grp_ids(user):
-    try:
-        groups = [g.gr_gid for g in grp.getgrall() if user in g.gr_mem]
-        gid = pwd.getpwnam(user).pw_gid
-        groups.append(gid)
-        return groups
-    except (KeyError, TypeError):
-        return None
+    return identities.groups(user)
 
 
 def default_user():
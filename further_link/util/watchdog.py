@@ -0,0 +1,96 @@
+# Deadlines of many connections, such as the inactivity timeouts of bluetooth
+# RunManagers, kept by one scheduler per event loop with a single loop.call_at
+# handle for the earliest. Restarting a deadline, which happens on every ping,
+# only records the new time. The handle is rescheduled lazily, when it fires
+# before the deadline it was set for has moved.
+import asyncio
+import heapq
+import weakref
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from . import stats
+
+
+class Watchdog:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._deadlines: Dict[Hashable, float] = {}
+        self._timeouts: Dict[Hashable, Tuple[float, Callable]] = {}
+        # one entry for each key, at or before its deadline
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._scheduled: Dict[Hashable, float] = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._handle_time = float("inf")
+        self._counter = 0  # orders entries with equal deadlines
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def start(self, key: Hashable, timeout: float, callback: Callable):
+        """Call the async callback once key hasn't been restarted for timeout."""
+        self._timeouts[key] = (timeout, callback)
+        self.restart(key)
+
+    def restart(self, key: Hashable):
+        if key not in self._timeouts:
+            return  # stopped or expired
+        timeout, _ = self._timeouts[key]
+        deadline = self._loop.time() + timeout
+        self._deadlines[key] = deadline
+        if deadline < self._scheduled.get(key, float("inf")):
+            self._push(key, deadline)
+
+    def stop(self, key: Hashable):
+        self._deadlines.pop(key, None)
+        self._timeouts.pop(key, None)
+        self._scheduled.pop(key, None)
+
+    def stats(self):
+        return {"live": len(self), "expired": self.expired}
+
+    def _push(self, key: Hashable, deadline: float):
+        self._counter += 1
+        heapq.heappush(self._heap, (deadline, self._counter, key))
+        self._scheduled[key] = deadline
+        if deadline < self._handle_time:
+            self._schedule(deadline)
+
+    def _schedule(self, when: float):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = self._loop.call_at(when, self._check)
+        self._handle_time = when
+
+    def _check(self):
+        self._handle = None
+        self._handle_time = float("inf")
+        now = self._loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            scheduled, _, key = heapq.heappop(self._heap)
+            deadline = self._deadlines.get(key)
+            if deadline is None or self._scheduled.get(key) != scheduled:
+                continue  # stopped, or superseded by an earlier entry
+            if deadline > now:
+                self._push(key, deadline)  # restarted since being scheduled
+                continue
+            _, callback = self._timeouts[key]
+            self.stop(key)
+            self.expired += 1
+            stats.count("watchdog.expired")
+            asyncio.ensure_future(callback())
+        if self._heap:
+            self._schedule(self._heap[0][0])
+
+
+_watchdogs: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_watchdog() -> Watchdog:
+    """The running event loop's Watchdog."""
+    loop = asyncio.get_running_loop()
+    watchdog = _watchdogs.get(loop)
+    if watchdog is None:
+        watchdog = _watchdogs[loop] = Watchdog(loop)
+        stats.add_gauge("watchdog.live", watchdog.__len__)
+    return watchdog
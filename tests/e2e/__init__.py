@@ -3,6 +3,7 @@ import os
 E2E_PATH = os.path.dirname(os.path.realpath(__file__))
 
 STATUS_PATH = "/status"
+STATS_PATH = "/stats"
 VERSION_PATH = "/version"
 UPLOAD_PATH = "/upload"
 RUN_PATH = "/run"
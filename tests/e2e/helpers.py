@@ -77,11 +77,16 @@ async def wait_for_data(
 async def send_formatted_bluetooth_message(
     service, characteristic, message, assert_characteristic_value=True
 ):
-    if not isinstance(message, str):
-        message = json.dumps(message)
-    chunked_message = ChunkedMessage.from_string(
-        id=0, message=message, format=PtMessageFormat
-    )
+    if isinstance(message, bytes):
+        chunked_message = ChunkedMessage.from_bytearray(
+            id=0, message=bytearray(message), format=PtMessageFormat
+        )
+    else:
+        if not isinstance(message, str):
+            message = json.dumps(message)
+        chunked_message = ChunkedMessage.from_string(
+            id=0, message=message, format=PtMessageFormat
+        )
 
     for i in range(chunked_message.received_chunks):
         chunk = chunked_message.get_chunk(i)
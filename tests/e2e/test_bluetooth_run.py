@@ -6,13 +6,14 @@ from time import time
 import pytest
 
 from further_link.util.bluetooth.messages.chunk import Chunk
+from further_link.util.bluetooth.messages.format import PtMessageFormat
 from further_link.util.bluetooth.uuids import (
     PT_CLIENTS_CHARACTERISTIC_UUID,
     PT_RUN_READ_CHARACTERISTIC_UUID,
     PT_RUN_WRITE_CHARACTERISTIC_UUID,
     PT_SERVICE_UUID,
 )
-from further_link.util.message import create_message
+from further_link.util.message import BinaryCodec, create_message
 
 from .helpers import send_formatted_bluetooth_message, wait_until
 
@@ -134,6 +135,37 @@ print(datetime.now().strftime("%A"))
     )
 
 
+@pytest.mark.asyncio
+async def test_run_binary(bluetooth_server):
+    service = bluetooth_server.get_service(PT_SERVICE_UUID)
+    char = service.get_characteristic(PT_RUN_WRITE_CHARACTERISTIC_UUID)
+
+    # clients on the shared characteristic don't intern their ids
+    client = BinaryCodec(intern_client=False)
+    start_cmd = client.create_message(
+        "start", "1", {"runner": "python3", "code": "print('hi')"}, "1"
+    )
+
+    messages = []
+    service.get_characteristic(PT_RUN_READ_CHARACTERISTIC_UUID)._subscribe(
+        lambda msg: messages.append(msg)
+    )
+
+    await send_formatted_bluetooth_message(bluetooth_server, char, start_cmd)
+
+    await wait_until(lambda: len(messages) == 3)
+    server = BinaryCodec()
+    parsed = [
+        server.parse_message(PtMessageFormat.get_payload(bytearray(m)))
+        for m in messages
+    ]
+    assert parsed == [
+        ("started", {}, "1", "1"),
+        ("stdout", {"output": "hi\r\n"}, "1", "1"),
+        ("stopped", {"exitCode": 0}, "1", "1"),
+    ]
+
+
 @pytest.mark.asyncio
 async def test_run_shell(bluetooth_server):
     service = bluetooth_server.get_service(PT_SERVICE_UUID)
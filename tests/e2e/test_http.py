@@ -5,8 +5,9 @@ from subprocess import run
 import pytest
 
 from further_link import __version__
+from further_link.util import stats
 
-from . import STATUS_PATH, VERSION_PATH
+from . import STATS_PATH, STATUS_PATH, VERSION_PATH
 
 
 @pytest.mark.asyncio
@@ -17,6 +18,16 @@ async def test_status(http_client):
     assert await response.text() == "OK"
 
 
+@pytest.mark.asyncio
+async def test_stats(http_client):
+    stats.reset_stats()
+    stats.count("output.websocket.stdout.dropped_bytes", 10)
+    response = await http_client.get(STATS_PATH)
+    assert response.status == 200
+    body = await response.json()
+    assert body["counters"] == {"output.websocket.stdout.dropped_bytes": 10}
+
+
 @pytest.mark.asyncio
 async def test_version(http_client):
     response = await http_client.get(VERSION_PATH)
@@ -272,3 +272,36 @@ async def test_discard_old_input(run_ws_client):
     await wait_for_data(run_ws_client, "stdout", "output", "hello\n", 0, "1")
 
     await wait_for_data(run_ws_client, "stopped", "exitCode", 0, 0, "1")
+
+
+@pytest.mark.asyncio
+async def test_run_kernel(run_ws_client):
+    start_cmd = create_message(
+        "start", "1", {"runner": "python3-kernel", "code": "x = 20"}, "1"
+    )
+    await run_ws_client.send_str(start_cmd)
+
+    await receive_data(run_ws_client, "started", process="1")
+    await receive_data(run_ws_client, "executed", "ok", True, "1")
+
+    execute_cmd = create_message("execute", "1", {"code": "print(x + 1)"}, "1")
+    await run_ws_client.send_str(execute_cmd)
+
+    await wait_for_data(run_ws_client, "stdout", "output", "21\n", 0, "1")
+    await receive_data(run_ws_client, "executed", "ok", True, "1")
+
+    reset_cmd = create_message("reset", "1", None, "1")
+    await run_ws_client.send_str(reset_cmd)
+    await receive_data(run_ws_client, "reset", process="1")
+
+    await run_ws_client.send_str(execute_cmd)
+    await receive_data(run_ws_client, "stderr", process="1")
+    await wait_for_data(run_ws_client, "executed", "error", "NameError", 0, "1")
+
+    stop_cmd = create_message("stop", "1", None, "1")
+    await run_ws_client.send_str(stop_cmd)
+    await wait_for_data(run_ws_client, "stopped", "exitCode", -15, 0, "1")
+
+    # only kernels execute cells
+    await run_ws_client.send_str(execute_cmd)
+    await receive_data(run_ws_client, "error", "message", "Bad message")
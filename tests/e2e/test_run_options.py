@@ -1,14 +1,19 @@
 import asyncio
+import json
 import os
 from datetime import datetime
 from shutil import copy
 
 import pytest
+from aiohttp import WSMsgType
 
-from further_link.util.message import create_message
+from further_link.__main__ import create_web_app
+from further_link.endpoint.run import resumable_run_managers
+from further_link.util import stats
+from further_link.util.message import BinaryCodec, create_message, parse_message
 
 from ..dirs import WORKING_DIRECTORY
-from . import E2E_PATH
+from . import E2E_PATH, RUN_PATH
 from .helpers import receive_data, wait_for_data
 from .test_data.image import jpeg_pixel_b64
 
@@ -35,6 +40,65 @@ print(datetime.now().strftime("%A"))
     await wait_for_data(run_ws_client, "stopped", "exitCode", 0, 0, "1")
 
 
+@pytest.mark.asyncio
+async def test_run_lossless_output(run_ws_client):
+    code = """\
+for i in range(30000):
+    print(i)
+"""
+    start_cmd = create_message(
+        "start",
+        "1",
+        {"runner": "python3", "code": code, "outputMode": "lossless"},
+        "1",
+    )
+    await run_ws_client.send_str(start_cmd)
+
+    await receive_data(run_ws_client, "started", process="1")
+
+    expected = "".join(f"{i}\n" for i in range(30000))
+    await wait_for_data(run_ws_client, "stdout", "output", expected, 0, "1")
+
+    await wait_for_data(run_ws_client, "stopped", "exitCode", 0, 0, "1")
+
+
+@pytest.mark.asyncio
+async def test_run_compact_output(run_ws_client):
+    code = """\
+import time
+for i in range(1001):
+    print(f"\\r{i / 10:5.1f}%", end="", flush=True)
+time.sleep(0.2)
+print()
+"""
+    start_cmd = create_message(
+        "start",
+        "1",
+        {"runner": "python3", "code": code, "compactOutput": True},
+        "1",
+    )
+    await run_ws_client.send_str(start_cmd)
+
+    await receive_data(run_ws_client, "started", process="1")
+
+    output = ""
+    while True:
+        m_type, m_data, m_process, _ = parse_message(
+            (await run_ws_client.receive()).data
+        )
+        assert m_process == "1"
+        if m_type == "stopped":
+            assert m_data["exitCode"] == 0
+            break
+        assert m_type == "stdout"
+        output += m_data["output"]
+
+    # the progress is redrawn far faster than it is flushed, so only the last
+    # updates of each flush are sent
+    assert output.endswith("\r100.0%\n")
+    assert output.count("\r") < 100
+
+
 @pytest.mark.asyncio
 async def test_run_code_relative_path(run_ws_client):
     copy("{}/test_data/print_date.py".format(E2E_PATH), WORKING_DIRECTORY)
@@ -103,6 +167,185 @@ echo $LOGNAME
     await wait_for_data(run_ws_client_query, "stopped", "exitCode", 0, 0, "1")
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query_params", [{"batch": "1"}])
+async def test_run_batch(run_ws_client_query):
+    code = """\
+for i in range(100):
+    print(i)
+"""
+    for process in ("1", "2"):
+        start_cmd = create_message(
+            "start", "1", {"runner": "python3", "code": code}, process
+        )
+        await run_ws_client_query.send_str(start_cmd)
+
+    frames = 0
+    output = {"1": "", "2": ""}
+    stopped = set()
+    while len(stopped) < 2:
+        frames += 1
+        message = parse_message((await run_ws_client_query.receive()).data)
+        m_type, m_data, _, _ = message
+        if m_type == "batch":
+            messages = [parse_message(json.dumps(m)) for m in m_data["messages"]]
+            assert len(messages) > 1
+        else:
+            messages = [message]
+
+        for m_type, m_data, m_process, _ in messages:
+            if m_type == "stdout":
+                output[m_process] += m_data["output"]
+            elif m_type == "stopped":
+                stopped.add(m_process)
+
+    expected = "".join(f"{i}\n" for i in range(100))
+    assert output == {"1": expected, "2": expected}
+
+    # connections of other tests may not have been cleaned up yet
+    (connection,) = [c for c in stats.get_stats()["connections"].values() if c["batch"]]
+    assert connection["batch"]
+    assert connection["frames"] == frames
+    assert connection["messages"] >= frames
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query_params", [{"format": "binary"}])
+async def test_run_binary(run_ws_client_query):
+    client = BinaryCodec()
+    server = BinaryCodec()
+
+    async def receive():
+        message = await run_ws_client_query.receive()
+        assert message.type == WSMsgType.BINARY
+        return server.parse_message(message.data)
+
+    code = "print(input())"
+    start_cmd = client.create_message(
+        "start", "1", {"runner": "python3", "code": code}, "1"
+    )
+    await run_ws_client_query.send_bytes(start_cmd)
+    assert await receive() == ("started", {}, "1", "")
+
+    user_input = client.create_message("stdin", "1", {"input": "hi 🚀\n"}, "1")
+    await run_ws_client_query.send_bytes(user_input)
+    assert await receive() == ("stdout", {"output": "hi 🚀\n"}, "1", "")
+    assert await receive() == ("stopped", {"exitCode": 0}, "1", "")
+
+
+@pytest.mark.asyncio
+async def test_run_compressed(aiohttp_client):
+    client = await aiohttp_client(await create_web_app())
+    url = RUN_PATH + "?compressLevel=6&compressThreshold=100"
+    async with client.ws_connect(url, compress=15, receive_timeout=0.5) as ws:
+        assert ws.compress == 15
+
+        code = "print('hello ' * 20)"
+        start_cmd = create_message(
+            "start", "1", {"runner": "python3", "code": code}, "1"
+        )
+        await ws.send_str(start_cmd)
+
+        await receive_data(ws, "started", process="1")
+        await wait_for_data(ws, "stdout", "output", "hello " * 20 + "\n", 0, "1")
+        await wait_for_data(ws, "stopped", "exitCode", 0, 0, "1")
+
+        (compression,) = [
+            c["compression"]
+            for c in stats.get_stats()["connections"].values()
+            if c.get("compression", {}).get("enabled")
+        ]
+        assert compression["level"] == 6
+        assert compression["threshold"] == 100
+        # only the output is over the threshold
+        assert compression["frames"] == 3
+        assert compression["compressed_frames"] == 1
+        assert compression["bytes_out"] < compression["bytes_in"]
+
+
+@pytest.mark.asyncio
+async def test_run_resume(aiohttp_client):
+    client = await aiohttp_client(await create_web_app())
+    url = RUN_PATH + "?client=1&resumable=1"
+    code = """\
+import time
+for i in range(5):
+    print(i, flush=True)
+    time.sleep(0.2)
+"""
+    start_cmd = create_message("start", "1", {"runner": "python3", "code": code}, "1")
+
+    async with client.ws_connect(url, receive_timeout=0.5) as ws:
+        m_type, m_data, _, _ = parse_message((await ws.receive()).data)
+        assert m_type == "session"
+        assert m_data["grace"] > 0
+        token = m_data["token"]
+
+        await ws.send_str(start_cmd)
+        await receive_data(ws, "started", process="1")  # seq 1
+        await receive_data(ws, "stdout", "output", "0\n", "1")  # seq 2
+
+    # the process carries on while disconnected
+    await asyncio.sleep(1.5)
+
+    url += f"&resume={token}&seq=2"
+    async with client.ws_connect(url, receive_timeout=0.5) as ws:
+        await receive_data(ws, "resumed", "seq", 3)
+        output = ""
+        m_type, m_data, _, _ = parse_message((await ws.receive()).data)
+        while m_type == "stdout":
+            output += m_data["output"]
+            m_type, m_data, _, _ = parse_message((await ws.receive()).data)
+        assert output == "1\n2\n3\n4\n"
+        assert m_type == "stopped"
+
+        (connection,) = [
+            c for c in stats.get_stats()["connections"].values() if c["resumes"]
+        ]
+        assert connection["resumable"]
+
+    # an unknown token starts a new session
+    url = RUN_PATH + "?client=1&resume=unknown&seq=2"
+    async with client.ws_connect(url, receive_timeout=0.5) as ws:
+        m_type, m_data, _, _ = parse_message((await ws.receive()).data)
+        assert m_type == "session"
+        assert m_data["token"] != token
+
+    for key, run_manager in list(resumable_run_managers.items()):
+        del resumable_run_managers[key]
+        await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_observe(aiohttp_client):
+    client = await aiohttp_client(await create_web_app())
+    code = """\
+import time
+time.sleep(0.5)
+print("hello")
+"""
+    start_cmd = create_message("start", "1", {"runner": "python3", "code": code}, "1")
+    observe_url = RUN_PATH + "?client=teacher&observe=student&process=1"
+
+    async with client.ws_connect(RUN_PATH + "?client=student") as ws:
+        await ws.send_str(start_cmd)
+        await receive_data(ws, "started", process="1")
+
+        async with client.ws_connect(observe_url, receive_timeout=2) as observer:
+            await observer.send_str(create_message("ping", "teacher"))
+            await receive_data(observer, "pong")
+            await receive_data(observer, "stdout", "output", "hello\n", "1")
+            await receive_data(observer, "stopped", "exitCode", 0, "1")
+            # closed when the process stops
+            assert (await observer.receive()).type == WSMsgType.CLOSE
+
+        await wait_for_data(ws, "stdout", "output", "hello\n", 0, "1")
+        await wait_for_data(ws, "stopped", "exitCode", 0, 0, "1")
+
+    async with client.ws_connect(observe_url, receive_timeout=0.5) as observer:
+        await receive_data(observer, "error", "message", "Process not found")
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("query_params", [{"pty": "1"}])
 async def test_input_pty(run_ws_client_query):
@@ -0,0 +1,160 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+from mock import AsyncMock, Mock
+
+from further_link.runner import display_pool
+from further_link.runner.display_pool import DisplayPool
+from further_link.util.id_generator import IdGenerator
+
+
+@pytest.fixture
+def vnc(tmp_path):
+    """Displays started by pt-web-vnc, which create their X socket."""
+
+    async def start(display_id, **kwargs):
+        await asyncio.sleep(0.05)
+        (tmp_path / f"X{display_id}").touch()
+
+    async def stop(display_id):
+        if (tmp_path / f"X{display_id}").exists():
+            (tmp_path / f"X{display_id}").unlink()
+
+    vnc = Mock()
+    vnc.async_start = AsyncMock(side_effect=start)
+    vnc.async_stop = AsyncMock(side_effect=stop)
+    vnc.async_clients = AsyncMock(return_value=0)
+    vnc.window_count = AsyncMock(return_value=2)
+    with patch.multiple(
+        display_pool,
+        X11_DIR=str(tmp_path),
+        SETTLE_TIME=0,
+        async_start=vnc.async_start,
+        async_stop=vnc.async_stop,
+        async_clients=vnc.async_clients,
+        async_connection_details=AsyncMock(),
+        start_activity_monitor=Mock(),
+        stop_activity_monitor=AsyncMock(),
+        start_screenshot_monitor=Mock(),
+        stop_screenshot_monitor=AsyncMock(),
+        _window_count=vnc.window_count,
+    ), patch.dict(
+        os.environ,
+        {"FURTHER_LINK_VNC_POOL": "1", "FURTHER_LINK_VNC_POOL_SIZES": "780x620"},
+    ):
+        yield vnc
+
+
+@pytest.fixture
+async def pool(vnc):
+    pool = DisplayPool(IdGenerator(min_value=100, max_value=999))
+    pool.start()
+    yield pool
+    await pool.stop()
+    assert pool.ids.used_ids == []
+
+
+async def wait_ready(pool, n):
+    for _ in range(100):
+        if pool.ready() == n and not any(pool._starting.values()):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("displays not ready")
+
+
+@pytest.mark.asyncio
+async def test_lease(vnc, pool):
+    await wait_ready(pool, 1)
+    display = await pool.lease(width=780, height=620)
+    assert display.is_alive()
+    assert display.id in pool.ids.used_ids
+    assert pool.hits == 1
+
+    # a display is started to replace it
+    await wait_ready(pool, 1)
+    assert vnc.async_start.call_count == 2
+    vnc.async_start.assert_called_with(
+        display_id=pool._ready[(780, 620)][0].id,
+        ssl_certificate=display_pool.VNC_CERTIFICATE_PATH,
+        with_window_manager=True,
+        height=620,
+        width=780,
+    )
+
+    # and the pool is full, so the display is stopped when released
+    await pool.release(display)
+    vnc.async_stop.assert_called_with(display.id)
+    assert display.id not in pool.ids.used_ids
+    assert pool.ready() == 1
+
+
+@pytest.mark.asyncio
+async def test_lease_returned(vnc, pool):
+    await wait_ready(pool, 1)
+    display = await pool.lease(width=780, height=620)
+
+    # returned while its replacement is starting, which is stopped instead
+    await asyncio.sleep(0.01)
+    await pool.release(display)
+    await wait_ready(pool, 1)
+    assert pool._ready[(780, 620)] == [display]
+    assert vnc.async_stop.call_count == 1
+
+    assert await pool.lease(width=780, height=620) is display
+    assert pool.hits == 2
+    await pool.release(display)
+
+
+@pytest.mark.asyncio
+async def test_lease_waits_for_starting(vnc, pool):
+    # the display started with the pool is ready sooner than a new one
+    display = await pool.lease(width=780, height=620)
+    assert pool.hits == 1
+    await asyncio.sleep(0.01)
+    assert vnc.async_start.call_count == 2
+    await pool.release(display)
+
+
+@pytest.mark.asyncio
+async def test_lease_miss(vnc, pool):
+    await wait_ready(pool, 1)
+    display = await pool.lease(width=100, height=100)
+    assert display.is_alive()
+    assert pool.misses == 1
+    assert pool.hit_rate() == 0
+
+    # displays of sizes not kept are stopped
+    await pool.release(display)
+    vnc.async_stop.assert_called_once_with(display.id)
+
+
+@pytest.mark.parametrize("clients, windows", [(1, 2), (0, 3)])
+@pytest.mark.asyncio
+async def test_release_not_scrubbed(vnc, pool, clients, windows):
+    await wait_ready(pool, 1)
+    display = await pool.lease(width=780, height=620)
+
+    # displays still viewed, or with windows left open, are stopped
+    vnc.async_clients.return_value = clients
+    vnc.window_count.return_value = windows
+    await pool.release(display)
+    vnc.async_stop.assert_called_once_with(display.id)
+    assert display not in pool._ready[(780, 620)]
+
+
+@pytest.mark.asyncio
+async def test_start_error(vnc, pool):
+    await wait_ready(pool, 1)
+    await pool.stop()
+
+    # displays aren't started again for a while after one fails
+    vnc.window_count.return_value = None
+    pool.start()
+    await asyncio.sleep(0.2)
+    pool.fill()
+    await asyncio.sleep(0.2)
+    assert vnc.async_start.call_count == 2
+    assert pool.ready() == 0
+    assert pool.ids.used_ids == []
@@ -0,0 +1,132 @@
+import asyncio
+import getpass
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+from mock import AsyncMock
+
+from further_link.runner.kernel_process_handler import KernelProcessHandler
+from further_link.runner.zygote import ZygoteProcess, stop_zygotes
+
+user = getpass.getuser()
+
+
+class Cells:
+    """Collects output and kernel messages in the order they arrive."""
+
+    def __init__(self):
+        self.events = []
+        self.replies = asyncio.Queue()
+
+    async def on_output(self, channel, output):
+        self.events.append((channel, output))
+
+    async def on_kernel_message(self, type, data):
+        self.events.append((type, data))
+        await self.replies.put((type, data))
+
+    async def reply(self):
+        return await asyncio.wait_for(self.replies.get(), 5)
+
+    def output(self):
+        output = "".join(o for c, o in self.events if c in ("stdout", "stderr"))
+        self.events.clear()
+        return output
+
+
+def start_kernel(cells, pty=False):
+    p = KernelProcessHandler(user, pty=pty)
+    p.on_start = AsyncMock()
+    p.on_stop = AsyncMock()
+    p.on_output = cells.on_output
+    p.on_kernel_message = cells.on_kernel_message
+    return p
+
+
+@pytest.mark.asyncio
+async def test_kernel_cells():
+    cells = Cells()
+    p = start_kernel(cells)
+    with tempfile.TemporaryDirectory() as work_dir:
+        await p.start(work_dir, "import os\nx = 1\nprint(os.getcwd())")
+        assert await cells.reply() == ("executed", {"ok": True, "error": None})
+        # the reply follows the cell's output
+        assert cells.events[-1][0] == "executed"
+        assert cells.output() == f"{work_dir}\n"
+
+        # the namespace is kept, and a final expression is printed
+        await p.execute("x += 1\nx")
+        await p.execute("print(input())")
+        await p.send_input("hello\n")
+        assert await cells.reply() == ("executed", {"ok": True, "error": None})
+        assert await cells.reply() == ("executed", {"ok": True, "error": None})
+        assert cells.output() == "2\nhello\n"
+
+        await p.reset()
+        assert await cells.reply() == ("reset", {})
+        await p.execute("print(x)")
+        assert await cells.reply() == (
+            "executed",
+            {"ok": False, "error": "NameError"},
+        )
+        output = cells.output()
+        assert output.startswith(
+            "Traceback (most recent call last):\n"
+            '  File "<cell 4>", line 1, in <module>\n'
+            "    print(x)\n"
+        )
+        assert output.endswith("NameError: name 'x' is not defined\n")
+
+        await p.execute("import time\ntime.sleep(10)")
+        await asyncio.sleep(0.5)
+        await p.interrupt()
+        assert await cells.reply() == (
+            "executed",
+            {"ok": False, "error": "KeyboardInterrupt"},
+        )
+
+        # the kernel is still running
+        await p.execute("print('still here')")
+        assert await cells.reply() == ("executed", {"ok": True, "error": None})
+        assert "still here\n" in cells.output()
+
+        await p.stop()
+        await p.process.wait()
+        await asyncio.sleep(0.5)
+    p.on_stop.assert_called_with(-15)
+
+
+@pytest.mark.asyncio
+async def test_kernel_exit():
+    cells = Cells()
+    p = start_kernel(cells, pty=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+        await p.start(work_dir, "print('hi')")
+        assert await cells.reply() == ("executed", {"ok": True, "error": None})
+        assert cells.output() == "hi\r\n"
+
+        await p.execute("import sys\nsys.exit(3)")
+        await p.process.wait()
+        await asyncio.sleep(0.5)
+    p.on_stop.assert_called_with(3)
+
+
+@pytest.mark.asyncio
+async def test_kernel_zygote():
+    cells = Cells()
+    with patch.dict(os.environ, {"FURTHER_LINK_PY_ZYGOTE": "1"}):
+        p = start_kernel(cells)
+        with tempfile.TemporaryDirectory() as work_dir:
+            await p.start(work_dir, "import sys\nprint(sys.argv[1:])")
+            assert isinstance(p.process, ZygoteProcess)
+            assert await cells.reply() == ("executed", {"ok": True, "error": None})
+            assert cells.output() == "[]\n"
+
+            await p.stop()
+            await p.process.wait()
+            await asyncio.sleep(0.5)
+
+    await stop_zygotes()
+    p.on_stop.assert_called_with(-15)
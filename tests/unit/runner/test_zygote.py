@@ -0,0 +1,129 @@
+import asyncio
+import getpass
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+import pytest
+from mock import AsyncMock
+
+from further_link.runner.py_process_handler import PyProcessHandler
+from further_link.runner.zygote import Zygote, ZygoteProcess, stop_zygotes
+
+user = getpass.getuser()
+
+script = """\
+import os, sys
+print(sys.argv[0], os.getcwd(), os.environ.get("GREETING"))
+print("colorsys" in sys.modules, os.getpid() == os.getpgid(0))
+print(input())
+raise ValueError("oops")
+"""
+
+
+@pytest.mark.asyncio
+async def test_zygote_spawn():
+    zygote = Zygote(sys.executable, ["colorsys"])
+    await zygote.start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "main.py")
+            with open(path, "w") as file:
+                file.write(script)
+
+            process = await zygote.spawn(
+                [path], work_dir, {"GREETING": "hi"}, user, asyncio.subprocess.PIPE
+            )
+            process.stdin.write(b"hello\n")
+            await process.stdin.drain()
+
+            assert await process.wait() == 1
+            assert process.returncode == 1
+            stdout = await process.stdout.read()
+            stderr = await process.stderr.read()
+    finally:
+        await zygote.stop()
+
+    # preloaded in a new session, as a python3 run
+    assert stdout.decode() == f"{path} {work_dir} hi\nTrue True\nhello\n"
+    # without the zygote's frames
+    assert stderr.decode() == (
+        "Traceback (most recent call last):\n"
+        f'  File "{path}", line 5, in <module>\n'
+        '    raise ValueError("oops")\n'
+        "ValueError: oops\n"
+    )
+    assert not zygote.is_running()
+
+
+@pytest.mark.asyncio
+async def test_zygote_spawn_process_group():
+    zygote = Zygote(sys.executable, [])
+    await zygote.start()
+    processes = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "main.py")
+            with open(path, "w") as file:
+                file.write("input()\n")
+
+            for _ in range(20):
+                process = await zygote.spawn(
+                    [path], work_dir, {}, user, asyncio.subprocess.PIPE
+                )
+                processes.append(process)
+                # as soon as the pid is known, the run is in its own group
+                assert os.getpgid(process.pid) == process.pid
+
+            for process in processes:
+                process.stdin.close()
+                assert await process.wait() == 1  # input() at end of file
+    finally:
+        await zygote.stop()
+
+
+@pytest.mark.asyncio
+async def test_py_process_handler_zygote():
+    with patch.dict(os.environ, {"FURTHER_LINK_PY_ZYGOTE": "1"}):
+        with tempfile.TemporaryDirectory() as work_dir:
+            p = PyProcessHandler(user)
+            p.on_start = AsyncMock()
+            p.on_stop = AsyncMock()
+            p.on_output = AsyncMock()
+
+            await p.start(work_dir, "import sys\nprint(input())\nsys.exit(4)")
+            assert isinstance(p.process, ZygoteProcess)
+            # stopping the run mustn't signal further-link's process group
+            assert p.pgid == p.process.pid
+            assert p.pgid != os.getpgid(0)
+
+            await p.send_input("hello\n")
+            await p.process.wait()
+            await asyncio.sleep(1)
+
+    await stop_zygotes()
+    p.on_output.assert_called_with("stdout", "hello\n")
+    p.on_stop.assert_called_with(4)
+
+
+@pytest.mark.asyncio
+async def test_py_process_handler_zygote_fallback():
+    with patch.dict(os.environ, {"FURTHER_LINK_PY_ZYGOTE": "1"}):
+        with patch("further_link.runner.zygote.SERVER_SCRIPT", "/nonexistent.py"):
+            with tempfile.TemporaryDirectory() as work_dir:
+                p = PyProcessHandler(user)
+                p.on_start = AsyncMock()
+                p.on_stop = AsyncMock()
+                p.on_output = AsyncMock()
+
+                await p.start(work_dir, "print('hello')")
+                # started with python3 instead
+                assert isinstance(p.process, asyncio.subprocess.Process)
+
+                await p.process.wait()
+                await asyncio.sleep(1)
+
+    await stop_zygotes()
+    p.on_output.assert_called_with("stdout", "hello\n")
+    p.on_stop.assert_called_with(0)
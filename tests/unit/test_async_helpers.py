@@ -5,7 +5,14 @@ from time import time
 import pytest
 from mock import AsyncMock
 
-from further_link.util.async_helpers import race, ringbuf_read, timeout
+from further_link.util.async_helpers import (
+    FlushPolicy,
+    RingBuffer,
+    race,
+    ringbuf_read,
+    timeout,
+)
+from further_link.util.terminal import compact_output
 
 
 @pytest.mark.asyncio
@@ -63,18 +70,21 @@ async def test_ringbuf_read():
     fast_stream.feed_data(b"a" * bytes_buffered + b"b" * bytes_buffered)
 
     read_callback = AsyncMock()
+    dropped_callback = AsyncMock()
 
     ringbuf_read_task = asyncio.create_task(
         ringbuf_read(
             fast_stream,
             read_callback,
             kBps=kBps,
+            on_dropped=dropped_callback,
         )
     )
     await asyncio.sleep(buffer_time + 0.01)
 
     # first chunk_size bytes of 'a's should be dropped
     read_callback.assert_called_with("b" * bytes_buffered)
+    dropped_callback.assert_called_once_with(bytes_buffered, 1)
 
     fast_stream.feed_eof()
     await asyncio.sleep(buffer_time + 0.01)
@@ -108,3 +118,195 @@ async def test_ringbuf_read_done_condition():
     read_callback.assert_called_with("hello")
     await asyncio.sleep(done_time - buffer_time)
     assert ringbuf_read_task.done()
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_task_allocations():
+    stream = asyncio.StreamReader()
+    read_callback = AsyncMock()
+    created = 0
+
+    loop = asyncio.get_running_loop()
+
+    def task_factory(loop, coro, **kwargs):
+        nonlocal created
+        created += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    loop.set_task_factory(task_factory)
+    try:
+        ringbuf_read_task = asyncio.ensure_future(ringbuf_read(stream, read_callback))
+        for _ in range(100):
+            stream.feed_data(b"a" * 256)
+            await asyncio.sleep(0)
+        stream.feed_eof()
+        await ringbuf_read_task
+    finally:
+        loop.set_task_factory(None)
+
+    # the reader and done condition tasks live for the whole read, rather than
+    # being created for every chunk
+    assert created <= 3
+    assert "".join(c.args[0] for c in read_callback.call_args_list) == "a" * 25600
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_lossless():
+    kBps = 20  # 2000 byte buffer
+    stream = asyncio.StreamReader()
+    received = []
+
+    async def slow_output(output):
+        received.append(output)
+        await asyncio.sleep(0.05)
+
+    ringbuf_read_task = asyncio.create_task(
+        ringbuf_read(stream, slow_output, kBps=kBps, lossless=True)
+    )
+
+    # far more than the buffer holds, in one go
+    data = "".join(f"{i}\n" for i in range(2000))
+    stream.feed_data(data.encode())
+    stream.feed_eof()
+
+    await asyncio.wait_for(ringbuf_read_task, 5)
+    assert "".join(received) == data
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_lossless_drains_after_done():
+    stream = asyncio.StreamReader()
+    stream.feed_data(b"a" * 5000)  # left in the stream when done, no EOF
+    read_callback = AsyncMock()
+
+    await asyncio.wait_for(
+        ringbuf_read(
+            stream,
+            read_callback,
+            done_condition=partial(asyncio.sleep, 0),
+            kBps=20,
+            lossless=True,
+        ),
+        5,
+    )
+
+    assert "".join(c.args[0] for c in read_callback.call_args_list) == "a" * 5000
+
+
+def test_ring_buffer_dropped_counts():
+    ringbuf = RingBuffer(max_bytes=10)
+    ringbuf.append("aaaa")
+    ringbuf.append("bbbb")
+    ringbuf.append("cccc")  # drops two of the a's
+
+    assert ringbuf.dropped_bytes == 2
+    assert ringbuf.peek() == "aabbbbcccc"
+    assert ringbuf.dropped_chunks == 1
+
+    ringbuf.append("dd")  # drops the rest of the partially dropped chunk
+    assert ringbuf.peek() == "bbbbccccdd"
+    assert ringbuf.dropped_bytes == 4
+    assert ringbuf.dropped_chunks == 1
+
+    ringbuf.append("e" * 12)  # drops everything, and the start of itself
+    assert ringbuf.peek() == "e" * 10
+    assert ringbuf.dropped_bytes == 16
+    assert ringbuf.dropped_chunks == 5
+
+    assert ringbuf.take(4) == "eeee"
+    assert ringbuf.size == 6
+
+
+def test_ring_buffer_multibyte():
+    ringbuf = RingBuffer(max_bytes=10)
+    ringbuf.append("a🚀b🚀")  # 10 bytes
+
+    # a split character is taken whole or not at all
+    assert ringbuf.take(3) == "a"
+    assert ringbuf.size == 9
+    assert ringbuf.take(5) == "🚀b"
+    assert ringbuf.size == 4
+
+    # a split character is dropped whole
+    ringbuf.append("é" * 4)  # 8 bytes, 2 over
+    assert ringbuf.peek() == "éééé"
+    assert ringbuf.dropped_bytes == 4
+    assert ringbuf.size == 8
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_multibyte_split_across_reads():
+    stream = asyncio.StreamReader()
+    read_callback = AsyncMock()
+    ringbuf_read_task = asyncio.create_task(ringbuf_read(stream, read_callback))
+
+    data = ("[" + "🟩" * 20 + "⬜" * 10 + "] 66%\r").encode() * 50
+    # feed in pieces which split characters between reads and flushes
+    for i in range(0, len(data), 101):
+        stream.feed_data(data[i : i + 101])
+        await asyncio.sleep(0.01)
+    stream.feed_data(b"\xf0\x9f")  # ends part way through a character
+    stream.feed_eof()
+    await ringbuf_read_task
+
+    output = "".join(c.args[0] for c in read_callback.call_args_list)
+    assert output == data.decode() + "\ufffd"
+
+
+def test_ring_buffer_transform_before_dropping():
+    ringbuf = RingBuffer(max_bytes=10, transform=compact_output)
+    for i in range(10):
+        ringbuf.append(f"\r{i}%")
+
+    # redraws were compacted rather than dropped
+    assert ringbuf.dropped_bytes == 0
+    assert ringbuf.peek().endswith("\r9%")
+
+    ringbuf.append("\n" + "a" * 10)  # can't be compacted
+    assert ringbuf.peek() == "a" * 10
+
+
+def test_flush_policy():
+    policy = FlushPolicy(min_window=0.005, max_window=0.1, idle_time=0.05)
+
+    # output after being idle is flushed almost at once
+    assert policy.window(0) == 0.005
+    policy.flushed(0.005)
+    assert policy.window(1) == 0.005
+    policy.flushed(1.005)
+
+    # sustained output widens the window up to the max
+    now = 1.005
+    windows = []
+    for _ in range(8):
+        window = policy.window(now)
+        windows.append(window)
+        now += window
+        policy.flushed(now)
+    assert windows[:4] == [0.01, 0.02, 0.04, 0.08]
+    assert windows[4:] == [0.1] * 4
+
+    # and idling resets it
+    assert policy.window(now + 0.06) == 0.005
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_flushes_interactive_output_at_once():
+    stream = asyncio.StreamReader()
+    flushed = asyncio.Queue()
+
+    async def on_output(output):
+        flushed.put_nowait((asyncio.get_running_loop().time(), output))
+
+    ringbuf_read_task = asyncio.create_task(ringbuf_read(stream, on_output))
+    loop = asyncio.get_running_loop()
+    for key in "abc":
+        await asyncio.sleep(0.1)
+        sent = loop.time()
+        stream.feed_data(key.encode())
+        received, output = await flushed.get()
+        assert output == key
+        assert received - sent < 0.05
+
+    stream.feed_eof()
+    await ringbuf_read_task
@@ -0,0 +1,220 @@
+import struct
+import zlib
+
+import pytest
+from aiohttp import WSMsgType, web
+
+from further_link.util.compression import (
+    DEFLATE_TRAILER,
+    CompressionSettings,
+    DeflateSender,
+    negotiated_sender,
+)
+
+
+class Transport:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    def is_closing(self):
+        return False
+
+
+class Socket:
+    def __init__(self):
+        self.closed = False
+        self._closing = False
+
+
+class Writer:
+    def __init__(self, transport):
+        self.transport = transport
+        self.drains = 0
+
+    async def drain(self):
+        self.drains += 1
+
+
+def parse_frame(frame):
+    first, length = struct.unpack("!BB", frame[:2])
+    payload = frame[2:]
+    if length == 126:
+        (length,) = struct.unpack("!H", frame[2:4])
+        payload = frame[4:]
+    assert len(payload) == length
+    return first & 0x0F, bool(first & 0x40), payload
+
+
+def inflate(decompressor, payload):
+    return decompressor.decompress(payload + DEFLATE_TRAILER)
+
+
+def test_settings_from_env(monkeypatch):
+    assert vars(CompressionSettings.from_env()) == vars(CompressionSettings())
+
+    monkeypatch.setenv("FURTHER_LINK_WS_COMPRESS", "0")
+    monkeypatch.setenv("FURTHER_LINK_WS_COMPRESS_LEVEL", "6")
+    monkeypatch.setenv("FURTHER_LINK_WS_WINDOW_BITS", "10")
+    monkeypatch.setenv("FURTHER_LINK_WS_COMPRESS_THRESHOLD", "64")
+    settings = CompressionSettings.from_env()
+    assert vars(settings) == {
+        "enabled": False,
+        "level": 6,
+        "window_bits": 10,
+        "threshold": 64,
+    }
+
+
+def test_settings_with_query():
+    settings = CompressionSettings(level=6, window_bits=12, threshold=64)
+    assert vars(settings.with_query({})) == vars(settings)
+    assert vars(
+        settings.with_query(
+            {
+                "compress": "0",
+                "compressLevel": "9",
+                "windowBits": "9",
+                "compressThreshold": "0",
+            }
+        )
+    ) == {"enabled": False, "level": 9, "window_bits": 9, "threshold": 0}
+
+    # invalid values leave the server's settings
+    invalid = settings.with_query(
+        {"compressLevel": "10", "windowBits": "8", "compressThreshold": "lots"}
+    )
+    assert vars(invalid) == vars(settings)
+
+
+@pytest.mark.asyncio
+async def test_deflate_sender_round_trip():
+    transport = Transport()
+    sender = DeflateSender(Socket(), Writer(transport), CompressionSettings())
+    decompressor = zlib.decompressobj(-15)
+    message = '{"type": "stdout", "data": {"output": "hello\\n"}, "process": "1"}'
+
+    for _ in range(3):
+        await sender.send_str(message)
+    await sender.send_bytes(b"\x01\x09binary")
+
+    sent = [parse_frame(frame) for frame in transport.frames]
+    assert [opcode for opcode, _, _ in sent] == [1, 1, 1, 2]
+    assert all(compressed for _, compressed, _ in sent)
+    assert [inflate(decompressor, payload) for _, _, payload in sent] == [
+        message.encode()
+    ] * 3 + [b"\x01\x09binary"]
+
+    # repeats refer back to the first message
+    assert len(sent[1][2]) < len(sent[0][2]) / 4
+
+
+@pytest.mark.asyncio
+async def test_deflate_sender_threshold():
+    transport = Transport()
+    sender = DeflateSender(
+        Socket(), Writer(transport), CompressionSettings(threshold=16)
+    )
+    decompressor = zlib.decompressobj(-15)
+
+    await sender.send_str("small")
+    await sender.send_str("large " * 10)
+
+    (_, small_compressed, small), (_, large_compressed, large) = [
+        parse_frame(frame) for frame in transport.frames
+    ]
+    assert not small_compressed and small == b"small"
+    assert large_compressed and inflate(decompressor, large) == b"large " * 10
+
+    stats = sender.stats()
+    assert stats["frames"] == 2
+    assert stats["compressed_frames"] == 1
+    assert stats["bytes_in"] == 5 + 60
+    assert stats["bytes_out"] == 5 + len(large)
+    assert stats["ratio"] == stats["bytes_out"] / stats["bytes_in"]
+    assert stats["cpu_seconds"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_deflate_sender_no_context_takeover():
+    transport = Transport()
+    sender = DeflateSender(
+        Socket(),
+        Writer(transport),
+        CompressionSettings(),
+        window_bits=10,
+        no_context_takeover=True,
+    )
+    assert sender.window_bits == 10
+
+    await sender.send_str("hello world")
+    await sender.send_str("hello world")
+
+    # each message can be inflated on its own
+    for frame in transport.frames:
+        _, _, payload = parse_frame(frame)
+        assert inflate(zlib.decompressobj(-10), payload) == b"hello world"
+
+
+@pytest.mark.asyncio
+async def test_deflate_sender_closing():
+    transport = Transport()
+    socket = Socket()
+    writer = Writer(transport)
+    sender = DeflateSender(socket, writer, CompressionSettings())
+
+    await sender.send_str("hello")
+    assert len(transport.frames) == 1
+    assert writer.drains == 1
+
+    # no data frame may follow the close frame
+    socket.closed = True
+    with pytest.raises(ConnectionResetError):
+        await sender.send_str("hello")
+    assert len(transport.frames) == 1
+    assert sender.stats()["frames"] == 1
+
+    # nor be sent once the client has started closing
+    socket.closed = False
+    socket._closing = True
+    with pytest.raises(ConnectionResetError):
+        await sender.send_bytes(b"hello")
+    assert len(transport.frames) == 1
+
+
+@pytest.mark.asyncio
+async def test_deflate_sender_aiohttp(aiohttp_client):
+    # frames written alongside the installed aiohttp's writer. The handler
+    # records what it sees, as errors in it are only logged by aiohttp
+    seen = []
+
+    async def handler(request):
+        socket = web.WebSocketResponse(compress=True)
+        writer = await socket.prepare(request)
+        sender = negotiated_sender(socket, writer, CompressionSettings(threshold=16))
+        await sender.send_str("small")
+        await sender.send_str("large " * 10)
+        await sender.send_bytes(b"\x01\x09binary")
+        seen.append(sender.is_closing())
+
+        msg = await socket.receive()
+        seen.append(msg.type)
+        seen.append(sender.is_closing())
+        try:
+            await sender.send_str("after close")
+        except ConnectionResetError:
+            seen.append("not sent")
+        return socket
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    client = await aiohttp_client(app)
+    async with client.ws_connect("/", compress=15, receive_timeout=1) as ws:
+        assert await ws.receive_str() == "small"
+        assert await ws.receive_str() == "large " * 10
+        assert await ws.receive_bytes() == b"\x01\x09binary"
+        await ws.close()
+
+    assert seen == [False, WSMsgType.CLOSE, True, "not sent"]
@@ -0,0 +1,81 @@
+import getpass
+import os
+from unittest.mock import patch
+
+import pytest
+
+from further_link.util import environment
+from further_link.util.environment import EnvironmentTemplates
+from further_link.util.user_config import get_home_directory
+
+user = getpass.getuser()
+
+
+@pytest.fixture
+def templates(tmp_path):
+    x11 = tmp_path / ".X11-unix"
+    x11.mkdir()
+    with patch.object(environment, "X11_DIR", str(x11)), patch.object(
+        environment, "XDG_RUNTIME_PARENT", str(tmp_path / "run")
+    ):
+        yield EnvironmentTemplates()
+
+
+def test_environment(templates):
+    with patch(
+        "further_link.util.environment.get_first_display", return_value=":0"
+    ) as first_display, patch.dict(os.environ, {"SHELL": "/bin/false"}):
+        env = templates.environment(user, "/work", {"VIRTUAL_ENV": "/venv"})
+        assert env["USER"] == env["LOGNAME"] == user
+        assert env["HOME"] == get_home_directory(user)
+        assert env["PWD"] == "/work"
+        assert env["DISPLAY"] == ":0"
+        assert env["VIRTUAL_ENV"] == "/venv"
+        assert env["TERM"] == "xterm-256color"
+        assert None not in env.values()
+
+        # the template is used again, with this run's overlay
+        env["CHANGED"] = "1"
+        other = templates.environment(user, "/other", {"VIRTUAL_ENV": "/venv"})
+        assert other["PWD"] == "/other"
+        assert "CHANGED" not in other
+        novnc = templates.environment(user, "/work", display=":5")
+        assert novnc["DISPLAY"] == ":5"
+        assert "VIRTUAL_ENV" not in novnc
+        assert first_display.call_count == 1
+
+
+def test_environment_invalidated(templates):
+    with patch(
+        "further_link.util.environment.get_first_display", return_value=":0"
+    ) as first_display:
+        templates.environment(user, "/work")
+
+        # by this process's environment changing
+        with patch.dict(os.environ, {"FURTHER_LINK_TEST": "1"}):
+            assert templates.environment(user, "/work")["FURTHER_LINK_TEST"] == "1"
+        assert "FURTHER_LINK_TEST" not in templates.environment(user, "/work")
+        assert first_display.call_count == 3
+
+        # and by a display starting
+        first_display.return_value = ":1"
+        assert templates.environment(user, "/work")["DISPLAY"] == ":0"
+        open(os.path.join(environment.X11_DIR, "X1"), "w").close()
+        assert templates.environment(user, "/work")["DISPLAY"] == ":1"
+
+
+def test_environment_changes_detected_with_cpython_internals():
+    # changes to this process's environment are detected from os.environ's
+    # encoded variables, which are a CPython internal
+    assert environment._environ_data() is os.environ._data
+    with patch.dict(os.environ, {"FURTHER_LINK_TEST": "1"}):
+        assert environment._environ_data()[b"FURTHER_LINK_TEST"] == b"1"
+
+
+def test_environment_invalidated_without_cpython_internals(templates):
+    # and from os.environ itself, slower, where they're missing
+    with patch.object(environment, "_environ_data", return_value=os.environ):
+        templates.environment(user, "/work")
+        with patch.dict(os.environ, {"FURTHER_LINK_TEST": "1"}):
+            assert templates.environment(user, "/work")["FURTHER_LINK_TEST"] == "1"
+        assert "FURTHER_LINK_TEST" not in templates.environment(user, "/work")
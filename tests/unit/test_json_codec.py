@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from further_link.util.json_codec import Orjson, StdlibJson
+
+STRINGS = [
+    "",
+    "a",
+    'quote " and backslash \\',
+    "\r\n\t\x1b[32mgreen\x1b[0m\x00",
+    "hello 🚀",
+    "é" * 200,
+    "x" * 127 + "\n",
+    "0123456789abcdef\n" * 240,
+    "del \x7f" * 100,
+    "\ud83d lone surrogate" * 10,
+]
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request):
+    if request.param == "json":
+        return StdlibJson()
+    return Orjson(pytest.importorskip("orjson"))
+
+
+def test_encode_string_matches_json_dumps(backend):
+    for string in STRINGS:
+        assert backend.encode_string(string) == json.dumps(string)
+
+
+def test_loads(backend):
+    assert backend.loads('{"type": "stdin", "data": {"input": "a"}}') == {
+        "type": "stdin",
+        "data": {"input": "a"},
+    }
+    assert backend.loads(b'{"input": "\\ud83d"}') == {"input": "\ud83d"}
+    assert backend.loads(bytearray(b"[18446744073709551616]")) == [2**64]
+    with pytest.raises(json.decoder.JSONDecodeError):
+        backend.loads("{not json")
+
+
+def test_dumps_bytes(backend):
+    data = {"output": "hello 🚀", "big": 2**64, "list": [1, None]}
+    assert json.loads(backend.dumps_bytes(data)) == data
@@ -0,0 +1,158 @@
+import json
+from base64 import b64encode
+
+import pytest
+
+from further_link.util.bluetooth.utils import bytearray_to_dict
+from further_link.util.message import (
+    BadMessage,
+    BinaryCodec,
+    JsonCodec,
+    append_to_message,
+    create_message,
+    is_binary_message,
+    parse_message,
+)
+
+MESSAGES = [
+    ("ping", "client", None, None),
+    ("start", "client", {"runner": "python3", "code": "print('hi')"}, "1"),
+    ("stdin", "client", {"input": "hello\n"}, "1"),
+    ("stdout", "client", {"output": "hello 🚀\n"}, "1"),
+    ("stderr", "client", {"output": ""}, "2"),
+    ("stopped", "client", {"exitCode": 0}, "1"),
+    ("keylisten", "client", {"output": "ArrowUp"}, "1"),
+    ("video", "client", {"output": b64encode(b"\xff\xd8 jpeg").decode()}, "1"),
+    ("video", "client", {"output": "not base64!"}, "1"),
+    ("stdout", "client", {"output": "a", "extra": 1}, "1"),
+    ("something new", "", {"key": ["value"]}, None),
+]
+
+
+def normalised(message):
+    msg_type, msg_client, msg_data, msg_process = message
+    return msg_type, msg_data or {}, msg_process or "", msg_client or ""
+
+
+def test_create_message_matches_json_dumps():
+    for msg_type, msg_client, msg_data, msg_process in MESSAGES + [
+        ("stdout", "client", {"output": "0123456789abcdef\n" * 240}, "1"),
+        ("stdout", "client", {"output": "del \x7f" * 100}, "1"),
+        ("start", None, {"novncOptions": {"enabled": True, "height": 480}}, "1"),
+        ("stopped", "client", {"exitCode": -15}, "1"),
+    ]:
+        assert create_message(
+            msg_type, msg_client, msg_data, msg_process
+        ) == json.dumps(
+            {
+                "type": msg_type,
+                "data": msg_data,
+                "client": msg_client,
+                "process": msg_process,
+            }
+        )
+
+
+def test_append_to_message():
+    message = create_message("stdout", "client", {"output": "a"}, "1")
+    appended = append_to_message(message, {"client": "other", "id": 2})
+    # replaced rather than repeated, which not every client's parser accepts
+    assert appended.count('"client"') == 1
+    assert json.loads(appended) == {
+        "type": "stdout",
+        "data": {"output": "a"},
+        "client": "other",
+        "process": "1",
+        "id": 2,
+    }
+    assert json.loads(append_to_message(message, {})) == json.loads(message)
+    assert json.loads(append_to_message("{}", {"a": 1})) == {"a": 1}
+    with pytest.raises(BadMessage):
+        append_to_message("[]", {"a": 1})
+    with pytest.raises(BadMessage):
+        append_to_message("{", {"a": 1})
+
+
+def test_bytearray_to_dict():
+    message = bytearray(create_message("stdin", "1", {"input": ", }"}, "1").encode())
+    assert bytearray_to_dict(message)["data"] == {"input": ", }"}
+
+    # trailing commas are allowed
+    assert bytearray_to_dict(bytearray(b'{"a": [1, 2, ], "b": 1,\n}')) == {
+        "a": [1, 2],
+        "b": 1,
+    }
+
+
+@pytest.mark.parametrize("codec_class", [JsonCodec, BinaryCodec])
+def test_codec_round_trip(codec_class):
+    encoder = codec_class()
+    decoder = codec_class()
+    # twice, the second time with ids already interned
+    for message in MESSAGES + MESSAGES:
+        encoded = encoder.create_message(*message)
+        assert is_binary_message(encoded) == codec_class.binary
+        assert decoder.parse_message(encoded) == normalised(message)
+
+
+def test_binary_codec_matches_json():
+    for message in MESSAGES:
+        assert BinaryCodec().parse_message(
+            BinaryCodec().create_message(*message)
+        ) == parse_message(create_message(*message))
+
+
+def test_binary_codec_smaller_than_json():
+    codec = BinaryCodec()
+    message = ("stdout", "a-client-uuid", {"output": "a"}, "a-process-id")
+    first = codec.create_message(*message)
+    interned = codec.create_message(*message)
+
+    # type code, interned client and process, data format, output
+    assert len(interned) == 1 + 1 + 1 + 1 + 1 + 1
+    assert len(first) < len(create_message(*message)) / 2
+
+    # video frames are sent as the image bytes, not base64
+    jpeg = bytes(range(256)) * 30
+    video = ("video", "c", {"output": b64encode(jpeg).decode()}, "1")
+    assert len(codec.create_message(*video)) < len(jpeg) + 10
+
+
+def test_binary_codec_batch():
+    encoder = BinaryCodec()
+    messages = [encoder.create_message(*m) for m in MESSAGES[:4]]
+    batch = encoder.create_batch_message(messages, "client")
+
+    msg_type, msg_data, msg_process, msg_client = BinaryCodec().parse_message(batch)
+    assert (msg_type, msg_process, msg_client) == ("batch", "", "client")
+    assert msg_data["messages"] == [
+        {**json.loads(create_message(*m)), "data": m[2] or {}, "process": m[3] or ""}
+        for m in MESSAGES[:4]
+    ]
+
+
+def test_binary_codec_client_not_interned():
+    codec = BinaryCodec(intern_client=False)
+    for message in MESSAGES[:3]:
+        # every message can be read by a decoder which hasn't seen the others
+        assert BinaryCodec.parse_client(codec.create_message(*message)) == "client"
+
+    interned = BinaryCodec()
+    interned.create_message("ping", "client")
+    with pytest.raises(BadMessage):
+        BinaryCodec.parse_client(interned.create_message("ping", "client"))
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"\x01",
+        b"\x01\x09\x00\x00\x07",  # unknown data format
+        b"\x01\x09\x04\x00\x02a",  # client reference never defined
+        b"\x01\x09\x00\x00\x01{bad json",
+        b"\x01\x00\x05ab",  # type string longer than the message
+    ],
+)
+def test_binary_codec_invalid(message):
+    with pytest.raises(BadMessage):
+        BinaryCodec().parse_message(message)
@@ -9,11 +9,12 @@ from io import BytesIO
 from unittest.mock import call, patch
 
 import pytest
-from aiofiles.threadpool.binary import AsyncFileIO
 from mock import AsyncMock
 from PIL import Image
 
 from further_link.runner.process_handler import ProcessHandler
+from further_link.util import stats
+from further_link.util.terminal import PtyStream
 from further_link.util.vnc import VNC_CERTIFICATE_PATH
 
 from ..e2e.test_data.image import jpeg_pixel_b64
@@ -80,8 +81,8 @@ async def test_pty():
     await p.start('python3 -u -c "print(input())"')
     assert type(p.process) == Process
     assert p.pty
-    assert type(p.pty_master) == AsyncFileIO
-    assert type(p.pty_slave) == AsyncFileIO
+    assert type(p.pty_master) == PtyStream
+    assert type(p.pty_slave) == int
 
     p.on_start.assert_called()
 
@@ -217,3 +218,129 @@ pause()
     assert p.on_output.call_count == 1
 
     p.on_stop.assert_called_with(-15)
+
+
+@pytest.mark.asyncio
+async def test_novnc_display_pool():
+    p = ProcessHandler(user)
+
+    p.on_start = AsyncMock()
+    p.on_stop = AsyncMock()
+    p.on_output = AsyncMock()
+
+    code = """\
+import os
+print(os.environ['DISPLAY'])
+"""
+    novncOptions = {"enabled": True, "height": 620, "width": 780}
+
+    with patch.dict(os.environ, {"FURTHER_LINK_VNC_POOL": "1"}), patch(
+        "further_link.runner.process_handler.display_pool"
+    ) as pool, patch(
+        "further_link.runner.process_handler.async_start", AsyncMock()
+    ) as vnc_start:
+        pool.lease = AsyncMock()
+        pool.lease.return_value.id = 5
+        pool.release = AsyncMock()
+
+        await p.start(f'python3 -u -c "{code}"', novncOptions=novncOptions)
+        await p.process.wait()
+        await asyncio.sleep(0.5)
+
+        pool.lease.assert_called_with(width=780, height=620)
+        pool.lease.return_value.monitor.assert_called_with(
+            on_display_activity=p.handle_display_activity,
+            screenshot_timeout=1,
+        )
+        vnc_start.assert_not_called()
+        pool.release.assert_called_with(pool.lease.return_value)
+
+    p.on_output.assert_called_with("stdout", ":5\n")
+    p.on_stop.assert_called_with(0)
+
+
+@pytest.mark.parametrize("pty", [False, True])
+@pytest.mark.asyncio
+async def test_lossless_output(pty):
+    p = ProcessHandler(user, pty=pty, lossless=True)
+
+    p.on_start = AsyncMock()
+    p.on_stop = AsyncMock()
+    output = []
+
+    async def on_output(channel, data):
+        output.append(data)
+
+    p.on_output = on_output
+
+    # much more than the 128kBps websocket limit allows in the time it runs
+    await p.start("seq 1 40000")
+    await p.process.wait()
+    while not p.on_stop.called:
+        await asyncio.sleep(0.1)
+
+    newline = "\r\n" if pty else "\n"
+    expected = newline.join(str(i) for i in range(1, 40001)) + newline
+    assert "".join(output) == expected
+    p.on_stop.assert_called_with(0)
+
+
+@pytest.mark.asyncio
+async def test_dropped_output():
+    stats.reset_stats()
+    p = ProcessHandler(user)
+
+    p.on_start = AsyncMock()
+    p.on_stop = AsyncMock()
+    p.on_output = AsyncMock()
+    p.on_dropped = AsyncMock()
+
+    # much more than the 128kBps websocket limit allows in the time it runs
+    await p.start("seq 1 100000")
+    await p.process.wait()
+    while not p.on_stop.called:
+        await asyncio.sleep(0.1)
+
+    dropped_bytes = sum(c.args[1] for c in p.on_dropped.call_args_list)
+    dropped_chunks = sum(c.args[2] for c in p.on_dropped.call_args_list)
+    assert p.on_dropped.call_args.args[0] == "stdout"
+    assert dropped_bytes > 0
+
+    counters = stats.get_stats()["counters"]
+    assert counters["output.websocket.stdout.dropped_bytes"] == dropped_bytes
+    assert counters["output.websocket.stdout.dropped_chunks"] == dropped_chunks
+    # output still in the pipe when the process exits is neither sent nor
+    # dropped, as reading stops then
+    sent = counters["output.websocket.stdout.sent_bytes"]
+    assert 0 < sent + dropped_bytes <= len("\n".join(map(str, range(1, 100001)))) + 1
+
+
+@pytest.mark.asyncio
+async def test_lossless_output_child_outlives_process():
+    # with pipes, rather than a pty, asyncio's process.wait() itself waits
+    # for the child, which holds them open
+    p = ProcessHandler(user, pty=True, lossless=True)
+
+    p.on_start = AsyncMock()
+    p.on_stop = AsyncMock()
+    output = []
+
+    async def on_output(channel, data):
+        output.append(data)
+
+    p.on_output = on_output
+
+    # a background child keeps writing to the output for 3s after sh exits,
+    # too often for it to go idle
+    child = "(trap '' HUP; for i in $(seq 300); do echo child; sleep 0.01; done) &"
+    with patch("further_link.runner.process_handler.LOSSLESS_DRAIN_TIMEOUT", 1):
+        await p.start(f'sh -c "{child} echo parent"')
+        await p.process.wait()
+        exited = asyncio.get_running_loop().time()
+        while not p.on_stop.called:
+            await asyncio.sleep(0.1)
+
+    # stopped once the drain timed out, without waiting for the child
+    assert asyncio.get_running_loop().time() - exited < 2.5
+    assert "parent" in "".join(output)
+    p.on_stop.assert_called_with(0)
@@ -0,0 +1,244 @@
+import asyncio
+from time import monotonic
+
+import pytest
+
+from further_link.util.async_helpers import RingbufReader, ringbuf_read
+from further_link.util.rate_limit import (
+    ACTIVE_TIME,
+    HEADROOM,
+    BandwidthBudget,
+    BandwidthEstimator,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_consume():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=500, clock=clock)  # 1000 bytes per second
+
+    assert bucket.consume(300) == 300
+    assert bucket.consume(300) == 200  # only the rest of the burst
+    assert bucket.consume(300) == 0
+
+    clock.now = 0.1
+    assert bucket.consume(300) == 100
+
+    clock.now = 10  # never more than the burst
+    assert bucket.consume(1000) == 500
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    assert bucket.unlimited
+    assert bucket.consume(10**9) == 10**9
+    assert bucket.delay(10**9) == 0
+
+
+def test_token_bucket_delay():
+    clock = FakeClock()
+    bucket = TokenBucket(2, burst=1000, clock=clock)
+    bucket.consume(1000)
+
+    assert bucket.delay(500) == pytest.approx(0.25)
+    # requests larger than the burst wait for a full bucket
+    assert bucket.delay(5000) == pytest.approx(0.5)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_acquire_throughput():
+    kBps = 20
+    bucket = TokenBucket(kBps, burst=1000)
+    bucket.consume(1000)  # start empty so the burst isn't counted
+
+    start = monotonic()
+    sent = 0
+    while monotonic() - start < 0.5:
+        await bucket.acquire(256)
+        sent += 256
+    duration = monotonic() - start
+
+    assert sent / duration / 1000 == pytest.approx(kBps, rel=0.1)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_acquire_larger_than_burst():
+    bucket = TokenBucket(10, burst=100)
+    start = monotonic()
+    await bucket.acquire(2000)  # allowed with a full bucket, leaves debt
+    await bucket.acquire(100)  # waits for the debt to be repaid
+    assert monotonic() - start == pytest.approx(0.2, abs=0.05)
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_read_throughput():
+    kBps = 10
+    stream = asyncio.StreamReader()
+    received = 0
+
+    async def on_output(output):
+        nonlocal received
+        received += len(output)
+
+    reader = asyncio.create_task(ringbuf_read(stream, on_output, kBps=kBps))
+
+    # produce several times faster than the limit, in varied chunk sizes,
+    # measuring once the initial burst allowance has been used
+    start = monotonic()
+    sizes = [10, 700, 90, 1500, 3]
+    i = 0
+    measure_start = None
+    while monotonic() - start < 1.3:
+        if measure_start is None and monotonic() - start > 0.3:
+            measure_start = monotonic()
+            measure_received = received
+        stream.feed_data(b"a" * sizes[i % len(sizes)])
+        i += 1
+        await asyncio.sleep(0.005)
+    duration = monotonic() - measure_start
+
+    assert (received - measure_received) / duration / 1000 == pytest.approx(
+        kBps, rel=0.15
+    )
+
+    stream.feed_eof()
+    await reader
+
+
+@pytest.mark.asyncio
+async def test_ringbuf_flush_consumes_bytes_sent():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=6, clock=clock)  # 1000 bytes per second
+    sent = []
+
+    async def on_output(output):
+        sent.append(output)
+
+    reader = RingbufReader(asyncio.StreamReader(), on_output, limiter=bucket)
+    reader.ringbuf.append("🟩🟩", 8)
+
+    # the limit ends inside the second character, whose bytes aren't used
+    await reader._flush()
+    assert sent == ["🟩"]
+    assert bucket.tokens == 2
+
+    clock.now = 0.002
+    await reader._flush()
+    assert sent == ["🟩", "🟩"]
+    assert bucket.tokens == 0
+
+
+def test_bandwidth_budget_single_stream_gets_full_rate():
+    clock = FakeClock()
+    budget = BandwidthBudget(10, clock=clock)
+    stream = budget.stream("1.stdout", "stdout")
+
+    stream.consume(10**6)
+    sent = 0
+    for _ in range(100):
+        clock.now += 0.1
+        sent += stream.consume(10**6)
+
+    assert sent / clock.now == pytest.approx(10000, rel=0.01)
+
+
+def test_bandwidth_budget_weighted_share():
+    clock = FakeClock()
+    budget = BandwidthBudget(10, weights={"stdout": 4, "video": 1}, clock=clock)
+    text = budget.stream("1.stdout", "stdout")
+    video = budget.stream("1.video", "video")
+    other_text = budget.stream("2.stdout", "stdout")
+
+    for stream in (text, video, other_text):
+        stream.consume(10**6)  # all streams are now asking for bandwidth
+
+    for _ in range(100):
+        clock.now += 0.1
+        for stream in (text, video, other_text):
+            stream.consume(10**6)
+
+    total = text.bytes + video.bytes + other_text.bytes
+    assert total / clock.now == pytest.approx(10000, rel=0.02)
+    assert text.bytes == pytest.approx(other_text.bytes, rel=0.02)
+    assert text.bytes / video.bytes == pytest.approx(4, rel=0.05)
+
+    usage = budget.usage()
+    assert usage["streams"]["1.video"]["bytes"] == video.bytes
+    assert usage["channels"]["stdout"] == text.bytes + other_text.bytes
+
+
+def test_bandwidth_budget_idle_share_is_passed_on():
+    clock = FakeClock()
+    budget = BandwidthBudget(10, weights={"stdout": 4, "video": 1}, clock=clock)
+    text = budget.stream("1.stdout", "stdout")
+    video = budget.stream("1.video", "video")
+
+    # text asks once then goes idle, after which video gets the whole rate
+    text.consume(10)
+    video.consume(10**6)
+    clock.now = ACTIVE_TIME
+    video.consume(10**6)
+    sent = 0
+    for _ in range(100):
+        clock.now += 0.1
+        sent += video.consume(10**6)
+
+    assert sent / (clock.now - ACTIVE_TIME) == pytest.approx(10000, rel=0.02)
+
+    text.close()
+    assert "1.stdout" not in budget.usage()["streams"]
+
+
+def test_bandwidth_budget_set_rate():
+    budget = BandwidthBudget(8)
+    budget.set_rate(16)
+    assert budget.rate == 16000
+    assert budget.burst == 3200
+
+
+def test_bandwidth_estimator_slow_link():
+    clock = FakeClock()
+    estimates = []
+    estimator = BandwidthEstimator(128, 2, 1000, estimates.append, clock=clock)
+
+    # a link carrying 4 kBps, so each send waits for the previous one
+    for _ in range(100):
+        clock.now += 0.25
+        estimator.sent(1000, 0.25)
+
+    assert estimator.kBps == pytest.approx(4 * HEADROOM, rel=0.01)
+    assert estimates[-1] == estimator.kBps
+    assert estimates == sorted(estimates, reverse=True)
+
+
+def test_bandwidth_estimator_fast_link():
+    clock = FakeClock()
+    estimator = BandwidthEstimator(128, 2, 1000, clock=clock)
+
+    # sending as fast as the rate allows, and never waiting
+    for _ in range(200):
+        clock.now += 0.1
+        estimator.sent(int(estimator.kBps * 100), 0)
+
+    assert estimator.kBps == 1000
+
+
+def test_bandwidth_estimator_idle():
+    clock = FakeClock()
+    estimator = BandwidthEstimator(128, 2, 1000, clock=clock)
+
+    # sending less than the rate allows says nothing about the link
+    for _ in range(100):
+        clock.now += 0.1
+        estimator.sent(100, 0)
+
+    assert estimator.kBps == 128
+    assert estimator.estimates == 0
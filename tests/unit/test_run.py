@@ -0,0 +1,318 @@
+import asyncio
+import json
+from time import monotonic
+
+import pytest
+
+from further_link.endpoint.run import Observer, RunManager
+from further_link.util import stats
+from further_link.util.connection_types import ConnectionType
+from further_link.util.message import create_message, parse_message
+from further_link.util.rate_limit import HEADROOM
+
+
+@pytest.mark.asyncio
+async def test_run_manager_batch():
+    frames = []
+
+    async def send_func(frame):
+        frames.append(frame)
+        await asyncio.sleep(0.01)
+
+    run_manager = RunManager(send_func, "client", batch=True)
+    outputs = [{"output": str(i)} for i in range(3)]
+    messages = [create_message("stdout", "client", o, "1") for o in outputs]
+
+    # sent in the same tick, so in one batch
+    await asyncio.gather(*(run_manager.send("stdout", o, "1") for o in outputs))
+    await run_manager.send_queue.join()
+    assert len(frames) == 1
+    m_type, m_data, _, m_client = parse_message(frames[0])
+    assert m_type == "batch"
+    assert m_client == "client"
+    assert m_data["messages"] == [json.loads(m) for m in messages]
+
+    # a message on its own is sent as it is
+    await run_manager.send("stdout", outputs[0], "1")
+    await run_manager.send_queue.join()
+    assert frames[1] == messages[0]
+
+    # messages sent while a batch is being sent join the next batch, in order
+    await run_manager.send("stdout", outputs[0], "1")
+    await asyncio.sleep(0.005)
+    await run_manager.send("stdout", outputs[1], "1")
+    await run_manager.send("stdout", outputs[2], "1")
+    await run_manager.send_queue.join()
+    assert frames[2] == messages[0]
+    assert parse_message(frames[3])[1]["messages"] == [
+        json.loads(m) for m in messages[1:]
+    ]
+
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_message_stats():
+    frames = []
+
+    async def send_func(frame):
+        frames.append(frame)
+
+    run_manager = RunManager(send_func, "client", batch=True)
+    await asyncio.gather(*(run_manager.send("pong") for _ in range(4)))
+    await run_manager.send_queue.join()
+    await run_manager.send("pong")
+    await run_manager.send_queue.join()
+
+    connection = stats.get_stats()["connections"][run_manager.id]
+    assert connection["batch"]
+    assert connection["messages"] == 5
+    assert connection["frames"] == 2
+    assert connection["bytes"] == sum(len(f) for f in frames)
+    assert connection["bytes_per_message"] == connection["bytes"] / 5
+    assert connection["queue"]["control"]["sent"] == 5
+    assert connection["queue"]["control"]["depth"] == 0
+
+    await run_manager.stop()
+    assert run_manager.id not in stats.get_stats()["connections"]
+
+
+@pytest.mark.asyncio
+async def test_run_manager_resume_numbers_sent_order():
+    frames = []
+    sends = asyncio.Semaphore(0)
+    connected = True
+
+    async def send_func(frame):
+        await sends.acquire()
+        if connected:
+            frames.append(frame)
+
+    run_manager = RunManager(send_func, "client", resume_grace=60)
+    await run_manager.send("stdout", {"output": "a"}, "1")
+    await asyncio.sleep(0)  # being sent
+    await run_manager.send("stdout", {"output": "b"}, "2")
+    await run_manager.send("error", {"message": "oops"})  # overtakes b
+    await run_manager.send("stdout", {"output": "c"}, "2")
+
+    # the client receives a and the error, then disconnects
+    sends.release()
+    sends.release()
+    while len(frames) < 2:
+        await asyncio.sleep(0)
+    assert [parse_message(f)[0] for f in frames] == ["stdout", "error"]
+    connected = False
+    for _ in range(2):
+        sends.release()
+    run_manager.detach(run_manager.stop)
+    await run_manager.send_queue.join()
+
+    resumed_frames = []
+
+    async def resumed_send_func(frame):
+        resumed_frames.append(frame)
+
+    await run_manager.resume(resumed_send_func, 2)
+    await run_manager.send_queue.join()
+    assert [parse_message(f)[:2] for f in resumed_frames] == [
+        ("resumed", {"seq": 3}),
+        ("stdout", {"output": "b"}),
+        ("stdout", {"output": "c"}),
+    ]
+
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_observers():
+    owner_frames = []
+    observer_frames = []
+    closed = []
+
+    async def send_func(frame):
+        owner_frames.append(frame)
+
+    async def observer_send_func(frame):
+        observer_frames.append(frame)
+
+    async def stalled_send_func(frame):
+        await asyncio.Event().wait()
+
+    async def close_func():
+        closed.append(True)
+
+    run_manager = RunManager(send_func, "client")
+    run_manager.process_handlers["1"] = None  # a running process
+    observer = Observer(observer_send_func, close_func)
+    stalled_observer = Observer(stalled_send_func, close_func)
+    assert run_manager.add_observer("1", observer)
+    assert run_manager.add_observer("1", stalled_observer)
+    assert not run_manager.add_observer("2", Observer(observer_send_func, close_func))
+
+    await run_manager.send("pong")  # not a message of the process
+    # more than the stalled observer's queue can hold
+    output = {"output": "x" * 1000}
+    for _ in range(2000):
+        await run_manager.send("stdout", output, "1")
+    await run_manager.send_queue.join()
+    await observer.send_queue.join()
+
+    assert len(owner_frames) == 2001
+    assert len(observer_frames) == 2000
+    # encoded once for the owner and observers
+    assert all(o is f for o, f in zip(observer_frames, owner_frames[1:]))
+    observer_stats, stalled_stats = run_manager.message_stats()["observers"]
+    assert observer_stats["text"]["dropped"] == 0
+    assert stalled_stats["text"]["dropped"] > 0
+
+    run_manager.remove_observer("1", observer)
+    del run_manager.process_handlers["1"]
+    await run_manager.stop()
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_run_manager_stalled_observer():
+    closed = []
+
+    async def send_func(frame):
+        pass
+
+    async def stalled_send_func(frame):
+        await asyncio.Event().wait()
+
+    async def close_func():
+        closed.append(True)
+
+    run_manager = RunManager(send_func, "client")
+    run_manager.process_handlers["1"] = None
+    observer = Observer(stalled_send_func, close_func)
+    run_manager.add_observer("1", observer)
+
+    # the echo of the owner's input is dropped once the queue is full
+    run_manager._input_times["1"] = monotonic()
+    output = {"output": "x" * 200}
+    limit = observer.send_queue.limit_bytes
+    for _ in range(limit // 200 + 100):
+        await run_manager.send("stdout", output, "1")
+    assert observer.send_queue.bytes <= limit
+    assert observer.send_queue.stats()["echo"]["dropped"] > 0
+    assert not closed
+
+    # then messages which aren't dropped disconnect it
+    for _ in range(10):
+        await run_manager.send("novnc", {"port": 1, "path": "x" * 100}, "1")
+    await asyncio.sleep(1.5)  # the stalled send is given up on
+    assert closed == [True]
+    assert len(observer.send_queue) == 0
+
+    run_manager.remove_observer("1", observer)
+    del run_manager.process_handlers["1"]
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_observers_receive_json():
+    observer_frames = []
+
+    async def send_func(frame):
+        pass
+
+    async def observer_send_func(frame):
+        observer_frames.append(frame)
+
+    async def close_func():
+        pass
+
+    run_manager = RunManager(send_func, "client", binary=True)
+    run_manager.process_handlers["1"] = None
+    observer = Observer(observer_send_func, close_func)
+    run_manager.add_observer("1", observer)
+
+    await run_manager.send("stdout", {"output": "hi"}, "1")
+    await observer.send_queue.join()
+    assert observer_frames == [
+        create_message("stdout", "client", {"output": "hi"}, "1")
+    ]
+
+    del run_manager.process_handlers["1"]
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_message_callbacks():
+    frames = []
+    received = []
+
+    async def send_func(frame):
+        frames.append(frame)
+
+    async def on_hello(data, process_id):
+        received.append((data, process_id))
+
+    stats.reset_stats()
+    run_manager = RunManager(send_func, "client")
+    run_manager.set_message_callback(
+        "hello", on_hello, lambda data, process_id: isinstance(data.get("name"), str)
+    )
+
+    await run_manager.handle_message(create_message("hello", "client", {"name": "a"}))
+    await run_manager.handle_message(create_message("hello", "client", {"name": 1}))
+    await run_manager.handle_message(create_message("ping", "client"))
+    await run_manager.handle_message(create_message("nonsense", "client"))
+    await run_manager.send_queue.join()
+
+    assert received == [({"name": "a"}, "")]
+    assert [parse_message(f)[0] for f in frames] == ["error", "pong", "error"]
+
+    histograms = stats.get_stats()["histograms"]
+    assert histograms["message.websocket.hello"]["count"] == 2
+    assert histograms["message.websocket.ping"]["count"] == 1
+    assert histograms["message.websocket.unknown"]["count"] == 1
+    assert "message.websocket.nonsense" not in histograms
+    assert sum(histograms["message.websocket.hello"]["buckets_ms"].values()) == 2
+
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_bandwidth_estimate():
+    link_kBps = 40
+
+    async def slow_send_func(frame):
+        await asyncio.sleep(len(frame) / link_kBps / 1000)
+
+    run_manager = RunManager(slow_send_func, "client")
+    assert run_manager.bandwidth_budget.rate == 128000
+
+    output = {"output": "x" * 4000}
+    start = monotonic()
+    while monotonic() - start < 2:
+        await run_manager.send("stdout", output, "1")
+
+    # the rate drops towards the link's, from the initial guess
+    kBps = run_manager.message_stats()["bandwidth"]["kBps"]
+    assert run_manager.bandwidth_budget.rate == kBps * 1000
+    assert link_kBps * HEADROOM * 0.8 < kBps < 70
+
+    await run_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_manager_bluetooth_bandwidth_not_estimated():
+    async def send_func(frame):
+        pass
+
+    run_manager = RunManager(
+        send_func, "client", connection_type=ConnectionType.BLUETOOTH
+    )
+    assert run_manager.bandwidth_estimator is None
+
+    output = {"output": "x" * 4000}
+    start = monotonic()
+    while monotonic() - start < 1:
+        await run_manager.send("stdout", output, "1")
+    assert run_manager.bandwidth_budget.rate == 8000
+    assert run_manager.message_stats()["bandwidth"]["kBps"] == 8
+
+    await run_manager.stop()
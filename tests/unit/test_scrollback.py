@@ -0,0 +1,21 @@
+from further_link.util.scrollback import Scrollback
+
+
+def test_scrollback():
+    scrollback = Scrollback(10)
+    assert scrollback.since(0) == (1, [])
+
+    assert scrollback.append("a", 4) == 1
+    assert scrollback.append("b", 4) == 2
+    assert scrollback.since(0) == (1, ["a", "b"])
+    assert scrollback.since(1) == (2, ["b"])
+    assert scrollback.since(2) == (3, [])
+
+    # the oldest are forgotten
+    assert scrollback.append("c", 4) == 3
+    assert scrollback.since(0) == (2, ["b", "c"])
+    assert scrollback.bytes == 8
+
+    # the latest is kept even when over the limit
+    scrollback.append("d", 20)
+    assert scrollback.since(0) == (4, ["d"])
@@ -0,0 +1,97 @@
+import asyncio
+import gc
+import logging
+from unittest.mock import patch
+
+import pytest
+from mock import AsyncMock
+
+from further_link.util.sdk import DisplayUserTracker, async_get_user_using_display
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    x11 = tmp_path / ".X11-unix"
+    x11.mkdir()
+    utmp = tmp_path / "utmp"
+    utmp.write_bytes(b"")
+    tracker = DisplayUserTracker()
+    tracker.paths = (str(x11), str(utmp))
+    return tracker
+
+
+@pytest.mark.asyncio
+async def test_display_user_tracker(tracker):
+    utmp = tracker.paths[1]
+    with patch(
+        "further_link.util.sdk.async_get_user_using_display",
+        AsyncMock(return_value="pi"),
+    ) as resolve, patch("further_link.util.sdk.get_first_display", lambda: ":0"):
+        assert await tracker.get_user() == "pi"
+        assert tracker.user() == "pi"
+        assert await tracker.get_user() == "pi"
+        assert resolve.call_count == 1
+
+        # a new login session is resolved in the background
+        resolve.return_value = "other"
+        with open(utmp, "wb") as file:
+            file.write(b"session")
+        assert tracker.user() == "pi"
+        await asyncio.sleep(0)
+        assert tracker.user() == "other"
+        assert resolve.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_display_user_tracker_who_fails(tracker, caplog):
+    utmp = tracker.paths[1]
+    unhandled = []
+    asyncio.get_running_loop().set_exception_handler(
+        lambda loop, context: unhandled.append(context)
+    )
+    with patch(
+        "further_link.util.sdk.async_get_user_using_display",
+        AsyncMock(return_value="pi"),
+    ) as resolve, patch("further_link.util.sdk.get_first_display", lambda: ":0"):
+        assert await tracker.get_user() == "pi"
+
+        # failing in the background keeps the user last resolved
+        resolve.side_effect = RuntimeError("who failed")
+        with open(utmp, "wb") as file:
+            file.write(b"session")
+        with caplog.at_level(logging.ERROR):
+            assert tracker.user() == "pi"
+            # the refresh, then its done callback
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        assert "Error resolving the user of the display" in caplog.text
+        assert resolve.call_count == 2
+
+        # and is tried again
+        resolve.side_effect = None
+        resolve.return_value = "other"
+        assert tracker.user() == "pi"
+        await asyncio.sleep(0)
+        assert tracker.user() == "other"
+        assert resolve.call_count == 3
+
+    gc.collect()
+    assert unhandled == []
+
+
+def test_display_user_tracker_off_loop(tracker):
+    with patch(
+        "further_link.util.sdk.get_user_using_display", return_value="pi"
+    ) as resolve:
+        assert tracker.user() == "pi"
+        assert tracker.user() == "pi"
+        assert resolve.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_async_get_user_using_display():
+    who = b"pi       tty7         2024-01-01 10:00 (:0)\n"
+    with patch("asyncio.create_subprocess_exec") as create:
+        create.return_value.communicate = AsyncMock(return_value=(who, b""))
+        assert await async_get_user_using_display(":0") == "pi"
+        assert await async_get_user_using_display(":1") is None
@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+
+from further_link.util.send_queue import Priority, SendQueue
+
+
+class Client:
+    """Receives delivered messages, only while not paused."""
+
+    def __init__(self):
+        self.messages = []
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+
+    async def deliver(self, messages):
+        await self.resumed.wait()
+        self.messages.append(messages)
+
+
+@pytest.mark.asyncio
+async def test_send_queue_priority():
+    client = Client()
+    client.resumed.clear()
+    queue = SendQueue(client.deliver, 2**20)
+
+    await queue.put("blocking", Priority.TEXT)
+    await asyncio.sleep(0)  # being delivered
+    await queue.put("video", Priority.VIDEO)
+    await queue.put("text", Priority.TEXT)
+    await queue.put("echo", Priority.ECHO)
+    await queue.put("pong", Priority.CONTROL)
+    client.resumed.set()
+    await queue.join()
+
+    assert client.messages == [["blocking"], ["pong"], ["echo"], ["text"], ["video"]]
+    stats = queue.stats()
+    assert stats["bytes"] == 0
+    assert stats["text"]["sent"] == 2
+    assert stats["text"]["max_depth"] == 1
+    assert stats["control"]["wait_max_ms"] < stats["video"]["wait_max_ms"]
+
+
+@pytest.mark.asyncio
+async def test_send_queue_stream_order():
+    client = Client()
+    client.resumed.clear()
+    queue = SendQueue(client.deliver, 2**20)
+
+    await queue.put("blocking", Priority.CONTROL)
+    await asyncio.sleep(0)
+    await queue.put("output", Priority.TEXT, ("1", "stdout"))
+    # echo and stopped don't overtake output already queued for the process
+    await queue.put("echo", Priority.ECHO, ("1", "stdout"))
+    await queue.put("stopped", Priority.CONTROL, ("1", None))
+    await queue.put("other echo", Priority.ECHO, ("2", "stdout"))
+    await queue.put("pong", Priority.CONTROL)
+    client.resumed.set()
+    await queue.join()
+
+    assert [m for [m] in client.messages] == [
+        "blocking",
+        "pong",
+        "other echo",
+        "output",
+        "echo",
+        "stopped",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_send_queue_text_waits_for_room():
+    client = Client()
+    client.resumed.clear()
+    queue = SendQueue(client.deliver, 10)
+
+    await queue.put("x" * 8, Priority.TEXT)
+    producer = asyncio.ensure_future(queue.put("y" * 8, Priority.TEXT))
+    await asyncio.sleep(0.01)
+    assert not producer.done()
+
+    # control messages are queued over the limit
+    await queue.put("pong", Priority.CONTROL)
+    assert queue.bytes == 12
+
+    client.resumed.set()
+    await producer
+    await queue.join()
+    assert client.messages == [["x" * 8], ["pong"], ["y" * 8]]
+
+
+@pytest.mark.asyncio
+async def test_send_queue_video_latest():
+    client = Client()
+    client.resumed.clear()
+    queue = SendQueue(client.deliver, 21)
+
+    await queue.put("frame 0", Priority.VIDEO, ("1", "video"))
+    await asyncio.sleep(0)
+    await queue.put("frame 1", Priority.VIDEO, ("1", "video"))
+    await queue.put("frame 2", Priority.VIDEO, ("1", "video"))
+    await queue.put("frame a", Priority.VIDEO, ("2", "video"))
+    # over the limit
+    await queue.put("frame b", Priority.VIDEO, ("3", "video"))
+    client.resumed.set()
+    await queue.join()
+
+    assert client.messages == [["frame 0"], ["frame 2"], ["frame a"]]
+    assert queue.stats()["video"]["dropped"] == 2
+
+
+@pytest.mark.asyncio
+async def test_send_queue_batch():
+    client = Client()
+    queue = SendQueue(client.deliver, 2**20, batch=True, batch_bytes=10)
+
+    await queue.put("video", Priority.VIDEO)
+    await queue.put("text", Priority.TEXT)
+    await queue.put("pong", Priority.CONTROL)
+    await queue.put("more", Priority.TEXT)
+    await queue.join()
+
+    assert client.messages == [["pong", "text"], ["more", "video"]]
+
+
+@pytest.mark.asyncio
+async def test_send_queue_close():
+    client = Client()
+    client.resumed.clear()
+    queue = SendQueue(client.deliver, 10)
+
+    await queue.put("x" * 10, Priority.TEXT)
+    producer = asyncio.ensure_future(queue.put("y", Priority.TEXT))
+    await queue.close(timeout=0.01)
+    await producer
+    await queue.put("pong", Priority.CONTROL)
+    assert client.messages == []
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_send_queue_records():
+    client = Client()
+    client.resumed.clear()
+    delivered = []
+    queue = SendQueue(
+        client.deliver,
+        2**20,
+        on_delivered=lambda record, size: delivered.append((record, size)),
+    )
+
+    await queue.put("blocking", Priority.TEXT, record=1)
+    await asyncio.sleep(0)  # being delivered
+    await queue.put("text", Priority.TEXT, record=2)
+    await queue.put("pong", Priority.CONTROL)
+    await queue.put("error", Priority.CONTROL, record=3)
+    client.resumed.set()
+    await queue.join()
+    # in the order delivered, rather than queued
+    assert delivered == [(1, 8), (3, 5), (2, 4)]
+
+    # the records of cleared messages are returned instead
+    client.resumed.clear()
+    await queue.put("blocking", Priority.TEXT, record=4)
+    await asyncio.sleep(0)
+    await queue.put("text", Priority.TEXT, record=5)
+    await queue.put("error", Priority.CONTROL, record=6)
+    assert queue.clear() == [(6, 5), (5, 4)]
+    client.resumed.set()
+    await queue.join()
+    assert delivered[3:] == [(4, 8)]
@@ -0,0 +1,101 @@
+import os
+import tty
+from pty import openpty
+
+import pytest
+
+from further_link.util.terminal import PtyStream, compact_output
+
+
+@pytest.mark.asyncio
+async def test_pty_stream_read_write():
+    master, slave = openpty()
+    tty.setraw(slave)  # no echo or line processing
+    stream = PtyStream(master)
+
+    os.write(slave, b"hello")
+    assert await stream.read(256) == b"hello"
+
+    await stream.write(b"world")
+    assert os.read(slave, 256) == b"world"
+
+    stream.close()
+    os.close(slave)
+
+
+@pytest.mark.asyncio
+async def test_pty_stream_eof_when_slave_closed():
+    master, slave = openpty()
+    tty.setraw(slave)
+    stream = PtyStream(master)
+
+    os.write(slave, b"bye")
+    assert await stream.read(256) == b"bye"
+
+    os.close(slave)
+    assert await stream.read(256) == b""
+    assert stream.at_eof()
+
+    stream.close()
+
+
+@pytest.mark.asyncio
+async def test_pty_stream_pauses_when_buffer_full():
+    master, slave = openpty()
+    tty.setraw(slave)
+    stream = PtyStream(master, limit=4)
+
+    os.write(slave, b"abcdefgh")
+    assert await stream.read(2) == b"ab"
+    received = b"ab"
+    while len(received) < 8:
+        received += await stream.read(2)
+    assert received == b"abcdefgh"
+
+    stream.close()
+    os.close(slave)
+
+
+def test_compact_output_progress_bar():
+    frames = "".join(f"\r[{'#' * (i // 10):<10}] {i:3d}%" for i in range(101))
+    assert compact_output(frames) == "\r[##########] 100%"
+
+
+def test_compact_output_keeps_visible_text():
+    # narrower redraws leave the end of wider ones visible
+    assert compact_output("\rhello\rhi") == "\rhello\rhi"
+    assert compact_output("\rhello\rhi\rbye!") == "\rhello\rbye!"
+    # text before the first carriage return may not start at the line start
+    assert compact_output("a\rb") == "a\rb"
+    # erasing the line overwrites any width, but is only overwritten by erasing
+    assert compact_output("\rwide one\r\x1b[2Kx\rab") == "\r\x1b[2Kx\rab"
+    # cursor movement stops compaction across it
+    assert compact_output("\r1%\r2%\x1b[1A\r3%\r4%") == "\r1%\r2%\x1b[1A\r4%"
+    # wider than the terminal may wrap
+    assert compact_output("\r1234\r5678", columns=3) == "\r1234\r5678"
+    assert compact_output("line\n") == "line\n"
+
+
+def test_compact_output_keeps_colours():
+    frames = "\r\x1b[32mabc\x1b[0m\r\x1b[32mabd\x1b[0m\r\x1b[31mabe"
+    assert compact_output(frames) == "\r\x1b[0m\x1b[31mabe"
+    # colours set by a dropped redraw still apply
+    assert compact_output("\r\x1b[31mab\rcd") == "\r\x1b[31mcd"
+    # a run of sequences undone before anything is drawn
+    assert compact_output("\x1b[1m\x1b[31m\x1b[0mx\x1b[?25l\x1b[?25h") == (
+        "\x1b[0mx\x1b[?25h"
+    )
+
+
+def test_compact_output_same_display():
+    frames = "".join(
+        f"\r\x1b[2K\x1b[34m{'🟩' * (i // 10)}\x1b[0m {i}%\x1b[?25l" for i in range(101)
+    )
+    compacted = compact_output(frames)
+    # states carried from dropped redraws come before the erase, which fills
+    # the line with the background colour at the time
+    assert compacted == (
+        "\r\x1b[0m\x1b[?25l\x1b[2K\x1b[34m" + "🟩" * 10 + "\x1b[0m 100%\x1b[?25l"
+    )
+    # compacting already compacted output with more redraws
+    assert compact_output(compacted + frames) == compact_output(frames + frames)
@@ -0,0 +1,57 @@
+import getpass
+import grp
+import os
+import pwd
+from unittest.mock import patch
+
+from further_link.util.user_config import IdentityCache, get_grp_ids
+
+user = getpass.getuser()
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def test_identity_cache(tmp_path):
+    passwd = tmp_path / "passwd"
+    passwd.write_text("root:x:0:0::/root:/bin/sh\n")
+    clock = Clock()
+    identities = IdentityCache(files=(str(passwd),), clock=clock)
+
+    with patch("pwd.getpwnam", wraps=pwd.getpwnam) as getpwnam:
+        assert identities.passwd(user).pw_name == user
+        assert identities.passwd(user).pw_name == user
+        assert identities.passwd("not-a-user") is None
+        assert identities.passwd("not-a-user") is None
+        assert identities.passwd(None) is None
+        assert getpwnam.call_count == 2
+
+        # looked up again once the file has changed and been checked
+        passwd.write_text("root:x:0:0::/root:/bin/bash\n")
+        identities.passwd(user)
+        assert getpwnam.call_count == 2
+        clock.time = 1
+        identities.passwd(user)
+        assert getpwnam.call_count == 3
+
+        # and after the max age when it hasn't
+        clock.time = 302
+        identities.passwd(user)
+        assert getpwnam.call_count == 4
+
+
+def test_grp_ids():
+    gid = pwd.getpwnam(user).pw_gid
+    members = {g.gr_gid for g in grp.getgrall() if user in g.gr_mem}
+
+    with patch("os.getgrouplist", wraps=os.getgrouplist) as getgrouplist:
+        assert set(get_grp_ids(user)) == members | {gid}
+        get_grp_ids(user)
+        assert getgrouplist.call_count <= 1
+
+    assert get_grp_ids("not-a-user") is None
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from further_link.util import stats
+from further_link.util.watchdog import Watchdog, get_watchdog
+
+
+@pytest.mark.asyncio
+async def test_watchdog():
+    watchdog = Watchdog(asyncio.get_running_loop())
+    expired = []
+
+    def callback(key):
+        async def on_expired():
+            expired.append(key)
+
+        return on_expired
+
+    watchdog.start("a", 0.2, callback("a"))
+    watchdog.start("b", 0.15, callback("b"))
+    watchdog.start("c", 0.05, callback("c"))
+    watchdog.stop("c")
+    assert watchdog.stats() == {"live": 2, "expired": 0}
+
+    # restarting keeps a deadline from expiring
+    for _ in range(4):
+        await asyncio.sleep(0.05)
+        watchdog.restart("a")
+    assert expired == ["b"]
+
+    await asyncio.sleep(0.3)
+    assert expired == ["b", "a"]
+    assert watchdog.stats() == {"live": 0, "expired": 2}
+
+    # restarting after expiring does nothing
+    watchdog.restart("a")
+    assert len(watchdog) == 0
+
+
+@pytest.mark.asyncio
+async def test_watchdog_shorter_timeout():
+    watchdog = Watchdog(asyncio.get_running_loop())
+    expired = []
+
+    async def on_expired():
+        expired.append(True)
+
+    watchdog.start("a", 10, on_expired)
+    watchdog.start("a", 0.01, on_expired)
+    await asyncio.sleep(0.05)
+    assert expired == [True]
+
+
+@pytest.mark.asyncio
+async def test_get_watchdog():
+    watchdog = get_watchdog()
+    assert get_watchdog() is watchdog
+
+    async def on_expired():
+        pass
+
+    watchdog.start("a", 10, on_expired)
+    assert stats.get_stats()["gauges"]["watchdog.live"] == 1
+    watchdog.stop("a")